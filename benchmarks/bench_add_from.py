@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+# Benchmark for bulk job submission -- jobs/sec of one `hatc --add-from`
+# vs. a loop of `hatc -a` calls. Needs a running daemon; the jobs are
+# added for the invoking user, 24 hours from now.
+# Usage: python3 benchmarks/bench_add_from.py [jobs]
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CLIENT = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat', 'client.py')
+
+
+def hatc(*args, **kwargs):
+    subprocess.run([sys.executable, CLIENT, *args], check=True,
+                   stdout=subprocess.DEVNULL, **kwargs)
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    # The loop is slow, so it's timed over fewer jobs
+    loop_jobs = min(jobs, 100)
+    started = time.perf_counter()
+    for i in range(loop_jobs):
+        hatc('-a', 'echo {}'.format(i), 'now + 24 hours')
+    loop_rate = loop_jobs / (time.perf_counter() - started)
+
+    with tempfile.NamedTemporaryFile('wt', suffix='.tsv') as f:
+        for i in range(jobs):
+            f.write('echo {}\tnow + 24 hours\n'.format(i))
+        f.flush()
+        started = time.perf_counter()
+        hatc('--add-from', f.name)
+        bulk_rate = jobs / (time.perf_counter() - started)
+
+    print('hatc -a loop: {:.0f} jobs/s | hatc --add-from ({} jobs): '
+          '{:.0f} jobs/s'.format(loop_rate, jobs, bulk_rate))
+
+
+if __name__ == '__main__':
+    main()
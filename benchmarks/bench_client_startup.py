@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+# Benchmark for the cold start of the client -- wall time of whole
+# `hatc -c` runs (interpreter start, imports, liveness check, request),
+# next to a bare interpreter start. A different client file can be
+# given to compare e.g. an older version. Needs a running daemon.
+# Usage: python3 benchmarks/bench_client_startup.py [runs] [client_file]
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def run_times(command, runs):
+    '''Returns the wall times (secs) of `runs` runs of `command`.'''
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - started)
+    return sorted(times)
+
+
+def report(name, times):
+    print('{:<16} median {:7.1f} ms | p90 {:7.1f} ms'.format(
+        name, statistics.median(times) * 1000,
+        times[int(len(times) * 0.9)] * 1000))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    client_file = sys.argv[2] if len(sys.argv) > 2 else os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'hat', 'client.py')
+    report('python3 -c pass', run_times([sys.executable, '-c', 'pass'], runs))
+    report('hatc -c', run_times([sys.executable, client_file, '-c'], runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Benchmark for concurrent clients -- requests per sec through the
+# daemon socket, with each client checking that it got its own reply.
+# Needs a running daemon.
+# Usage: python3 benchmarks/bench_clients.py [clients] [requests_per_client]
+
+import os
+import sys
+import threading
+import time
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+import client
+
+
+def call(content):
+    data = client.SendReceiveData(content)
+    data.check_get_send()
+    return data.receive_from_daemon()
+
+
+def worker(requests, errors):
+    for _ in range(requests):
+        # Stats come as a dict, a joblist as a page of jobs
+        if 'max_workers' not in call(('stats',)) or \
+           'jobs' not in call(('joblist',)):
+            errors.append(1)
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    errors = []
+    threads = [threading.Thread(target=worker, args=(requests, errors))
+               for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    secs = time.perf_counter() - started
+    total = clients * requests * 2
+    print('{} clients, {} requests: {:.0f} req/s, {} mismatched replies'
+          .format(clients, total, total / secs, len(errors)))
+
+
+if __name__ == '__main__':
+    main()
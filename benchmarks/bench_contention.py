@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# Benchmark for contention -- p50/p99 latency with 50 concurrent
+# processes: appending log lines with the old sleep-polling FLock vs.
+# a blocking FLock vs. no lock (single O_APPEND write), then, with a
+# running daemon, `hatc` requests through the daemon socket.
+# Usage: python3 benchmarks/bench_contention.py [processes] [calls_each]
+
+import datetime
+import fcntl
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+import client
+from lib.utils import LOCK_DIR, FLock, write_file
+
+
+class PollingFLock(FLock):
+    '''FLock as it was: retrying every 0.5 secs.'''
+    def __enter__(self):
+        self.lockf = open(self.lockfile, 'w')
+        while True:
+            try:
+                fcntl.lockf(self.lockf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                time.sleep(0.5)
+                continue
+            return self.lockf
+
+
+def polling_write(file_path, content):
+    '''`write_file` as it was, for appends.'''
+    with PollingFLock('{}/write_{}'.format(file_path,
+                                           file_path.replace('/', '_'))):
+        with open(file_path, 'at') as f:
+            f.write('{} : {}\n'.format(
+                datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                content))
+
+
+def blocking_write(file_path, content):
+    write_file(file_path, content, mode='at', lock=True)
+
+
+def unlocked_write(file_path, content):
+    write_file(file_path, content, mode='at')
+
+
+def request(_, content):
+    data = client.SendReceiveData(content)
+    data.check_get_send()
+    return data.receive_from_daemon()
+
+
+def worker(call, target, calls, start, latencies):
+    while time.time() < start:
+        time.sleep(0.001)
+    taken = []
+    for i in range(calls):
+        started = time.perf_counter()
+        call(target, ('stats',) if call is request else 'line {}'.format(i))
+        taken.append(time.perf_counter() - started)
+    latencies.extend(taken)
+
+
+def measure(call, target, processes, calls):
+    '''Returns the latencies (secs) of all calls, made by
+    `processes` processes starting at once.
+    '''
+    with multiprocessing.Manager() as manager:
+        latencies = manager.list()
+        start = time.time() + 0.5
+        procs = [multiprocessing.Process(
+            target=worker, args=(call, target, calls, start, latencies))
+            for _ in range(processes)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        return sorted(latencies)
+
+
+def report(name, latencies):
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print('{:<18} p50 {:8.2f} ms | p99 {:8.2f} ms | max {:8.2f} ms'.format(
+        name, statistics.median(latencies) * 1000, p99 * 1000,
+        latencies[-1] * 1000))
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    print('{} processes, {} calls each'.format(processes, calls))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_file = os.path.join(tmp_dir, 'daemon.log')
+        for name, call in (('polling FLock', polling_write),
+                           ('blocking FLock', blocking_write),
+                           ('no lock (append)', unlocked_write)):
+            report(name, measure(call, log_file, processes, calls))
+    if os.path.exists(client.SOCKET_FILE):
+        report('hatc -s', measure(request, None, processes, calls))
+    else:
+        print('Daemon is not running, skipping the hatc requests')
+
+
+if __name__ == '__main__':
+    main()
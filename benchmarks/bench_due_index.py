@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Benchmark for the runner tick -- cost of finding the due jobs,
+# with the due index vs. the old scan over all enqueued jobs.
+# Usage: python3 benchmarks/bench_due_index.py [max_jobs]
+
+import os
+import sys
+import time
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib import scheduler
+from lib.jobrecord import JobRecord
+
+
+def full_scan(current_time):
+    '''The old way: looking at every job of every user.'''
+    due = []
+    for euid, job_dict in scheduler.get_enqueued_jobs(-1).items():
+        for job_id, job in job_dict.items():
+            if job.job_run_at <= current_time:
+                due.append((euid, job_id, job))
+    return due
+
+
+def fill(count, start):
+    '''Enqueues `count` jobs for 100 users, none due before `start`.'''
+    scheduler.enqueued_jobs.clear()
+    scheduler._rebuild_index()
+    # All in memory, however far: nothing goes to the host's cold tier
+    for i in range(count):
+        scheduler._store_job(1000 + i % 100, i // 100 + 1,
+                             JobRecord('true', start + i), hot=True)
+
+
+def time_ticks(tick, current_time, ticks):
+    '''Returns the mean time (in microseconds) of a tick.'''
+    started = time.perf_counter()
+    for _ in range(ticks):
+        tick(current_time)
+    return (time.perf_counter() - started) / ticks * 1e6
+
+
+def main():
+    max_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6
+    now = int(time.time())
+    print('{:>10}  {:>14}  {:>14}'.format('jobs', 'index (us)', 'scan (us)'))
+    count = 10
+    while count <= max_jobs:
+        fill(count, now + 3600)
+        index_us = time_ticks(
+            lambda t: (scheduler.next_run_at(), scheduler.pop_due_jobs(t)),
+            now, 1000)
+        scan_us = time_ticks(full_scan, now, 1 if count >= 10 ** 5 else 10)
+        print('{:>10}  {:>14.2f}  {:>14.2f}'.format(count, index_us, scan_us))
+        count *= 10
+
+
+if __name__ == '__main__':
+    main()
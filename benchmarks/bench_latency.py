@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+# Benchmark for request latency -- one client sending requests one
+# after another over one connection, p50/p99 of the round trip through
+# the daemon (and its runner). Compare a daemon started with
+# `single_process = yes` in /etc/hatd/hatd.conf against the default.
+# Needs a running daemon.
+# Usage: python3 benchmarks/bench_latency.py [requests]
+
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+import client
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(client.SOCKET_FILE)
+    request = '{}\n'.format(json.dumps({'stats': True})).encode('utf-8')
+    latencies = []
+    with conn, conn.makefile('rb') as f:
+        for _ in range(requests):
+            started = time.perf_counter()
+            conn.sendall(request)
+            f.readline()
+            latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    print('{} requests: p50 {:.3f} ms | p99 {:.3f} ms'.format(
+        requests, statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000))
+
+
+if __name__ == '__main__':
+    main()
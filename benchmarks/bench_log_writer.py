@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Benchmark for log writing -- records/s of `write_file` appends made
+# directly (a open/write/close each) against those taken by the log
+# writer thread (buffered, one write per file per flush), spread over
+# a few files like the daemon's log and some users' job logs.
+# Usage: python3 benchmarks/bench_log_writer.py [records] [files]
+
+import os
+import sys
+import tempfile
+import time
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib.logwriter import start_log_writer, stop_log_writer
+from lib.utils import write_file
+
+
+def run(log_files, records, buffered):
+    '''Returns the secs taken to append `records` records, till
+    they are all on disk.
+    '''
+    started = time.perf_counter()
+    if buffered:
+        start_log_writer()
+    for i in range(records):
+        write_file(log_files[i % len(log_files)],
+                   'id>{} : Removal failed: No such job'.format(i),
+                   mode='at')
+    if buffered:
+        stop_log_writer()
+    return time.perf_counter() - started
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_files = [os.path.join(tmp_dir, str(i), 'daemon.log')
+                     for i in range(files)]
+        for name, buffered in (('direct', False), ('log writer', True)):
+            secs = run(log_files, records, buffered)
+            print('{:<12} {:>9.0f} records/s'.format(name, records / secs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# Benchmark for the memory taken by enqueued jobs -- bytes per job
+# with `JobRecord`s vs. the old dict per job, for jobs submitted by
+# a script (a few distinct commands, each sent thousands of times).
+# Usage: python3 benchmarks/bench_memory.py [job_count]
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib.jobrecord import JobRecord
+
+
+def submissions(count, start):
+    '''Yields the jobs as decoded from the clients' JSON, so that
+    each job gets its own copy of the command, as in the daemon.
+    '''
+    for i in range(count):
+        yield json.loads(json.dumps({
+            'command': '/usr/local/bin/sync-mirror --host mirror{}.'
+                       'example.org --retries 3'.format(i % 10),
+            'job_run_at': start + i,
+            'use_shell': '/bin/bash' if i % 2 else False,
+            'exact': False,
+            'batch': False,
+        }))
+
+
+def measure(count, make_job):
+    '''Returns the bytes per job of a `{euid: {job_id: job}}`
+    table of `count` jobs made by `make_job`.
+    '''
+    jobs = submissions(count, int(time.time()))
+    tracemalloc.start()
+    table = {}
+    for i, job in enumerate(jobs):
+        table.setdefault(1000 + i % 100, {})[i // 100 + 1] = make_job(job)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 5
+    as_dict = measure(count, dict)
+    as_record = measure(count, JobRecord.from_dict)
+    print('{} jobs: dict {:.0f} B/job | JobRecord {:.0f} B/job | '
+          '{:.1f}x less'.format(count, as_dict, as_record,
+                                as_dict / as_record))
+
+
+if __name__ == '__main__':
+    main()
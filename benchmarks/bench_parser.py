@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# Benchmark for hat-parser -- wall time of a search over a current and
+# `rotations` rotated, gzipped job logs (made up in a temp home dir),
+# with 1 and `jobs` worker processes; checks the output is the same.
+# Usage: python3 benchmarks/bench_parser.py [rotations] [records] [jobs]
+
+import datetime
+import gzip
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+PARSER_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'hat', 'hat-parser.py')
+
+
+def make_logs(log_dir, rotations, records):
+    '''Writes the logs, oldest (`stdout.log.<rotations>.gz`) first.'''
+    at = datetime.datetime(2025, 1, 1)
+    for n in range(rotations, -1, -1):
+        log_file = os.path.join(log_dir, 'stdout.log')
+        if n:
+            log_file = '{}.{}.gz'.format(log_file, n)
+        open_ = gzip.open if n else open
+        with open_(log_file, 'wt') as f:
+            for i in range(records):
+                at += datetime.timedelta(seconds=random.randint(0, 60))
+                time_ = at.strftime('%Y-%m-%d %H:%M:%S')
+                f.write('{0} : euid>1000 : id>{1} : time>{0} : cmd>echo {1}'
+                        ' : ret>0 :: out>{1}\n'.format(time_, i))
+        # As kept on rotation
+        os.utime(log_file, (at.timestamp(), at.timestamp()))
+
+
+def run(home, jobs):
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, PARSER_FILE, '-c', 'echo 12', '-j', str(jobs)],
+        env=dict(os.environ, HOME=home), stdout=subprocess.PIPE,
+        check=True).stdout
+    return time.perf_counter() - started, output
+
+
+def main():
+    rotations = int(sys.argv[1]) if len(sys.argv) > 1 else 14
+    records = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    jobs = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    with tempfile.TemporaryDirectory() as home:
+        log_dir = os.path.join(home, '.hatd', 'logs')
+        os.makedirs(log_dir)
+        make_logs(log_dir, rotations, records)
+        secs, expected = run(home, 1)
+        print('-j 1  {:6.2f} s'.format(secs))
+        secs, output = run(home, jobs)
+        print('-j {:<2} {:6.2f} s{}'.format(
+            jobs, secs, '' if output == expected else '  OUTPUT DIFFERS'))
+
+
+if __name__ == '__main__':
+    main()
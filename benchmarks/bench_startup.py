@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Benchmark for the daemon startup -- time till the near-due jobs are
+# usable and till everything is loaded, streaming the snapshot vs. the
+# old load of the whole table as one pickle, at 100k and 1M jobs.
+# Usage: python3 benchmarks/bench_startup.py [job_count ...]
+
+import heapq
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+started = time.perf_counter()
+from lib import scheduler
+from lib.jobrecord import JobRecord
+import_secs = time.perf_counter() - started
+
+
+def fill(count, start):
+    '''Enqueues `count` jobs for 100 users, none due before `start`.'''
+    scheduler.enqueued_jobs.clear()
+    for i in range(count):
+        scheduler.enqueued_jobs[1000 + i % 100][i // 100 + 1] = \
+            JobRecord('true', start + i)
+    scheduler._rebuild_index()
+
+
+def bench(count, tmp_dir):
+    pickle_file = os.path.join(tmp_dir, 'hatdb.pkl')
+    legacy_file = os.path.join(tmp_dir, 'hatdb-legacy.pkl')
+    journal_file = os.path.join(tmp_dir, 'hatdb.journal')
+    fill(count, int(time.time()) + 60)
+    scheduler._write_snapshot(pickle_file)
+    with open(legacy_file, 'wb') as f:
+        pickle.dump({euid: {job_id: job.as_dict()
+                            for job_id, job in jobs.items()}
+                     for euid, jobs in scheduler.enqueued_jobs.items()}, f)
+    scheduler.enqueued_jobs.clear()
+    scheduler._rebuild_index()
+
+    # The old way: nothing is usable till the whole pickle is loaded
+    started = time.perf_counter()
+    with open(legacy_file, 'rb') as f:
+        jobs = pickle.load(f)
+    index = [(job['job_run_at'], euid, job_id)
+             for euid, jobs_ in jobs.items() for job_id, job in jobs_.items()]
+    heapq.heapify(index)
+    legacy_secs = time.perf_counter() - started
+
+    scheduler.enqueued_jobs.clear()
+    scheduler._rebuild_index()
+    started = time.perf_counter()
+    steps = scheduler.load_db_steps(pickle_file, journal_file)
+    # The journal, then the first (earliest) snapshot chunk
+    next(steps)
+    next(steps)
+    first_secs = time.perf_counter() - started
+    for _ in steps:
+        pass
+    full_secs = time.perf_counter() - started
+
+    print('{:>9} jobs: legacy load {:8.3f}s | streamed: first jobs '
+          '{:8.4f}s, all {:8.3f}s'.format(
+              count, legacy_secs, first_secs, full_secs))
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    print('scheduler import: {:.4f}s'.format(import_secs))
+    # Cold jobs of the host are left out
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scheduler.cold_jobs = scheduler.ColdStore(
+            os.path.join(tmp_dir, 'cold'))
+        for count in counts:
+            bench(count, tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,35 @@
 '''The client.'''
 
-import argparse
+# Kept to what every call needs; argparse, the humantime converter and
+# the user lookup are imported only by the calls that use them
+
 import json
 import os
-import shlex
-import subprocess
+import socket
 import sys
 import time
 
-from collections import Sequence
+from collections.abc import Sequence
 
-from lib.utils import print_msg, read_file, write_file, username_from_euid
-from lib.humantime_epoch_converter import main as get_epoch_main
+from lib.utils import print_msg, read_file
 
 
 __version__ = '0.1'
 
-DAEMON_IN = '/var/run/hatd/ipc/daemon_in.fifo'
-DAEMON_OUT = '/var/run/hatd/ipc/daemon_out.fifo'
+SOCKET_FILE = '/var/run/hatd/ipc/hatd.sock'
+# Jobs asked for in each page of the joblist
+PAGE_SIZE = 500
 DAEMON_PID_FILE = '/var/run/hatd/hatd.pid'
-USER_DIR = '/home/{}/.hatd'.format(username_from_euid(os.geteuid())) \
-           if os.geteuid != 0 else '/root/.hatd'
+# Arguments of the common queries, handled without argparse
+FAST_ARGUMENTS = {
+    (): ('joblist',),
+    ('-l',): ('joblist',),
+    ('--list',): ('joblist',),
+    ('-c',): ('jobcount',),
+    ('--count',): ('jobcount',),
+    ('-s',): ('stats',),
+    ('--stats',): ('stats',),
+}
 
 
 class HatClientException(Exception):
@@ -28,56 +37,84 @@ class HatClientException(Exception):
     pass
 
 
+def get_epoch_main(datetime_spec):
+    '''Returns the Epoch of `datetime_spec`, by the humantime
+    converter (imported on first use).
+    '''
+    from lib.humantime_epoch_converter import main
+    return main(datetime_spec)
+
+
+def user_dir():
+    '''Returns the hat dir of the invoking user.'''
+    from lib.users import hat_dir
+    return hat_dir(os.geteuid())
+
+
 def create_user_files():
     '''Create necessary dirs and files
     for the invoking user.
     '''
-    os.makedirs('{}/logs'.format(USER_DIR), mode=0o700, exist_ok=True)
+    hat_dir = user_dir()
+    os.makedirs('{}/logs'.format(hat_dir), mode=0o700, exist_ok=True)
     for file_ in {'stdout.log', 'stderr.log'}:
-        file_ = '{}/logs/{}'.format(USER_DIR, file_)
+        file_ = '{}/logs/{}'.format(hat_dir, file_)
         if not os.path.isfile(file_):
             with open(file_, 'wt') as f:
                 f.write('')
 
 
-# Manual arg help formatter class to make `nargs='+'` show one arg
-class ManualHelpFormatter(argparse.RawTextHelpFormatter):
-    def _format_args(self, action, default_metavar):
-        get_metavar = self._metavar_formatter(action, default_metavar)
-        if action.nargs is None:
-            result = '%s' % get_metavar(1)
-        elif action.nargs == argparse.OPTIONAL:
-            result = '[%s]' % get_metavar(1)
-        elif action.nargs == argparse.ZERO_OR_MORE:
-            result = '[%s [%s ...]]' % get_metavar(2)
-        # Here...
-        elif action.nargs == argparse.ONE_OR_MORE:
-            result = '%s' % get_metavar(1)
-        elif action.nargs == argparse.REMAINDER:
-            result = '...'
-        elif action.nargs == argparse.PARSER:
-            result = '%s ...' % get_metavar(1)
-        else:
-            formats = ['%s' for _ in range(action.nargs)]
-            result = ' '.join(formats) % get_metavar(action.nargs)
-        return result
-
-                
 def parse_arguments():
     '''Parse arguments (for client) and
     return appropriate response back.
     '''
+    import argparse
+
+    # Manual arg help formatter class to make `nargs='+'` show one arg
+    class ManualHelpFormatter(argparse.RawTextHelpFormatter):
+        def _format_args(self, action, default_metavar):
+            get_metavar = self._metavar_formatter(action, default_metavar)
+            if action.nargs is None:
+                result = '%s' % get_metavar(1)
+            elif action.nargs == argparse.OPTIONAL:
+                result = '[%s]' % get_metavar(1)
+            elif action.nargs == argparse.ZERO_OR_MORE:
+                result = '[%s [%s ...]]' % get_metavar(2)
+            # Here...
+            elif action.nargs == argparse.ONE_OR_MORE:
+                result = '%s' % get_metavar(1)
+            elif action.nargs == argparse.REMAINDER:
+                result = '...'
+            elif action.nargs == argparse.PARSER:
+                result = '%s ...' % get_metavar(1)
+            else:
+                formats = ['%s' for _ in range(action.nargs)]
+                result = ' '.join(formats) % get_metavar(action.nargs)
+            return result
+
     parser = argparse.ArgumentParser(prog='hatc', description='HAT client – a client for HAT (Hyper-AT), the one-time scheduler for GNU/Linux.',
                                      formatter_class=ManualHelpFormatter)
     parser.add_argument('-l', '--list', dest='joblist',
                         required=False, action='store_true',
-                        help='Show the list of queued jobs.\n')
+                        help='Show the list of queued jobs, sorted by time (see `--sort`), optionally filtered (`--match`, `--after`, `--before`, `--shell`).\nShown page by page as the daemon sends them.\n\n')
+    parser.add_argument('--limit', dest='limit', metavar='<count>',
+                        type=int, required=False,
+                        help='Show at most <count> jobs with `-l`/`--list`.\n\n')
+    parser.add_argument('--sort', dest='sort', choices=('time', 'id'),
+                        required=False,
+                        help='Sort the list of `-l`/`--list` by run time (default), or by Job ID.\n\n')
     parser.add_argument('-c', '--count', dest='jobcount',
                         required=False, action='store_true',
-                        help='Show the number of queued jobs.\n\n')
+                        help='Show the number of queued jobs: in total, exact ones, and overdue ones (due, not started yet).\n\n')
+    parser.add_argument('-s', '--stats', dest='stats',
+                        required=False, action='store_true',
+                        help='Show the job executor stats of the daemon: running and pending (due, waiting for a free slot) jobs, their wait times in secs, held batch jobs, and the backlog of overdue jobs being caught up on.\n\n')
     parser.add_argument('-e', '--exact', dest='exact',
                         required=False, action='store_true',
                         help='Run the job only at the time specified, not after. By default, a job is will be run later if e.g. the computer was off at the desired run time.\n\n')
+    parser.add_argument('-b', '--batch', dest='batch',
+                        required=False, action='store_true',
+                        help='Make the job a batch job: once due, it is run only when the system load is low enough. Like `-e`/`--exact`, needs to be specified explicitly when modifying.\n\n')
     parser.add_argument('-a', '--add', dest='add_job',
                         metavar='<command> <datetime_spec> [<shell>]', nargs='+',
                         required=False, help="""Add a new job. If shell is specified, the job will be run in the given shell,
@@ -90,11 +127,23 @@ Examples:
         hatc -a 'echo $PATH' 'today 18:06:34' dash
         hatc -a date 'tomorrow 10 - 6 hr 12 min 3 sec'
         hatc -e -a 'free -g' 'now+1h' sh  # Making the job exact, see `-e`/`--exact`
+        hatc -b -a 'updatedb' 'today 23:00'  # Making the job a batch job, see `-b`/`--batch`
 
 More on <datetime_spec>: https://github.com/heemayl/humantime-epoch-converter
 The job's STDOUT and STDERR are logged in `~/.hatd/logs/{stdout,stderr}.log`, respectively.
         """
     )
+    parser.add_argument('-A', '--add-from', dest='add_from',
+                        metavar='<file>', required=False, help="""Add the jobs listed in <file> (`-` for STDIN) in one go, one job per line, as either
+tab separated <command> <datetime_spec> [<shell>] (like `--add`), or JSON e.g.
+        {"command": "free -m", "time": "now + 30 min", "shell": "bash", "exact": true, "batch": false}
+where only "command" and "time" are required. `-e`/`--exact` and `-b`/`--batch` apply to the lines without "exact"/"batch".
+Empty lines and lines starting with `#` are skipped. The result of each line is shown, with the line number.
+Examples:
+        hatc --add-from jobs.tsv
+        generate-jobs | hatc -e -A -
+        """
+    )
     parser.add_argument('-m', '--modify', dest='modify_job',
                         metavar='<job_id> <command> <datetime_spec> [<shell>]', nargs='+',
                         required=False, help="""Modify an enqueued job. The first argument must be the job ID (from `hatc -l`).
@@ -118,6 +167,36 @@ Examples:
         hatc -r 3 8 23
         """
     )
+    parser.add_argument('-R', '--remove-matching', dest='remove_matching',
+                        required=False, action='store_true',
+                        help="""Remove all queued jobs matching the filters (`--match`, `--after`, `--before`, `--shell`), at least one is needed.
+Shows the number of jobs removed.
+Examples:
+        hatc -R --match '^backup-' --before 'friday 00:00'
+        hatc --remove-matching --shell dash
+        """
+    )
+    parser.add_argument('-M', '--modify-matching', dest='modify_matching',
+                        metavar='<command> <datetime_spec> [<shell>]', nargs='+',
+                        required=False, help="""Modify all queued jobs matching the filters (see `-R`/`--remove-matching`), like `--modify` does
+by Job ID. Shows the number of jobs modified.
+Examples:
+        hatc -M _ 'tomorrow 03:00' --match '^backup-'  # Moving all backups to tomorrow
+        hatc -e -M _ _ --after 'now' --before 'now + 2 hours'  # Making the jobs of the next 2 hours exact
+        """
+    )
+    parser.add_argument('--match', dest='match', metavar='<regex>',
+                        required=False,
+                        help='Filter (also for `-l`): jobs with command matching <regex> (anywhere in the command).\n\n')
+    parser.add_argument('--after', dest='after', metavar='<datetime_spec>',
+                        required=False,
+                        help='Filter: jobs due at or after <datetime_spec>.\n\n')
+    parser.add_argument('--before', dest='before', metavar='<datetime_spec>',
+                        required=False,
+                        help='Filter: jobs due at or before <datetime_spec>.\n\n')
+    parser.add_argument('--shell', dest='shell', metavar='<shell>',
+                        required=False,
+                        help='Filter: jobs run in <shell>, `-` for jobs run without a shell.\n\n')
     
     args_ns = parser.parse_args()
     args_dict = vars(args_ns)
@@ -129,87 +208,113 @@ def argument_serializer(args_dict):
     as a sequence after passing them through decision logic.
     '''
     exact = args_dict.get('exact', False)
-    if not any(args_dict.values()) or args_dict.get('joblist'):
+    if args_dict.get('joblist') or not any(
+            value for key, value in args_dict.items()
+            if key not in {'limit', 'sort', 'match', 'after', 'before',
+                           'shell'}):
         return ('joblist',)
     elif args_dict.get('jobcount'):
         return ('jobcount',)
+    elif args_dict.get('stats'):
+        return ('stats',)
     elif args_dict.get('add_job'):
         return ('add_job', *([exact] + args_dict.get('add_job')))
+    elif args_dict.get('add_from'):
+        return ('add_from', exact, args_dict.get('add_from'))
     elif args_dict.get('modify_job'):
         return ('modify_job', *([exact] + args_dict.get('modify_job')))
     elif args_dict.get('remove_job'):
         return ('remove_job', *([exact] + args_dict.get('remove_job')))
+    elif args_dict.get('remove_matching'):
+        return ('remove_matching', exact)
+    elif args_dict.get('modify_matching'):
+        return ('modify_matching',
+                *([exact] + args_dict.get('modify_matching')))
     return
 
 
 def check_daemon_process(pid_file):
-    '''Checks if the daemon process exists.'''
-    if not os.path.isfile(pid_file):
+    '''Checks if the daemon process exists, from its
+    command line in `/proc`.
+    '''
+    try:
+        pid = int(read_file(pid_file, whole=True))
+        with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+            cmdline = f.read()
+    except (OSError, TypeError, ValueError):
         return False
-    pid = read_file(
-        pid_file,
-        whole=True
-    )
-    proc = subprocess.Popen(
-        shlex.split('/bin/ps -p {} -o cmd='.format(pid)),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL,
-        )
-    ret = proc.wait()
-    if not ret or b'hat/daemon_front.py' in proc.communicate()[0]:
-        return True
-    return False
-
-
-def json_to_table_print(json_str):
-    '''Takes a str (e.g. from `json_dumps`)
-    and converts to a table for printing.
+    return b'daemon_front.py' in cmdline
+
+
+def jobs_to_table(jobs, header=True):
+    '''Takes a page of the joblist, `[[job_id, job], ...]` as sorted
+    by the daemon, and converts to table rows for printing.
     '''
-    # Needs raw str to keep \" as-is
-    data = json.loads(r'{}'.format(json_str))
-    if data:
-        # Header
-        to_print = '\t\t'.join(('ID', 'Time', 'Exact', 'Shell', 'Command'))
-        # Sorting list according to the Epoch, then ID
-        data.sort(key=lambda x: (x[1]['job_run_at'], x[0]))
-        for job in data:
-            job_id = job[0]
-            command = job[1]['command']
-            shell = job[1]['use_shell'] or '  -'
-            time_ = time.strftime('%Y-%m-%dT%H:%M:%S',
-                                  time.localtime(job[1]['job_run_at']))
-            exact = ' Yes' if job[1]['exact'] else ' No'
-            to_print = '{}\n{}'.format(to_print,
-                                       '\t'.join((job_id, time_, exact,
-                                                  '\t{}'.format(shell),
-                                                  '\t{}'.format(command)
-                                       )))
-        return to_print
-    return 'Job queue is empty'
+    rows = []
+    if header:
+        rows.append('\t\t'.join(('ID', 'Time', 'Exact', 'Batch', 'Shell',
+                                  'Command')))
+    for job_id, job in jobs:
+        shell = job['use_shell'] or '  -'
+        time_ = time.strftime('%Y-%m-%dT%H:%M:%S',
+                              time.localtime(job['job_run_at']))
+        exact = ' Yes' if job['exact'] else ' No'
+        batch = '\t Yes' if job.get('batch') else '\t No'
+        rows.append('\t'.join((str(job_id), time_, exact, batch,
+                                '\t{}'.format(shell),
+                                '\t{}'.format(job['command']))))
+    return '\n'.join(rows)
+
+
+def print_joblist(data):
+    '''Prints the joblist page by page, as received.'''
+    printed = False
+    for jobs in data.joblist_pages():
+        if jobs:
+            print(jobs_to_table(jobs, header=not printed), flush=True)
+            printed = True
+    if not printed:
+        print('Job queue is empty')
+
 
-    
 class SendReceiveData:
     '''Takes and parses input, based on key creates and
     sends appropriate JSON for daemon. Input content must
     be a sequence with first element being the desired key.
     '''
-    def __init__(self, content):
+    def __init__(self, content, batch=False, filters=None):
         if not isinstance(content, Sequence):
             raise HatClientException('Input must be a sequence')
         self.content = content
+        # Connection to the daemon, made by `send_to_daemon`
+        self.conn = None
+        # For `add_from`: line numbers of the jobs sent, and
+        # the errors of the lines that could not be sent
+        self.line_numbers = []
+        self.line_errors = {}
+        # Whether an added/modified job is a batch job
+        self.batch = batch
+        # `{'match': regex, 'after': datetime_spec, ...}` for
+        # `remove_matching`/`modify_matching`/`joblist`, with
+        # `limit` and `sort` for `joblist`
+        self.filters = filters or {}
         self.key_format_map = {
             'add_job': self.add_job_fmt,
+            'add_from': self.add_from_fmt,
             'modify_job': self.modify_job_fmt,
             'remove_job': self.remove_job_fmt,
+            'remove_matching': self.remove_matching_fmt,
+            'modify_matching': self.modify_matching_fmt,
             'joblist': self.joblist_fmt,
             'jobcount': self.jobcount_fmt,
+            'stats': self.stats_fmt,
             'stop_daemon': self.stop_daemon,
         }
 
     def check_get_send(self):
         '''Sending sliced data to specific formatters, after
         looking up the fmt func using key (first element).
-        If all goes good, sending to daemon fifo.
+        If all goes good, sending to the daemon socket.
         '''
         try:
             self.key_format_map[self.content[0]](self.content[1:])
@@ -227,14 +332,81 @@ class SendReceiveData:
                               time.localtime(get_epoch_main(data[2])))
         self.out_dict = {
             'add_job': {
-                'euid': os.geteuid(),
                 'exact': exact,
                 'command': command,
                 'time_': time_,
-                'use_shell': data[3] if len(data) == 4 else False
+                'use_shell': data[3] if len(data) == 4 else False,
+                'batch': self.batch
             }
         }
 
+    def _job_from_line(self, line, exact):
+        '''Returns the `add_job` dict of an `add_from` line.'''
+        if line.lstrip().startswith('{'):
+            spec = json.loads(line)
+            if not isinstance(spec, dict):
+                raise HatClientException('Ambiguous input')
+            command, datetime_spec = spec['command'], spec['time']
+            shell = spec.get('shell') or False
+            exact = spec.get('exact', exact)
+            batch = spec.get('batch', self.batch)
+        else:
+            fields = line.split('\t')
+            if not (2 <= len(fields) <= 3):
+                raise HatClientException('Ambiguous input')
+            command, datetime_spec = fields[:2]
+            shell = fields[2] if len(fields) == 3 else False
+            batch = self.batch
+        time_ = time.strftime('%Y-%m-%d_%H:%M:%S',
+                              time.localtime(get_epoch_main(datetime_spec)))
+        return {
+            'exact': exact,
+            'command': '{} -c "{}"'.format(shell, command) if shell
+                       else command,
+            'time_': time_,
+            'use_shell': shell,
+            'batch': batch
+        }
+
+    def add_from_fmt(self, data):
+        from lib.humantime_epoch_converter import DateTimeException
+        exact, path = data
+        jobs = []
+        try:
+            f = sys.stdin if path == '-' else open(path)
+        except OSError as e:
+            raise HatClientException(str(e))
+        with f:
+            for line_number, line in enumerate(f, 1):
+                line = line.rstrip('\n')
+                if not line.strip() or line.lstrip().startswith('#'):
+                    continue
+                try:
+                    jobs.append(self._job_from_line(line, exact))
+                except (ValueError, KeyError, HatClientException,
+                        DateTimeException) as e:
+                    self.line_errors[line_number] = 'Invalid job: {}'.format(
+                        e)
+                else:
+                    self.line_numbers.append(line_number)
+        self.out_dict = {
+            'add_jobs': jobs
+        }
+
+    def add_from_results(self, results):
+        '''Returns the per line results of `add_from`, from the
+        daemon's reply `[{"msg": ..., "job_id": ...} or {"error": ...}]`.
+        '''
+        lines = dict(self.line_errors)
+        for line_number, result in zip(self.line_numbers, results):
+            if 'error' in result:
+                lines[line_number] = result['error']['msg']
+            else:
+                lines[line_number] = '{} (Job ID {})'.format(
+                    result['msg'], result['job_id'])
+        return '\n'.join('{}: {}'.format(line_number, lines[line_number])
+                         for line_number in sorted(lines))
+
     def modify_job_fmt(self, data):
         if not (4 <= len(data) <= 5):
             raise HatClientException('Ambiguous input')
@@ -250,12 +422,12 @@ class SendReceiveData:
             time.localtime(get_epoch_main(data[3])))
         self.out_dict = {
             'add_job': {
-                'euid': os.geteuid(),
                 'exact': exact,
                 'command': command,
                 'time_': time_,
                 'use_shell': data[4] if len(data) == 5 else False,
-                'job_id': job_id
+                'job_id': job_id,
+                'batch': self.batch
             }
         }
 
@@ -265,17 +437,72 @@ class SendReceiveData:
         except ValueError:
             raise HatClientException('Ambiguous input')
         self.out_dict = {
-            'remove_job': (os.geteuid(), *data)
+            'remove_job': data
+        }
+
+    def _filter(self):
+        '''Returns the filter of the jobs to remove/modify,
+        as expected by the daemon.
+        '''
+        filter_ = {}
+        if self.filters.get('match') is not None:
+            filter_['command'] = self.filters['match']
+        for key in ('after', 'before'):
+            if self.filters.get(key) is not None:
+                filter_[key] = get_epoch_main(self.filters[key])
+        if self.filters.get('shell') is not None:
+            filter_['shell'] = self.filters['shell']
+        return filter_
+
+    def remove_matching_fmt(self, _):
+        self.out_dict = {
+            'remove_matching': self._filter()
+        }
+
+    def modify_matching_fmt(self, data):
+        if not (3 <= len(data) <= 4):
+            raise HatClientException('Ambiguous input')
+        exact = data[0]
+        command = '{} -c "{}"'.format(data[3], data[1]) if len(data) == 4 \
+                  else data[1]
+        time_ = data[2] if data[2] == '_' else time.strftime(
+            '%Y-%m-%d_%H:%M:%S',
+            time.localtime(get_epoch_main(data[2])))
+        self.out_dict = {
+            'modify_matching': {
+                'filter': self._filter(),
+                'job': {
+                    'exact': exact,
+                    'command': command,
+                    'time_': time_,
+                    'use_shell': data[3] if len(data) == 4 else False,
+                    'batch': self.batch
+                }
+            }
         }
 
+    # The daemon knows the user from the connection
+
     def joblist_fmt(self, _):
+        limit = self.filters.get('limit')
+        if limit is not None and limit < 1:
+            raise HatClientException('Ambiguous input')
         self.out_dict = {
-            'joblist': os.geteuid()
+            'joblist': {
+                'limit': min(PAGE_SIZE, limit or PAGE_SIZE),
+                'sort': self.filters.get('sort') or 'time',
+                'filter': self._filter()
+            }
         }
 
     def jobcount_fmt(self, _):
         self.out_dict = {
-            'jobcount': os.geteuid()
+            'jobcount': True
+        }
+
+    def stats_fmt(self, _):
+        self.out_dict = {
+            'stats': True
         }
 
     def stop_daemon(self, _):
@@ -284,20 +511,49 @@ class SendReceiveData:
         }
 
     def send_to_daemon(self):
-        write_file(
-            DAEMON_IN,
-            self.out_dict,
-            mode='wt',
-            nodate=True,
-            json_dumps=True
-        )
+        self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.conn.connect(SOCKET_FILE)
+        except OSError as e:
+            self.conn.close()
+            raise HatClientException(
+                'Can not connect to the daemon: {}'.format(e))
+        self._send()
+
+    def _send(self):
+        self.conn.sendall('{}\n'.format(json.dumps(self.out_dict))
+                          .encode('utf-8'))
 
     def receive_from_daemon(self):
-        return read_file(
-            DAEMON_OUT,
-            whole=True,
-            json_loads=True
-        )
+        with self.conn, self.conn.makefile('rb') as f:
+            line = f.readline()
+        return json.loads(line.decode('utf-8')) if line else None
+
+    def joblist_pages(self):
+        '''Yields the pages of the joblist as received, asking for
+        the next one on the same connection till the last page,
+        or till `limit` jobs.
+        '''
+        request = self.out_dict['joblist']
+        left = self.filters.get('limit')
+        with self.conn, self.conn.makefile('rb') as f:
+            while True:
+                line = f.readline()
+                if not line:
+                    return
+                page = json.loads(line.decode('utf-8'))
+                if 'error' in page:
+                    raise HatClientException(page['error']['msg'])
+                jobs = page['jobs'] if left is None else page['jobs'][:left]
+                yield jobs
+                if left is not None:
+                    left -= len(jobs)
+                if page['cursor'] is None or left == 0:
+                    return
+                request['cursor'] = page['cursor']
+                if left is not None:
+                    request['limit'] = min(PAGE_SIZE, left)
+                self._send()
 
     
 def main():
@@ -309,6 +565,7 @@ def main():
             data_seq = ('stop_daemon', True)
             data = SendReceiveData(data_seq)
             data.check_get_send()
+            data.receive_from_daemon()
             exit(0)
         if sys.argv[1] in {'-V', '--version'}:
             print_msg(__version__, file=sys.stderr)
@@ -316,20 +573,35 @@ def main():
     if not check_daemon_process(DAEMON_PID_FILE):
         print_msg('Daemon (hatd) is not running')
         exit(127)
-    args_dict = parse_arguments()
-    data_seq = argument_serializer(args_dict)
+    data_seq = FAST_ARGUMENTS.get(tuple(sys.argv[1:]))
+    if data_seq is not None:
+        args_dict = {}
+    else:
+        args_dict = parse_arguments()
+        data_seq = argument_serializer(args_dict)
     if not data_seq:
         print_msg('Ambiguous input')
         exit(126)
-    create_user_files()
-    data = SendReceiveData(data_seq)
+    if data_seq[0] in {'add_job', 'add_from', 'modify_job',
+                       'modify_matching'}:
+        # Where the output of the jobs goes
+        create_user_files()
+    data = SendReceiveData(data_seq, batch=args_dict.get('batch', False),
+                           filters=args_dict)
     data.check_get_send()
+    if data_seq[0] == 'joblist':
+        try:
+            print_joblist(data)
+        except HatClientException as e:
+            print_msg(str(e))
+            exit(1)
+        return
     received = data.receive_from_daemon()
     if received is not None:
-        if not isinstance(received, str):
-            print(received)
+        if data_seq[0] == 'add_from' and isinstance(received, list):
+            print(data.add_from_results(received))
         else:
-            print(json_to_table_print(received))
+            print(received)
 
         
 if __name__ == '__main__':
@@ -1,14 +1,22 @@
 '''The daemon and related stuffs of hat.'''
 
+import asyncio
+import itertools
 import json
 import multiprocessing
+import os
 import subprocess
 import time
 
-from lib.utils import read_file, write_file
+from lib.config import get_config
+from lib.utils import write_file
 from lib.runner import BaseRunner
 
 
+# Longest reply line from the runner (a joblist) that is accepted
+REPLY_LIMIT = 1 << 30
+
+
 class HatDaemonMeta(type):
     '''Metaclass to ensure HatDaemon singleton.'''
     _instances = {}
@@ -20,21 +28,43 @@ class HatDaemonMeta(type):
 
 
 class HatDaemon(metaclass=HatDaemonMeta):
+    '''The daemon. The runner runs in a process of its own, talked
+    to through the runner FIFOs; or, with `single_process`, as a task
+    of the event loop serving the clients, talked to through an
+    in-memory queue.
+    '''
     def __init__(self):
         self.runner = BaseRunner()
+        self.single_process = get_config('single_process')
         self.daemon = multiprocessing.Process(
             target=self.runner.start,
             # daemon=True,
             name='hatd',
         )
+        # With `single_process`: the runner task, and its inbox
+        self._runner_task = None
+        self._inbox = None
         self.runner_in = '/var/run/hatd/ipc/runner_in.fifo'
         self.runner_out = '/var/run/hatd/ipc/runner_out.fifo'
-        self.daemon_in = '/var/run/hatd/ipc/daemon_in.fifo'
-        self.daemon_out = '/var/run/hatd/ipc/daemon_out.fifo'
         self.daemon_log = '/var/log/hatd/daemon.log'
+        # Requests sent to the runner and waiting for the
+        # reply, as `{request ID: future}`
+        self._req_ids = itertools.count(1)
+        self._waiting = {}
+        # False once the runner is gone, failing the requests
+        self._runner_up = True
         
     def start(self):
         '''Starting the daemon.'''
+        if self.single_process:
+            # The runner starts along with the event loop
+            # (see `open_runner_channel`)
+            write_file(
+                self.daemon_log,
+                'Daemon started (single process): PID {}'.format(self.pid),
+                'at'
+            )
+            return True
         self.daemon.start()
         write_file(
             self.daemon_log,
@@ -46,6 +76,10 @@ class HatDaemon(metaclass=HatDaemonMeta):
 
     def stop(self):
         '''Stop should be foreceful, if needed.'''
+        if self.single_process:
+            if self._inbox is not None:
+                self._inbox.put_nowait({'stop': True})
+            return True
         self.runner.stop()
         if self.status():
             self.daemon.terminate()
@@ -57,6 +91,8 @@ class HatDaemon(metaclass=HatDaemonMeta):
         return True
     
     def status(self):
+        if self.single_process:
+            return True
         return self.daemon.is_alive()
 
     @property
@@ -67,70 +103,178 @@ class HatDaemon(metaclass=HatDaemonMeta):
     
     @property
     def pid(self):
+        if self.single_process:
+            return os.getpid()
         return self.daemon.pid
 
-    def add_job(self, euid, exact, command, time_, use_shell=False,
-                job_id=None):
+    async def open_runner_channel(self):
+        '''Opens the FIFOs to and from the runner, for `request`;
+        to be called from the event loop before any requests. With
+        `single_process`, starts the runner task instead.
+        '''
+        loop = asyncio.get_running_loop()
+        self._runner_up = True
+        if self.single_process:
+            self._inbox = asyncio.Queue()
+            self._runner_task = loop.create_task(
+                self.runner.run_in_loop(self._inbox, self._take_replies))
+            self._runner_task.add_done_callback(self._runner_done)
+            return
+        # The runner has it open already (see `daemon_front`)
+        runner_in = os.fdopen(
+            os.open(self.runner_in, os.O_WRONLY | os.O_NONBLOCK), 'wb', 0)
+        self._runner_in, _ = await loop.connect_write_pipe(
+            asyncio.Protocol, runner_in)
+        # Read-write, so that it does not hit EOF between the replies
+        runner_out = os.fdopen(
+            os.open(self.runner_out, os.O_RDWR | os.O_NONBLOCK), 'rb', 0)
+        reader = asyncio.StreamReader(limit=REPLY_LIMIT)
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), runner_out)
+        self._reply_reader = loop.create_task(self._read_replies(reader))
+        # The runner process ending fails the requests left waiting
+        loop.add_reader(self.daemon.sentinel, self._runner_exited)
+
+    async def _read_replies(self, reader):
+        '''Hands the runner\'s replies to the waiting requests.'''
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            try:
+                reply = json.loads(line.decode('utf-8'))
+                future = self._waiting.pop(reply['req'])
+            except (ValueError, KeyError) as e:
+                write_file(self.daemon_log, 'Bad reply from runner: {}'
+                           .format(e), mode='at')
+                continue
+            if not future.done():
+                future.set_result(reply['reply'])
+
+    def _take_replies(self, replies):
+        '''Hands the replies of the runner task to the waiting requests.'''
+        for reply in replies:
+            future = self._waiting.pop(reply['req'], None)
+            if future is not None and not future.done():
+                future.set_result(reply['reply'])
+
+    def _runner_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            write_file(self.daemon_log, 'Runner failed: {!r}'
+                       .format(task.exception()), mode='at')
+        self._runner_gone()
+
+    def _runner_exited(self):
+        asyncio.get_running_loop().remove_reader(self.daemon.sentinel)
+        # Gone already, only to be reaped
+        self.daemon.join(1)
+        write_file(self.daemon_log, 'Runner exited: exit code {}'
+                   .format(self.daemon.exitcode), mode='at')
+        self._runner_gone()
+
+    def _runner_gone(self):
+        '''Fails the requests waiting for the runner, and the
+        ones to come, as there will be no reply.
+        '''
+        self._runner_up = False
+        for future in self._waiting.values():
+            if not future.done():
+                future.set_exception(ValueError('Runner failed'))
+
+    async def close_runner_channel(self):
+        '''Waits for the runner task to finish its round and
+        stop, with `single_process`.
+        '''
+        if self._runner_task is not None:
+            await asyncio.wait((self._runner_task,))
+
+    def _send(self, content):
+        '''Sends `content` to the runner, without waiting.'''
+        if self.single_process:
+            self._inbox.put_nowait(content)
+            return
+        self._runner_in.write('{}\n'.format(json.dumps(content))
+                              .encode('utf-8'))
+
+    async def request(self, content):
+        '''Sends `content` to the runner, tagged with a request ID,
+        and returns the runner\'s reply to it.
+        '''
+        if not self._runner_up:
+            raise ValueError('Runner failed')
+        req = next(self._req_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[req] = future
+        self._send(dict(content, req=req))
+        try:
+            return await future
+        finally:
+            self._waiting.pop(req, None)
+
+    async def add_job(self, euid, exact, command, time_, use_shell=False,
+                      job_id=None, batch=False):
         '''Adds a new job.'''
-        # Sending `job` dict to fifo with required params
+        # Sending `job` dict to the runner with required params
         job = {
             'euid': euid,
             'exact': exact,
             'command': command,
             'time_': time_,
             'use_shell': use_shell,
-            'job_id': job_id
+            'job_id': job_id,
+            'batch': batch
         }
-        write_file(
-            self.runner_in,
-            job,
-            nodate=True,
-            json_dumps=True
-        )
-        
-    def remove_job(self, euid, *job_ids):
+        return await self.request(job)
+
+    async def add_jobs(self, euid, jobs):
+        '''Adds the jobs (dicts of `add_job` params), all in one go;
+        returns the result of each.
+        '''
+        return await self.request({
+            'add_jobs': [dict(job, euid=euid) for job in jobs]
+        })
+
+    async def remove_job(self, euid, *job_ids):
         '''Remove a job.'''
         # Sending a dict with `remove` as key
         # and [(euid, job_id),...] as value
-        remove_job = {
+        self._send({
             'remove': [(euid, id) for id in job_ids]
-        }
-        write_file(
-            self.runner_in,
-            remove_job,
-            nodate=True,
-            json_dumps=True
-        )
-        write_file(
-            self.daemon_out,
-            {"msg": "Queued"},
-            nodate=True,
-            json_dumps=True,
-        )
+        })
+        return {"msg": "Queued"}
 
-    def joblist(self, euid):
-        '''Getting the current joblist of euid as raw dict.'''
-        # Sending one item dict with key `joblist`
-        content = {
-            'joblist': euid
-        }
-        write_file(
-            self.runner_in,
-            content,
-            nodate=True,
-            json_dumps=True
-        )
-        # Getting jobs: `{id: {}, id: {}, ...}`
-        jobs = read_file(
-            self.runner_out,
-            whole=True,
-            json_loads=True
-        )
-        return json.dumps(sorted(jobs.items()), indent=4)  # Prettify-ing
+    async def remove_matching(self, euid, filter_):
+        '''Removes the jobs matching `filter_` (see
+        `scheduler.match_jobs`); returns the count.
+        '''
+        return await self.request({
+            'remove_matching': {'euid': euid, 'filter': filter_}
+        })
+
+    async def modify_matching(self, euid, filter_, job):
+        '''Modifies the jobs matching `filter_` as per `job`
+        (`add_job` params); returns the count.
+        '''
+        return await self.request({
+            'modify_matching': {'euid': euid, 'filter': filter_, 'job': job}
+        })
+
+    async def joblist(self, euid, options):
+        '''Getting a page of the joblist of euid, filtered and sorted by
+        the runner as per `options` (limit, cursor, sort, filter), as
+        `{'jobs': [[id, {}], ...], 'cursor': next page cursor or None}`.
+        '''
+        return await self.request({'joblist': dict(options, euid=euid)})
+
+    async def stats(self):
+        '''Getting the job executor stats of the runner as dict.'''
+        return await self.request({'stats': True})
 
-    def jobcount(self, euid):
-        jobs = json.loads(self.joblist(euid))
-        return len(jobs)
+    async def jobcount(self, euid):
+        '''Getting the job counts of euid (total, exact, overdue
+        pending) as dict, kept by the runner as jobs come and go.
+        '''
+        return await self.request({'jobcount': euid})
     
     
 if __name__ == '__main__':
@@ -1,106 +1,178 @@
 '''Front facing interface of the daemon, for abstracting the daemon.'''
 
+import asyncio
 import json
+import os
 import sys
-import time
 
-from collections import Mapping
+from collections.abc import Mapping
 
-from lib.utils import write_file
+from lib.config import get_config
+from lib.logwriter import start_log_writer, stop_log_writer
+from lib.utils import peer_credentials, write_file
 from daemon import HatDaemon
 
 
-DAEMON_IN = '/var/run/hatd/ipc/daemon_in.fifo'
-DAEMON_OUT = '/var/run/hatd/ipc/daemon_out.fifo'
+SOCKET_FILE = '/var/run/hatd/ipc/hatd.sock'
 RUNNER_IN = '/var/run/hatd/ipc/runner_in.fifo'
 DAEMON_LOG = '/var/log/hatd/daemon.log'
 PID_FILE = '/var/run/hatd/hatd.pid'
+# Longest request line accepted from a client (e.g. bulk submissions)
+REQUEST_LIMIT = 1 << 26
+# Options of a `joblist` request
+JOBLIST_OPTIONS = {'limit', 'cursor', 'sort', 'filter'}
 
 
 class DaemonWrapper:
+    '''Serves the clients on the Unix socket `SOCKET_FILE`. Each
+    connection sends JSON lines of `{operation: value}` and gets a JSON
+    line back for each, in order; connections are served concurrently.
+    The user is taken from the peer credentials of the connection,
+    never from the request.
+    '''
     def __init__(self, daemon):
         self.daemon = daemon
         # dict values are wrappers that calls the
         # underlying relevant daemon function
         self.input_to_operation_map = {
             'add_job': self.add_job,
+            'add_jobs': self.add_jobs,
             'remove_job': self.remove_job,
+            'remove_matching': self.remove_matching,
+            'modify_matching': self.modify_matching,
             'joblist': self.joblist,
             'jobcount': self.jobcount,
+            'stats': self.stats,
             'stop': self.stop_daemon,
         }
-        
-    def add_job(self, value):
+        self._stopped = None
+
+    async def add_job(self, euid, value):
         '''Adds a new job.'''
-        return self.daemon.add_job(**dict(value))
+        return await self.daemon.add_job(**dict(value, euid=euid))
+
+    async def add_jobs(self, euid, value):
+        '''Adds the jobs of a bulk submission.'''
+        if not isinstance(value, list) or \
+           not all(isinstance(job, Mapping) for job in value):
+            raise ValueError('Ambiguous input')
+        return await self.daemon.add_jobs(euid, value)
 
-    def remove_job(self, value):
+    async def remove_job(self, euid, value):
         '''Removes a job.'''
-        return self.daemon.remove_job(*value)
+        if not isinstance(value, list) or \
+           not all(type(job_id) is int for job_id in value):
+            raise ValueError('Ambiguous input')
+        return await self.daemon.remove_job(euid, *value)
+
+    async def remove_matching(self, euid, value):
+        '''Removes the jobs matching the filter.'''
+        if not isinstance(value, Mapping):
+            raise ValueError('Ambiguous input')
+        return await self.daemon.remove_matching(euid, dict(value))
+
+    async def modify_matching(self, euid, value):
+        '''Modifies the jobs matching the filter.'''
+        if not isinstance(value, Mapping) or \
+           not isinstance(value['filter'], Mapping) or \
+           not isinstance(value['job'], Mapping):
+            raise ValueError('Ambiguous input')
+        return await self.daemon.modify_matching(
+            euid, dict(value['filter']), dict(value['job']))
+
+    async def joblist(self, euid, value):
+        '''Returns a page of the joblist of the user.'''
+        if not isinstance(value, Mapping):
+            # e.g. `True`: the first page, with the defaults
+            value = {}
+        if not set(value) <= JOBLIST_OPTIONS or \
+           not isinstance(value.get('filter') or {}, Mapping):
+            raise ValueError('Ambiguous input')
+        return await self.daemon.joblist(euid, value)
+
+    async def jobcount(self, euid, _):
+        '''Returns the jobcount of the user.'''
+        return await self.daemon.jobcount(euid)
 
-    def _write_daemon_out(self, output):
-        '''Writes the output to the daemon_out fifo.'''
+    async def stats(self, *_):
+        '''Returns the job executor stats.'''
+        return await self.daemon.stats()
+
+    async def stop_daemon(self, euid, _):
+        '''Stops the daemon, for superuser only.'''
+        if euid != 0:
+            return {"error": {"msg": "Permission denied"}}
         write_file(
-            DAEMON_OUT,
-            output,
-            nodate=True,
-            json_dumps=True
+            DAEMON_LOG,
+            'Daemon stopped',
+            mode='at'
         )
-    
-    def joblist(self, value):
-        '''Returns the joblist of UID - value.'''
-        output = self.daemon.joblist(int(value))
-        self._write_daemon_out(output)
-        
-    def jobcount(self, value):
-        '''Returns the jobcount of UID - value.'''
-        output = self.daemon.jobcount(int(value))
-        self._write_daemon_out(output)
-
-    def stop_daemon(self, *_):
-        '''Stops the daemon.'''
-        self.daemon.stop()
-        
-    def parse_check_forward(self, content):
-        '''Takes the input content, checks validity;
-        if valid, passes to upstream, discards otherwise.
+        self._stopped.set()
+        return {"msg": "Stopping"}
+
+    async def parse_check_forward(self, content, euid):
+        '''Takes the input content, checks validity; if valid,
+        passes to upstream and returns the reply, returns an
+        error otherwise.
         '''
-        if not isinstance(content, Mapping):
-            return
+        if not isinstance(content, Mapping) or not content:
+            return {"error": {"msg": "Ambiguous input"}}
         operation, value = next(iter(content.items()))
         try:
-            self.input_to_operation_map[operation](value)
+            operation = self.input_to_operation_map[operation]
         except KeyError:
-            return
-        
-    def run(self):
-        '''Runs continuously, gets input from fifo, sends
-        those for processing to parse_check_forward.
-        '''
-        with open(DAEMON_IN, 'rt') as d_in:
+            return {"error": {"msg": "Ambiguous input"}}
+        try:
+            return await operation(euid, value)
+        except (KeyError, TypeError, ValueError) as e:
+            return {"error": {"msg": str(e)}}
+
+    async def handle_client(self, reader, writer):
+        '''Serves one client connection till it's closed.'''
+        _, euid, _ = peer_credentials(writer.get_extra_info('socket'))
+        try:
             while True:
-                for line in d_in:
-                    try:
-                        content = json.loads(line)
-                    except json.JSONDecodeError:
-                        pass
-                    else:
-                        if 'stop' in content:
-                            write_file(
-                                DAEMON_LOG,
-                                'Daemon stopped',
-                                mode='at'
-                            )
-                        self.parse_check_forward(content)
-                        # This is redundant, just making sure
-                        if 'stop' in content:
-                            break
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    content = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    reply = {"error": {"msg": "Ambiguous input"}}
                 else:
-                    time.sleep(0.1)
-                    continue
-                break
+                    reply = await self.parse_check_forward(content, euid)
+                writer.write('{}\n'.format(json.dumps(reply))
+                             .encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            # Gone midway, the request line is too long, or stopping
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        '''Serves the clients till stopped.'''
+        self._stopped = asyncio.Event()
+        await self.daemon.open_runner_channel()
+        server = await asyncio.start_unix_server(
+            self.handle_client, SOCKET_FILE, limit=REQUEST_LIMIT)
+        # Access is for the members of the `hatd` group, as of the dir
+        os.chmod(SOCKET_FILE, 0o660)
+        async with server:
+            await self._stopped.wait()
+        self.daemon.stop()
+        await self.daemon.close_runner_channel()
+
+    def run(self):
+        '''Runs continuously, serving the clients.'''
+        start_log_writer(get_config('log_flush_interval'),
+                         get_config('log_buffer_bytes'))
+        try:
+            asyncio.run(self.serve())
+        finally:
+            stop_log_writer()
+
 
-    
 if __name__ == '__main__':
     daemon = HatDaemon()
     # Start-stop
@@ -115,14 +187,14 @@ if __name__ == '__main__':
     if daemon.status():
         write_file(PID_FILE, daemon.pid, nodate=True)
         daemon_wrapper = DaemonWrapper(daemon)
-        # To make first iteration of runner, sending a no-op to the
-        # runner_in fifo; runner will start with previous jobs now
-        write_file(
-             RUNNER_IN,
-             {'noop': True},
-             json_dumps=True,
-             nodate=True,
-        )
+        if not daemon.single_process:
+            # To make first iteration of runner, sending a no-op to the
+            # runner_in fifo; runner will start with previous jobs now
+            write_file(
+                 RUNNER_IN,
+                 {'noop': True},
+                 json_dumps=True,
+                 nodate=True,
+            )
         # Perpetual running
         daemon_wrapper.run()
-
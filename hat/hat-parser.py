@@ -2,41 +2,51 @@
 
 import argparse
 import datetime
+import functools
 import glob
 import gzip
+import json
+import multiprocessing
 import os
 import re
 import sys
 
+from lib.logindex import INDEX_SLACK, build_index, seek_offset
 from lib.utils import print_msg
 
 
 # Constants
 USER_LOG_LOCATION = os.path.expanduser('~/.hatd/logs/')
+DT_FORMAT = '%Y-%m-%d %H:%M:%S'
+# A text record: `<date> : euid>.. : id>.. : time>.. : cmd>.. : ret>..
+# :: out>..`, the output going on in the lines after, if multiline
+TEXT_RECORD = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) : euid>(\d+) : id>(\d+) : '
+    r'time>(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) : cmd>(.*?) : '
+    r'ret>(-?\d+) :: out>(.*)$', re.S)
+# An NDJSON record (`job_log_format = ndjson`) starts with `run` and
+# `scheduled`, of fixed width
+NDJSON_START = '{"run": "'
+NDJSON_SCHEDULED = '", "scheduled": "'
 
 
-def split_format(line):
-    '''Takes a line as input and returns
-    splitted-formatted fields as output.
+def ndjson_times(line):
+    '''Returns `(run, scheduled)` (`YYYY-mm-dd HH:MM:SS`) of the NDJSON
+    record `line`, sliced out without parsing it; None if it is not
+    laid out as written by the daemon.
     '''
-    dt_format = '%Y-%m-%d %H:%M:%S'
-    splitted_line = line.split(' :')
+    if line[28:45] != NDJSON_SCHEDULED or line[64:65] != '"':
+        return None
+    return line[9:28], line[45:64]
 
-    run_time = splitted_line[0].strip()
-    run_time_dt = datetime.datetime.strptime(run_time, dt_format)
-    
-    euid = splitted_line[1].split('>')[1].strip()
-    job_id = splitted_line[2].split('>')[1].strip()
-    
-    scheduled_time = splitted_line[3].split('>')[1].strip()
-    scheduled_time_dt = datetime.datetime.strptime(scheduled_time, dt_format)
-    
-    command = splitted_line[4].split('>')[1].strip()
-    return_code = splitted_line[5].split('>')[1].strip()
-    output = splitted_line[-1].split('>', maxsplit=1)[1].strip()
 
-    return (run_time_dt, euid, job_id, scheduled_time_dt,
-            command, return_code, output)
+def ndjson_format(record):
+    '''Returns the NDJSON `record` (dict) laid out as a text record,
+    with the duration and dropped output bytes.
+    '''
+    return ('{run} : euid>{euid} : id>{job_id} : time>{scheduled} : '
+            'cmd>{command} : ret>{returncode} : dur>{duration} : '
+            'dropped>{dropped} :: out>{out}'.format(**record))
 
 
 def parse_arguments():
@@ -55,6 +65,10 @@ def parse_arguments():
                         required=False, help='Show logs starting from this time (including). Must be in format YYYY-mm-ddTHH:MM:SS (e.g. 2018-02-04T14:34:00, 2017-12-23T02:23:45).\n')
     parser.add_argument('-t', '--to', dest='to_time',
                         required=False, help='Show logs upto this time (including). Must be in format YYYY-mm-ddTHH:MM:SS (e.g. 2018-04-14T23:31:04, 2017-12-31T09:12:45).\n')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        required=False, help='Search this many log files (rotated, compressed ones too) at once, in as many processes; 0 for the number of CPUs. Output stays in order. Default: 1.')
+    parser.add_argument('--reindex', dest='reindex', action='store_true',
+                        required=False, help='Rebuild the time indexes (`<log>.idx`) of the logs, used to go straight to `--from`, and exit.')
     
     args_ns = parser.parse_args()
     args_dict = vars(args_ns)
@@ -68,7 +82,7 @@ def search_params_formatter(args_dict):
     '''
     command_re = re.compile(r'{}'.format(
         args_dict.get('command') or '.'))  # compiled
-    logtype = args_dict.get('stderr') or 'stdout'
+    logtype = 'stderr' if args_dict.get('stderr') else 'stdout'
     compare_sched = args_dict.get('scheduled', False)
     # I think it's safe to take the start of 2018
     # as the starting time if nothing given
@@ -93,51 +107,151 @@ def search_params_formatter(args_dict):
     return (command_re, logtype, compare_sched, start_dt, end_dt)
 
 
+def log_files(logtype):
+    '''Returns the log files (rotated ones too) of `logtype`, but
+    their index files; oldest first, by the time last written (kept
+    on rotation and compression).
+    '''
+    logfile_glob = os.path.join(USER_LOG_LOCATION, '{}.log*'.format(logtype))
+    files = []
+    for file_ in glob.glob(logfile_glob):
+        if file_.endswith(('.idx', '.tmp')):
+            continue
+        try:
+            files.append((os.stat(file_).st_mtime, file_))
+        except OSError:
+            # Rotated away meanwhile
+            continue
+    return [file_ for _, file_ in sorted(files)]
+
+
+def reindex(logtype):
+    '''Rebuilds the time indexes of the (uncompressed) log files.'''
+    for file_ in log_files(logtype):
+        if file_.endswith('.gz'):
+            continue
+        try:
+            entries = build_index(file_)
+        except OSError as e:
+            print_msg('{}: {}'.format(file_, e), file=sys.stderr)
+            continue
+        print_msg('{}: {} index entries'.format(file_, entries), end='')
+
+
+def search_file(file_, command_re, compare_sched, start, end):
+    '''Yields the records of the log `file_` matching the search
+    params (`start` and `end` as `YYYY-mm-dd HH:MM:SS`), to print.
+    Comparing run times, reading starts from the first record in
+    range, as found by `lib/logindex.py`.
+    '''
+    # Setting appropriate open function
+    # expecting .gz extension or as-is
+    open_ = gzip.open if file_.endswith('.gz') else open
+    with open_(file_, mode='rb') as f:
+        if not compare_sched and not file_.endswith('.gz'):
+            seek_from = (datetime.datetime.strptime(start, DT_FORMAT) -
+                         datetime.timedelta(seconds=INDEX_SLACK))
+            f.seek(seek_offset(f, file_, seek_from.strftime(DT_FORMAT)))
+        # Log lines start with appropriately formatted datetime 
+        dt_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}\s+(?:\d{2}:){2}\d{2}')
+        # This keeps track if the line containing
+        # dt has been printed already; need this
+        # to handle multiline logs
+        dt_line_printed = False
+        for line in f:
+            line = line.decode('utf-8', 'replace')
+            if line.startswith(NDJSON_START):
+                dt_line_printed = False
+                times = ndjson_times(line)
+                record = None
+                if times is None:
+                    try:
+                        record = json.loads(line)
+                        times = record['run'], record['scheduled']
+                    except (ValueError, KeyError):
+                        continue
+                run_time, scheduled_time = times
+                compare_time = scheduled_time if compare_sched \
+                    else run_time
+                if start <= compare_time <= end:
+                    record = record or json.loads(line)
+                    if command_re.search(record['command']):
+                        yield ndjson_format(record).rstrip()
+                elif not compare_sched and compare_time > end:
+                    break
+                continue
+            line = line.rstrip()
+            if not line:
+                continue
+            # If the line does not start with datetime, it is a
+            # multiline log so printing it and continuing the
+            # loop without the datetime comparison
+            if not dt_pattern.search(line):
+                if dt_line_printed:
+                    yield line
+                continue
+            match = TEXT_RECORD.match(line)
+            if match is None:
+                dt_line_printed = False
+                continue
+            run_time, scheduled_time, command = match.group(1, 4, 5)
+            # Comparing dt field
+            compare_time = scheduled_time if compare_sched else run_time
+            if start <= compare_time <= end:
+                if command_re.search(command):
+                    yield line
+                    dt_line_printed = True
+                else:
+                    dt_line_printed = False
+            # Break out of this file if we're already passed
+            # the end dt and we're comparing run time
+            else:
+                dt_line_printed = False
+                if not compare_sched and compare_time > end:
+                    break
+
+
+def search_file_all(file_, command_re, compare_sched, start, end):
+    '''Returns the records of `search_file` as a list, for the
+    workers of `-j`.
+    '''
+    return list(search_file(file_, command_re, compare_sched, start, end))
+
+
+def search_files(files, jobs, command_re, compare_sched, start, end):
+    '''Yields the matching records of the log `files`, in order; with
+    `jobs` > 1, searching the files in a pool of that many processes,
+    the records of each file coming as soon as it and all before it
+    are done.
+    '''
+    if jobs <= 1 or len(files) <= 1:
+        for file_ in files:
+            yield from search_file(file_, command_re, compare_sched, start,
+                                   end)
+        return
+    search = functools.partial(search_file_all, command_re=command_re,
+                               compare_sched=compare_sched, start=start,
+                               end=end)
+    with multiprocessing.Pool(min(jobs, len(files))) as pool:
+        for lines in pool.imap(search, files):
+            yield from lines
+
+
 def main():
     '''Main function that calls others to get data and
     then iterates over the files line by line.'''
+    args_dict = parse_arguments()
     command_re, logtype, compare_sched, start_dt, end_dt = (
-        search_params_formatter(parse_arguments()))
-    logfile_glob = os.path.join(USER_LOG_LOCATION, '{}.log*'.format(logtype))
-    logfiles = glob.iglob(logfile_glob)
-    # Log lines start with appropriately formatted datetime 
-    dt_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}\s+(?:\d{2}:){2}\d{2}')
-    for file_ in logfiles:
-        # Setting appropriate open function
-        # expecting .gz extension or as-is
-        open_ = gzip.open if file_.endswith('.gz') else open
-        with open_(file_, mode='rt') as f:
-            # This keeps track if the line containing
-            # dt has been printed already; need this
-            # to handle multiline logs
-            dt_line_printed = False
-            for line in f:
-                line = line.rstrip()
-                if not line:
-                    continue
-                # If the line does not start with datetime, it is a
-                # multiline log so printing it and continuing the
-                # loop without the datetime comparison
-                if not dt_pattern.search(line):
-                    if dt_line_printed:
-                        print_msg(line, end='')  # log lines already contain blank lines
-                    continue
-                (run_time_dt, euid, job_id, scheduled_time_dt,
-                 command, return_code, output) = split_format(line)
-                # Comparing dt field
-                compare_dt = scheduled_time_dt if compare_sched else run_time_dt
-                if start_dt <= compare_dt <= end_dt:
-                    if command_re.search(command):
-                        print_msg(line, end='')
-                        dt_line_printed = True
-                    else:
-                        dt_line_printed = False
-                # Break out of this file if we're already passed
-                # the end dt and we're comparing run time
-                else:
-                    dt_line_printed = False
-                    if not compare_sched and compare_dt > end_dt:
-                        break
+        search_params_formatter(args_dict))
+    if args_dict['reindex']:
+        reindex(logtype)
+        return
+    # Times of records are compared as strings, being of fixed width
+    start, end = start_dt.strftime(DT_FORMAT), end_dt.strftime(DT_FORMAT)
+    jobs = args_dict['jobs'] or os.cpu_count() or 1
+    for line in search_files(log_files(logtype), jobs, command_re,
+                             compare_sched, start, end):
+        print_msg(line, end='')  # log lines already contain blank lines
                 
     
 if __name__ == '__main__':
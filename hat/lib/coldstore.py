@@ -0,0 +1,245 @@
+'''On-disk storage for jobs due beyond the hot horizon, so that
+the daemon only keeps near-term jobs in memory.
+'''
+
+import collections
+import heapq
+import os
+import pickle
+
+
+COLD_DIR = '/var/lib/hatd/cold'
+
+
+class ColdStore:
+    '''Far-future jobs. Jobs are kept in segment files, one per
+    `segment_secs` wide window of run time (named after the window
+    start), as a stream of pickled add/remove records. A segment is
+    read back and deleted as a whole once its window comes within the
+    hot horizon. Only `{euid: {job_id: job_run_at}}` is kept in memory.
+    '''
+    def __init__(self, cold_dir=COLD_DIR, segment_secs=3600):
+        self.cold_dir = cold_dir
+        self.segment_secs = segment_secs
+        self.locations = collections.defaultdict(dict)
+        # Min-heap of segment window starts, and the same as a set
+        self._segments = []
+        self._segment_set = set()
+        # Segments read by `promote`, to be deleted by `discard_promoted`
+        self._promoted = []
+        # `{(euid, job_id): job_run_at}` of the jobs taken out by `take`,
+        # their removal to be written by `drop_taken`
+        self._taken = {}
+        # Segments written to since the last `sync`, and if any is new
+        self._unsynced = set()
+        self._created = False
+
+    def _window(self, job_run_at):
+        return job_run_at - job_run_at % self.segment_secs
+
+    def _segment_path(self, window):
+        return os.path.join(self.cold_dir, '{}.seg'.format(window))
+
+    def _append(self, window, record):
+        '''Appends `record` to the segment of `window`.'''
+        os.makedirs(self.cold_dir, mode=0o700, exist_ok=True)
+        with open(self._segment_path(window), 'ab') as f:
+            if not f.tell():
+                self._created = True
+            pickle.dump(record, f)
+        self._unsynced.add(window)
+        if window not in self._segment_set:
+            self._segment_set.add(window)
+            heapq.heappush(self._segments, window)
+
+    def sync(self, fsync=True):
+        '''Makes the records written since the last call durable (with
+        `fsync`), to be called before the changes are committed elsewhere.
+        '''
+        if fsync:
+            for window in self._unsynced:
+                try:
+                    fd = os.open(self._segment_path(window), os.O_RDONLY)
+                except FileNotFoundError:
+                    continue
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            if self._created:
+                # The names of the new segments
+                fd = os.open(self.cold_dir, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        self._unsynced.clear()
+        self._created = False
+
+    def _read_segment(self, window):
+        '''Returns `{(euid, job_id): job}` of the segment of `window`,
+        after applying all of its records in order.
+        '''
+        jobs = {}
+        try:
+            with open(self._segment_path(window), 'rb') as f:
+                while True:
+                    try:
+                        op, euid, job_id, job = pickle.load(f)
+                    # A torn last record (crash mid-write) ends the segment
+                    except (EOFError, pickle.UnpicklingError):
+                        break
+                    if op == 'add':
+                        jobs[(euid, job_id)] = job
+                    else:
+                        jobs.pop((euid, job_id), None)
+        except FileNotFoundError:
+            pass
+        return jobs
+
+    def load_steps(self):
+        '''Rebuilds the in-memory job locations from the segments,
+        earliest first; a generator, yielding the jobs of each segment
+        as `[(euid, job_id, job), ...]`.
+        '''
+        try:
+            names = os.listdir(self.cold_dir)
+        except FileNotFoundError:
+            return
+        windows = sorted(int(name[:-len('.seg')]) for name in names
+                         if name.endswith('.seg'))
+        for window in windows:
+            entries = [(euid, job_id, job) for (euid, job_id), job
+                       in self._read_segment(window).items()]
+            for euid, job_id, job in entries:
+                self.locations[euid][job_id] = job.job_run_at
+            self._segment_set.add(window)
+            heapq.heappush(self._segments, window)
+            yield entries
+
+    def load(self):
+        '''Rebuilds the in-memory job locations from the segments.'''
+        for _ in self.load_steps():
+            pass
+
+    def is_cold(self, job_run_at, horizon_end):
+        '''Checks if a job running at `job_run_at` belongs here, given
+        that everything before `horizon_end` is kept in memory.
+        '''
+        return self._window(job_run_at) >= horizon_end
+
+    def __contains__(self, key):
+        euid, job_id = key
+        return job_id in self.locations.get(euid, {})
+
+    def add(self, euid, job_id, job):
+        '''Saves (or replaces) a job.'''
+        if (euid, job_id) in self:
+            self.remove(euid, job_id)
+        # Taken out and back again, the removal goes first
+        job_run_at = self._taken.pop((euid, job_id), None)
+        if job_run_at is not None:
+            self._append(self._window(job_run_at),
+                         ('remove', euid, job_id, None))
+        self._append(self._window(job.job_run_at),
+                     ('add', euid, job_id, job))
+        self.locations[euid][job_id] = job.job_run_at
+
+    def remove(self, euid, job_id):
+        '''Removes a job, raises KeyError if there is no such job.'''
+        job_run_at = self.locations[euid].pop(job_id)
+        self._append(self._window(job_run_at),
+                     ('remove', euid, job_id, None))
+
+    def take(self, euid, job_id):
+        '''Takes a job out to be kept elsewhere, raises KeyError if
+        there is no such job. Its removal is only written by `drop_taken`,
+        once the job is saved elsewhere; a crash in between leaves the
+        job in both places rather than in none.
+        '''
+        self._taken[(euid, job_id)] = self.locations[euid].pop(job_id)
+
+    def drop_taken(self):
+        '''Writes the removal of the jobs taken out by `take`.'''
+        for (euid, job_id), job_run_at in self._taken.items():
+            window = self._window(job_run_at)
+            # Deleted as a whole anyway
+            if window not in self._promoted:
+                self._append(window, ('remove', euid, job_id, None))
+        self._taken.clear()
+
+    def get(self, euid, job_id):
+        '''Returns the job, or None if there is no such job.'''
+        job_run_at = self.locations.get(euid, {}).get(job_id)
+        if job_run_at is None:
+            return None
+        return self._read_segment(self._window(job_run_at))[(euid, job_id)]
+
+    def job_ids(self, euid):
+        return self.locations.get(euid, {}).keys()
+
+    def run_times(self, euid):
+        '''Returns `{job_id: job_run_at}` of the jobs of `euid`.'''
+        return self.locations.get(euid, {})
+
+    def get_many(self, euid, job_ids):
+        '''Returns the jobs of `euid` with the given IDs (the ones
+        here) as `{job_id: job}`, reading each segment only once.
+        '''
+        locations = self.locations.get(euid, {})
+        wanted = collections.defaultdict(list)
+        for job_id in job_ids:
+            if job_id in locations:
+                wanted[self._window(locations[job_id])].append(job_id)
+        jobs = {}
+        for window, window_ids in wanted.items():
+            segment = self._read_segment(window)
+            for job_id in window_ids:
+                jobs[job_id] = segment[(euid, job_id)]
+        return jobs
+
+    def jobs(self, euid):
+        '''Returns all jobs of `euid` as `{job_id: job}`.'''
+        jobs = {}
+        windows = {self._window(job_run_at)
+                   for job_run_at in self.locations.get(euid, {}).values()}
+        for window in sorted(windows):
+            for (euid_, job_id), job in self._read_segment(window).items():
+                if euid_ == euid:
+                    jobs[job_id] = job
+        return jobs
+
+    def next_window(self):
+        '''Returns the start of the earliest segment window, or None.'''
+        return self._segments[0] if self._segments else None
+
+    def promote(self, horizon_end):
+        '''Takes out all jobs of the segments with window starting
+        before `horizon_end`, returns those as `[(euid, job_id, job), ...]`.
+        The segment files are kept until `discard_promoted` is called,
+        so that those can be deleted once the jobs are saved elsewhere.
+        '''
+        promoted = []
+        while self._segments and self._segments[0] < horizon_end:
+            window = heapq.heappop(self._segments)
+            self._segment_set.discard(window)
+            for (euid, job_id), job in self._read_segment(window).items():
+                if self.locations.get(euid, {}).get(job_id) == \
+                   job.job_run_at:
+                    del self.locations[euid][job_id]
+                    promoted.append((euid, job_id, job))
+            self._promoted.append(window)
+        return promoted
+
+    def discard_promoted(self):
+        '''Deletes the segments taken out by `promote`.'''
+        for window in self._promoted:
+            try:
+                os.remove(self._segment_path(window))
+            except FileNotFoundError:
+                pass
+        self._promoted = []
+
+
+if __name__ == '__main__':
+    pass
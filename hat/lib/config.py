@@ -0,0 +1,95 @@
+'''Daemon configuration. Options are read from the `[hatd]`
+section of `/etc/hatd/hatd.conf` (if present), anything
+missing falls back to the defaults here.
+'''
+
+import configparser
+
+
+CONFIG_FILE = '/etc/hatd/hatd.conf'
+
+# Option: default value; the type of the default
+# dictates how the configured value is parsed
+DEFAULTS = {
+    # Where the jobs are kept: `memory` (in-memory table with
+    # snapshot, journal and on-disk far-future jobs), or `sqlite`
+    'job_store': 'memory',
+    # Jobs due within this many secs are kept in memory,
+    # later ones are kept on disk until they come in range
+    'hot_horizon': 86400,
+    # Width (in secs of run time) of each on-disk job segment
+    'cold_segment_secs': 3600,
+    # Maximum number of jobs running at once, due jobs
+    # beyond that wait in the daemon for their turn
+    'max_running_jobs': 32,
+    # Batch jobs are admitted only while the 1 min load average
+    # per CPU, or the CPU pressure (`some avg10` %, preferred if
+    # available), is below these
+    'batch_max_loadavg': 0.8,
+    'batch_max_cpu_pressure': 10.0,
+    # Secs between admissions of held batch jobs
+    'batch_check_interval': 5,
+    # Overdue non-exact jobs (e.g. after downtime) are released at
+    # most this many per sec, 0 for no limit; each release is delayed
+    # by a random 0 to `catchup_jitter` secs more
+    'catchup_rate': 2.0,
+    'catchup_jitter': 0.0,
+    # fsync the job journal on every commit
+    'journal_fsync': True,
+    # Secs to wait for more changes before committing them
+    # together (group commit), 0 to commit right away
+    'journal_commit_window': 0.0,
+    # Fold the journal into the snapshot after this many records
+    'journal_compact_records': 10000,
+    # Run the job runner in the daemon's process, on the event loop
+    # serving the clients, instead of a process of its own
+    'single_process': False,
+    # Bytes of a job's STDOUT, and of its STDERR, kept in the logs;
+    # the rest is dropped, with a note
+    'job_output_max_bytes': 1048576,
+    # Format of the job logs: `text` lines, or `ndjson` objects
+    'job_log_format': 'text',
+    # Log records are buffered, and written out every this many secs,
+    # or once this many bytes are buffered
+    'log_flush_interval': 0.2,
+    'log_buffer_bytes': 65536,
+}
+
+_config = None
+
+
+def _load_config(config_file):
+    '''Reads the config file, returns the options
+    dict with defaults filled in.
+    '''
+    parser = configparser.ConfigParser()
+    # Non-existent file is not an error, defaults it is
+    parser.read(config_file)
+    config = dict(DEFAULTS)
+    if not parser.has_section('hatd'):
+        return config
+    section = parser['hatd']
+    for option, default in DEFAULTS.items():
+        if option not in section:
+            continue
+        if isinstance(default, bool):
+            config[option] = section.getboolean(option)
+        elif isinstance(default, int):
+            config[option] = section.getint(option)
+        elif isinstance(default, float):
+            config[option] = section.getfloat(option)
+        else:
+            config[option] = section.get(option)
+    return config
+
+
+def get_config(option):
+    '''Returns the configured value of `option`.'''
+    global _config
+    if _config is None:
+        _config = _load_config(CONFIG_FILE)
+    return _config[option]
+
+
+if __name__ == '__main__':
+    pass
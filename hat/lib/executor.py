@@ -0,0 +1,81 @@
+'''Bounded execution of due jobs.'''
+
+import collections
+import time
+
+
+class JobExecutor:
+    '''Starts due jobs through `launch`, with at most `max_workers`
+    of those running at a time; the rest wait their turn in a FIFO
+    pending queue. `launch` takes a pending item and returns the
+    started `multiprocessing.Process`, or None if there's nothing
+    to run anymore (e.g. the job was removed meanwhile).
+    '''
+    def __init__(self, launch, max_workers):
+        self.launch = launch
+        self.max_workers = max_workers
+        # (queued at (monotonic), item)
+        self.pending = collections.deque()
+        self.running = []
+        # Counters for `stats`
+        self.started = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def submit(self, item):
+        '''Queues `item` to be started when there is room.'''
+        self.pending.append((time.monotonic(), item))
+
+    def _reap(self):
+        '''Joins the finished processes.'''
+        still_running = []
+        for proc in self.running:
+            if proc.is_alive():
+                still_running.append(proc)
+            else:
+                proc.join()
+        self.running = still_running
+
+    def run_pending(self):
+        '''Starts pending items while there is room, returns the
+        list of items started.
+        '''
+        self._reap()
+        started = []
+        while self.pending and len(self.running) < self.max_workers:
+            queued_at, item = self.pending.popleft()
+            proc = self.launch(item)
+            if proc is None:
+                continue
+            waited = time.monotonic() - queued_at
+            self.started += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.running.append(proc)
+            started.append(item)
+        return started
+
+    def sentinels(self):
+        '''Returns the fds that become ready when a running job
+        ends, to wait on along with other input.
+        '''
+        return [proc.sentinel for proc in self.running]
+
+    def stats(self):
+        '''Returns the queue depth and wait times as a dict.'''
+        oldest_wait = time.monotonic() - self.pending[0][0] \
+            if self.pending else 0.0
+        return {
+            'max_workers': self.max_workers,
+            'running': len(self.running),
+            'pending': len(self.pending),
+            'oldest_pending_wait': round(oldest_wait, 3),
+            'started': self.started,
+            'mean_wait': round(self.wait_total / self.started, 3)
+            if self.started else 0.0,
+            'max_wait': round(self.wait_max, 3),
+        }
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,170 @@
+'''Collecting the output of running jobs into the users' logs.'''
+
+import codecs
+import datetime
+import io
+import json
+import os
+import selectors
+import shutil
+import tempfile
+
+from .logindex import note_record
+from .utils import file_lock, write_file
+
+
+# Bytes read from a job's pipe, or copied into the log, at a time
+OUTPUT_CHUNK = 65536
+# Records up to this many bytes of output go through `write_file` (and
+# the log writer); larger ones are copied in by the job's process
+SMALL_RECORD = 65536
+
+
+class OutputSpool:
+    '''The output of a job on one stream, kept in an unnamed temporary
+    file in `spool_dir` as it comes, so that memory stays flat however
+    chatty the job is. Only the first `max_bytes` are kept, the rest
+    is counted and dropped. Undecodable bytes are escaped (as `\\xNN`),
+    so that the log stays UTF-8 text.
+    '''
+    def __init__(self, spool_dir, max_bytes):
+        self.file = tempfile.TemporaryFile(dir=spool_dir)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.dropped = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')(
+            errors='backslashreplace')
+
+    def feed(self, data, final=False):
+        '''Takes the next `data` read, `final` once the stream ends.'''
+        if self.dropped:
+            # Full, no need to decode the rest
+            self.dropped += len(data)
+            return
+        data = self._decoder.decode(data, final).encode('utf-8')
+        room = self.max_bytes - self.size
+        if len(data) > room:
+            # Not cutting a character in two
+            kept = data[:max(room, 0)].decode('utf-8', 'ignore') \
+                .encode('utf-8')
+            self.dropped += len(data) - len(kept)
+            data = kept
+        self.file.write(data)
+        self.size += len(data)
+
+    def __bool__(self):
+        return bool(self.size or self.dropped)
+
+    def copy_to(self, f):
+        '''Writes the kept output, and the truncation marker if
+        anything was dropped, to the binary file `f`.
+        '''
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, f, OUTPUT_CHUNK)
+        if self.dropped:
+            f.write('\n[hat: output truncated at {} bytes, {} more bytes '
+                    'dropped]'.format(self.size, self.dropped)
+                    .encode('utf-8'))
+
+    def text_chunks(self):
+        '''Yields the kept output as text, a chunk at a time.'''
+        self.file.seek(0)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+            data = self.file.read(OUTPUT_CHUNK)
+            text = decoder.decode(data, not data)
+            if text:
+                yield text
+            if not data:
+                return
+
+    def close(self):
+        self.file.close()
+
+
+def pump_output(spools):
+    '''Reads the pipes of `spools`, `{pipe: OutputSpool}`, as data
+    comes on either, till all are closed.
+    '''
+    with selectors.DefaultSelector() as selector:
+        for pipe, spool in spools.items():
+            selector.register(pipe, selectors.EVENT_READ, spool)
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fd, OUTPUT_CHUNK)
+                if data:
+                    key.data.feed(data)
+                    continue
+                key.data.feed(b'', final=True)
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+
+
+def write_output_record(log_file, fields, spool, ndjson=False):
+    '''Appends a log record of a job to `log_file`: `fields` (euid,
+    job_id, scheduled, command, returncode, duration) and the output in
+    `spool`, under the lock of the file, as other jobs of the user
+    append there too. The record is a text line, `<date> : euid>.. :
+    id>.. : time>.. : cmd>.. : ret>.. :: out><output>`, or with
+    `ndjson` a JSON object line (see `ndjson_record`). Large output is
+    copied over from `spool` in chunks.
+    '''
+    run = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if ndjson:
+        record = ndjson_record(run, fields, spool.dropped)
+    else:
+        header = 'euid>{euid} : id>{job_id} : time>{scheduled} : ' \
+            'cmd>{command} : ret>{returncode}'.format(**fields)
+    if spool.size <= SMALL_RECORD:
+        if ndjson:
+            record['out'] = ''.join(spool.text_chunks())
+            write_file(log_file, record, mode='at', nodate=True,
+                       json_dumps=True, lock=True, index=True)
+            return
+        output = io.BytesIO()
+        spool.copy_to(output)
+        write_file(log_file, '{} :: out>{}'.format(
+            header, output.getvalue().decode('utf-8')), mode='at', lock=True,
+            index=True)
+        return
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    with file_lock(log_file), open(log_file, 'ab') as f:
+        if ndjson:
+            start = '{}, "out": "'.format(json.dumps(record)[:-1])
+        else:
+            start = '{} : {} :: out>'.format(run, header)
+        start = start.encode('utf-8')
+        note_record(log_file, f.tell(), start)
+        f.write(start)
+        if ndjson:
+            # `out` goes last, escaped a chunk at a time
+            for text in spool.text_chunks():
+                f.write(json.dumps(text)[1:-1].encode('utf-8'))
+            f.write(b'"}\n')
+            return
+        spool.copy_to(f)
+        f.write(b'\n')
+
+
+def ndjson_record(run, fields, dropped):
+    '''Returns the dict of a job\'s NDJSON log record, but the
+    output (`out`, last). `run` (logged at, as the job ended) and
+    `scheduled` come first, as `YYYY-mm-dd HH:MM:SS` strings, so that
+    readers can compare them without parsing the line (see
+    `hat-parser`); `dropped` is the number of output bytes past
+    `job_output_max_bytes`.
+    '''
+    return {
+        'run': run,
+        'scheduled': fields['scheduled'],
+        'euid': int(fields['euid']),
+        'job_id': int(fields['job_id']),
+        'command': fields['command'],
+        'returncode': fields['returncode'],
+        'duration': round(fields['duration'], 3),
+        'dropped': dropped,
+    }
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,61 @@
+'''Compact in-memory record of an enqueued job.'''
+
+import sys
+
+
+def _intern(value):
+    '''Interns strings, so that jobs with the same command
+    (or shell) share one string object.
+    '''
+    return sys.intern(value) if type(value) is str else value
+
+
+class JobRecord:
+    '''A job as kept by the scheduler: command, run time (Epoch),
+    shell (or False), and the exact and batch flags. Slotted, and
+    with the command and shell interned, this takes a fraction of
+    the memory of a dict per job. Use `as_dict` where a dict is
+    needed e.g. for JSON.
+    '''
+    __slots__ = ('command', 'job_run_at', 'use_shell', 'exact', 'batch')
+
+    def __init__(self, command, job_run_at, use_shell=False, exact=False,
+                 batch=False):
+        self.command = _intern(command)
+        self.job_run_at = job_run_at
+        self.use_shell = _intern(use_shell)
+        self.exact = exact
+        self.batch = batch
+
+    @classmethod
+    def from_dict(cls, job):
+        '''Returns a record of the `job` dict (see `as_dict`).'''
+        return cls(job['command'], job['job_run_at'],
+                   job.get('use_shell', False), job.get('exact', False),
+                   job.get('batch', False))
+
+    def as_dict(self):
+        return {
+            'command': self.command,
+            'job_run_at': self.job_run_at,
+            'use_shell': self.use_shell,
+            'exact': self.exact,
+            'batch': self.batch,
+        }
+
+    def __reduce__(self):
+        # Pickled as the bare fields, re-interned when loaded
+        return (JobRecord, (self.command, self.job_run_at, self.use_shell,
+                            self.exact, self.batch))
+
+    def __eq__(self, other):
+        if not isinstance(other, JobRecord):
+            return NotImplemented
+        return self.__reduce__()[1] == other.__reduce__()[1]
+
+    def __repr__(self):
+        return 'JobRecord({!r})'.format(self.as_dict())
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,143 @@
+'''Append-only journal of changes to the in-memory job table, so
+that saving a change costs the same whatever the queue size. The
+journal is folded into the snapshot (`hatdb.pkl`) now and then.
+'''
+
+import json
+import os
+
+
+JOURNAL_FILE = '/var/lib/hatd/hatdb.journal'
+
+
+class Journal:
+    '''Buffers add/modify/remove records, and writes them out (with
+    a single fsync, if enabled) on `commit`, so that all changes made
+    in between share one write. Records are JSON lines of
+    `[op, euid, job_id, job]`.
+    '''
+    def __init__(self, journal_file=JOURNAL_FILE, fsync=True):
+        self.journal_file = journal_file
+        self.old_file = '{}.old'.format(journal_file)
+        self.fsync = fsync
+        self._buffer = []
+        self._drop_torn_record()
+        # Records in the journal file, to decide on compaction
+        self.records = self._count_records()
+        self._f = open(self.journal_file, 'ab')
+
+    def _count_records(self):
+        try:
+            with open(self.journal_file, 'rb') as f:
+                return sum(chunk.count(b'\n')
+                           for chunk in iter(lambda: f.read(1 << 20), b''))
+        except FileNotFoundError:
+            return 0
+
+    def _drop_torn_record(self):
+        '''Truncates a partially written last record (crash mid-write),
+        so that new records don't get glued to it.
+        '''
+        try:
+            with open(self.journal_file, 'rb+') as f:
+                size = f.seek(0, os.SEEK_END)
+                if not size:
+                    return
+                f.seek(max(size - 65536, 0))
+                tail = f.read()
+                if tail.endswith(b'\n'):
+                    return
+                newline = tail.rfind(b'\n')
+                if newline == -1 and size > len(tail):
+                    # A very long torn record, finding its start the slow way
+                    f.seek(0)
+                    whole = f.read()
+                    f.truncate(whole.rfind(b'\n') + 1)
+                else:
+                    f.truncate(size - len(tail) + newline + 1)
+        except FileNotFoundError:
+            pass
+
+    def append(self, op, euid, job_id, job=None):
+        '''Buffers a record, to be written by `commit`.'''
+        self._buffer.append('{}\n'.format(
+            json.dumps([op, euid, job_id, job])))
+
+    @property
+    def pending(self):
+        return bool(self._buffer)
+
+    def commit(self):
+        '''Writes out the buffered records; returns True if there
+        was anything to write.
+        '''
+        if not self._buffer:
+            return False
+        self._f.write(''.join(self._buffer).encode('utf-8'))
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
+        self.records += len(self._buffer)
+        self._buffer = []
+        return True
+
+    def rotate(self):
+        '''Moves the records aside to the `.old` journal to be
+        compacted, and starts an empty journal.
+        '''
+        self.commit()
+        self._f.close()
+        if os.path.exists(self.old_file):
+            # The previous compaction didn't finish, keeping its records
+            with open(self.journal_file, 'rb') as src, \
+                 open(self.old_file, 'ab') as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.truncate(self.journal_file, 0)
+        else:
+            os.replace(self.journal_file, self.old_file)
+        self._f = open(self.journal_file, 'ab')
+        self.records = 0
+
+    def drop_old(self):
+        '''Removes the `.old` journal, once compacted.'''
+        try:
+            os.remove(self.old_file)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        self.commit()
+        self._f.close()
+
+
+def replay(journal_file, jobs, keep_removed=False):
+    '''Applies the records of `journal_file` to the `jobs` table
+    (`{euid: {job_id: job}}`), in order; returns the number of
+    records applied. With `keep_removed`, removed jobs are kept
+    with None as the job. A torn last record (crash mid-write)
+    ends the replay.
+    '''
+    applied = 0
+    try:
+        with open(journal_file, 'rb') as f:
+            for line in f:
+                try:
+                    op, euid, job_id, job = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                if op == 'remove' and not keep_removed:
+                    jobs[euid].pop(job_id, None)
+                elif op == 'remove':
+                    jobs[euid][job_id] = None
+                else:
+                    jobs[euid][job_id] = job
+                applied += 1
+    except FileNotFoundError:
+        pass
+    return applied
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,167 @@
+'''Sparse time index of the job logs, for seeking to a time in them.
+
+The index of a log is a sidecar file, `<log>.idx`, of lines
+`<YYYY-mm-dd HH:MM:SS> <offset>`: the run time of the record starting
+at byte `offset` of the log, one per `INDEX_EVERY` bytes or so. Records
+are appended as jobs end, so run times go up along the log.
+'''
+
+import bisect
+import os
+import re
+
+
+# Bytes of log between the records indexed
+INDEX_EVERY = 65536
+# Secs run times may go back along a log (records are timed as made,
+# and may be written out a little later, by another process)
+INDEX_SLACK = 60
+# Bytes left to scan through when binary searching a log
+BISECT_MIN = 4096
+# Start of a record, text or NDJSON (see `lib/joboutput.py`)
+RECORD_START = re.compile(
+    rb'(?:\{"run": ")?(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?: : euid>|", )')
+
+
+def index_path(log_file):
+    return '{}.idx'.format(log_file)
+
+
+def record_time(line):
+    '''Returns the run time (`YYYY-mm-dd HH:MM:SS`) of the record
+    starting with `line` (bytes), None if it does not start one.
+    '''
+    match = RECORD_START.match(line)
+    return match.group(1).decode('ascii') if match else None
+
+
+def read_index(log_file):
+    '''Returns the entries of the index of `log_file`, as
+    `[(time, offset), ...]`; none if it has no index.
+    '''
+    try:
+        with open(index_path(log_file), 'rb') as f:
+            lines = f.read().decode('ascii', 'replace').splitlines()
+    except OSError:
+        return []
+    entries = []
+    for line in lines:
+        time_, _, offset = line.rpartition(' ')
+        if offset.isdigit():
+            entries.append((time_, int(offset)))
+    return entries
+
+
+def _last_entry(log_file):
+    try:
+        with open(index_path(log_file), 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(size - 64, 0))
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    if not lines:
+        return None
+    time_, _, offset = lines[-1].decode('ascii', 'replace').rpartition(' ')
+    return (time_, int(offset)) if offset.isdigit() else None
+
+
+def note_record(log_file, offset, record):
+    '''Indexes the record `record` (bytes, the start of it at least)
+    just written at `offset` of `log_file`, if it's `INDEX_EVERY` bytes
+    past the last one indexed; to be called under the lock of the log.
+    '''
+    time_ = record_time(record)
+    if time_ is None:
+        return
+    last = _last_entry(log_file)
+    mode = 'ab'
+    if last is not None:
+        if offset - last[1] < INDEX_EVERY and offset >= last[1]:
+            return
+        if offset < last[1]:
+            # The log was truncated or replaced
+            mode = 'wb'
+    with open(index_path(log_file), mode, buffering=0) as f:
+        f.write('{} {}\n'.format(time_, offset).encode('ascii'))
+
+
+def build_index(log_file):
+    '''(Re)builds the index of `log_file` from scratch; returns
+    the number of entries.
+    '''
+    entries = []
+    next_at = 0
+    with open(log_file, 'rb') as f:
+        offset = 0
+        for line in f:
+            if offset >= next_at:
+                time_ = record_time(line)
+                if time_ is not None:
+                    entries.append('{} {}\n'.format(time_, offset))
+                    next_at = offset + INDEX_EVERY
+            offset += len(line)
+    tmp_file = '{}.tmp'.format(index_path(log_file))
+    with open(tmp_file, 'w') as f:
+        f.writelines(entries)
+    os.replace(tmp_file, index_path(log_file))
+    return len(entries)
+
+
+def _next_record(f, offset, limit):
+    '''Returns `(time, offset)` of the first record starting in
+    `f` after `offset` (past the line it's in) and before `limit`.
+    '''
+    f.seek(offset)
+    if offset:
+        f.readline()
+    position = f.tell()
+    while position < limit:
+        line = f.readline()
+        if not line:
+            break
+        time_ = record_time(line)
+        if time_ is not None:
+            return time_, position
+        position += len(line)
+    return None
+
+
+def bisect_offset(f, start):
+    '''Returns the offset to read the log `f` (binary, seekable)
+    from for the records run at `start` or later, binary searching
+    it; all records before it run before `start`.
+    '''
+    lo, hi = 0, f.seek(0, os.SEEK_END)
+    while hi - lo > BISECT_MIN:
+        found = _next_record(f, (lo + hi) // 2, hi)
+        if found is None or found[0] >= start:
+            hi = (lo + hi) // 2
+        else:
+            lo = found[1]
+    return lo
+
+
+def seek_offset(f, log_file, start):
+    '''Returns the offset to read the log `f` (binary, seekable) of
+    `log_file` from for the records run at `start` (`YYYY-mm-dd
+    HH:MM:SS`) or later: from its index if it has a valid one,
+    binary searching it otherwise. `start` should be less
+    `INDEX_SLACK`, to allow for records out of order.
+    '''
+    entries = read_index(log_file)
+    if not entries:
+        return bisect_offset(f, start)
+    i = bisect.bisect_left(entries, (start, -1))
+    if not i:
+        return 0
+    time_, offset = entries[i - 1]
+    # Stale (e.g. the log was replaced)?
+    f.seek(offset)
+    if record_time(f.readline()) != time_:
+        return bisect_offset(f, start)
+    return offset
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,244 @@
+'''Buffered writing of the logs, in a thread of the daemon's processes.'''
+
+import collections
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from . import utils
+from .logindex import note_record
+
+
+# Secs records may wait in the buffer before being written out
+LOG_FLUSH_INTERVAL = 0.2
+# Where records that could not be written are reported
+DAEMON_LOG = '/var/log/hatd/daemon.log'
+# Buffered bytes (all files) that get written out right away
+LOG_BUFFER_BYTES = 65536
+# Most log files kept open; the least recently written are closed
+LOG_MAX_OPEN = 64
+# Secs a log file is kept open with nothing written to it
+LOG_IDLE_SECS = 60
+# Most secs `stop` waits for the records to be written out
+LOG_STOP_TIMEOUT = 5
+
+_STOP = None
+
+
+class LogWriter:
+    '''Appends the log records handed to `write`, from a thread of
+    its own: records are taken through a queue, buffered, and written
+    out together every `interval` secs (or on `max_buffer` bytes), one
+    write per file, to files kept open. A file is reopened once it's
+    gone or replaced (rotated). Records with `lock` are written under
+    the `utils.file_lock` of the file, once per write out; those with
+    `index` are noted in the time index of the file (see
+    `lib/logindex.py`).
+
+    Child processes (the jobs) hand their records over through a pipe,
+    read by another thread. Once stopping, records are written
+    directly instead.
+    '''
+    def __init__(self, interval=LOG_FLUSH_INTERVAL,
+                 max_buffer=LOG_BUFFER_BYTES):
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self._pid = os.getpid()
+        self._queue = queue.SimpleQueue()
+        self._children_queue = multiprocessing.SimpleQueue()
+        # Set by `stop`, seen by the child processes too
+        self._stopped = multiprocessing.Event()
+        # Path: [records (bytes)], and if any needs the lock, or indexing
+        self._pending = {}
+        self._locked = set()
+        self._indexed = set()
+        self._pending_bytes = 0
+        # Path: (fd, (st_dev, st_ino), last written at), in LRU order
+        self._files = collections.OrderedDict()
+        self._threads = []
+
+    def start(self):
+        for target in (self._run, self._forward):
+            thread = threading.Thread(target=target, name='hatd-log',
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=LOG_STOP_TIMEOUT):
+        '''Writes out everything taken so far, and ends the threads;
+        waits `timeout` secs at most (e.g. for a lock held elsewhere),
+        returns if all was written out. Records taken from then on are
+        written directly by `write`; only those of a child process
+        racing the stop may be lost.
+        '''
+        self._stopped.set()
+        deadline = time.monotonic() + timeout
+        self._children_queue.put(_STOP)
+        self._threads[1].join(timeout)
+        self._queue.put(_STOP)
+        self._threads[0].join(max(deadline - time.monotonic(), 0))
+        if any(thread.is_alive() for thread in self._threads):
+            self._report('Log writer not stopped in {} secs, buffered '
+                         'records may be lost'.format(timeout))
+            return False
+        return True
+
+    def write(self, file_path, data, lock=False, index=False):
+        '''Takes the record `data` (bytes, whole lines) to append to
+        `file_path`; written directly if handed over from a process
+        that can't (or no longer can) reach the thread.
+        '''
+        record = (file_path, data, lock, index)
+        if self._stopped.is_set():
+            utils.append_direct(file_path, data, lock, index)
+        elif os.getpid() == self._pid:
+            self._queue.put(record)
+        elif os.getppid() == self._pid:
+            self._children_queue.put(record)
+        else:
+            utils.append_direct(file_path, data, lock, index)
+
+    def _forward(self):
+        while True:
+            record = self._children_queue.get()
+            if record is _STOP:
+                # Handed over while stopping
+                while not self._children_queue.empty():
+                    self._queue.put(self._children_queue.get())
+                return
+            self._queue.put(record)
+
+    def _run(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else \
+                max(deadline - time.monotonic(), 0)
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = ()
+            if record is _STOP:
+                # Taken while stopping
+                while True:
+                    try:
+                        self._add(*self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._flush()
+                self._close_all()
+                return
+            if record:
+                self._add(*record)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+            if self._pending_bytes >= self.max_buffer or (
+                    deadline is not None and time.monotonic() >= deadline):
+                self._flush()
+                deadline = None
+
+    def _add(self, file_path, data, lock=False, index=False):
+        self._pending.setdefault(file_path, []).append(data)
+        if lock:
+            self._locked.add(file_path)
+        if index:
+            self._indexed.add(file_path)
+        self._pending_bytes += len(data)
+
+    def _flush(self):
+        now = time.monotonic()
+        for file_path, records in self._pending.items():
+            data = b''.join(records)
+            try:
+                if file_path in self._locked:
+                    with utils.file_lock(file_path):
+                        offset = self._append(file_path, data, now)
+                        if file_path in self._indexed:
+                            # The first record of the lot, at least
+                            note_record(file_path, offset, records[0])
+                else:
+                    self._append(file_path, data, now)
+            except OSError as e:
+                self._close(file_path)
+                self._report('Log records to {} lost: {}'.format(file_path,
+                                                                 e))
+        self._pending.clear()
+        self._locked.clear()
+        self._indexed.clear()
+        self._pending_bytes = 0
+        for file_path, (_, _, written_at) in list(self._files.items()):
+            if now - written_at < LOG_IDLE_SECS and \
+                    len(self._files) <= LOG_MAX_OPEN:
+                break
+            self._close(file_path)
+
+    def _report(self, msg):
+        # Straight to the daemon log: `write_file` would queue it here
+        try:
+            utils.append_direct(DAEMON_LOG, utils.log_line(msg))
+        except OSError:
+            pass
+
+    def _append(self, file_path, data, now):
+        fd = self._open(file_path)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        self._files[file_path] = (fd, self._files[file_path][1], now)
+        self._files.move_to_end(file_path)
+        # Where the lot landed, as other processes append too
+        return os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+
+    def _open(self, file_path):
+        '''Returns the fd of `file_path`, reopened if rotated.'''
+        try:
+            stat = os.stat(file_path)
+            file_id = (stat.st_dev, stat.st_ino)
+        except FileNotFoundError:
+            file_id = None
+        if file_path in self._files:
+            if self._files[file_path][1] == file_id:
+                return self._files[file_path][0]
+            self._close(file_path)
+        os.makedirs(os.path.dirname(file_path), mode=0o755, exist_ok=True)
+        fd = os.open(file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o666)
+        stat = os.fstat(fd)
+        self._files[file_path] = (fd, (stat.st_dev, stat.st_ino), None)
+        return fd
+
+    def _close(self, file_path):
+        entry = self._files.pop(file_path, None)
+        if entry is not None:
+            os.close(entry[0])
+
+    def _close_all(self):
+        for file_path in list(self._files):
+            self._close(file_path)
+
+
+def start_log_writer(interval=LOG_FLUSH_INTERVAL,
+                     max_buffer=LOG_BUFFER_BYTES):
+    '''Starts a LogWriter for the appends of `utils.write_file` in
+    this process (and its children), returns it.
+    '''
+    writer = LogWriter(interval, max_buffer)
+    writer.start()
+    utils.set_log_writer(writer)
+    return writer
+
+
+def stop_log_writer(timeout=LOG_STOP_TIMEOUT):
+    '''Goes back to appending directly, and writes out the buffered
+    records, waiting `timeout` secs at most; returns if all was
+    written out.
+    '''
+    writer = utils.set_log_writer(None)
+    if writer is None:
+        return True
+    return writer.stop(timeout)
+
+
+if __name__ == '__main__':
+    pass
@@ -1,15 +1,38 @@
 '''The base job runner and associative stuffs.'''
 
+import asyncio
+import collections
+import heapq
 import json
 import multiprocessing
 import os
-import pickle
+import random
+import re
 import shlex
+import sqlite3
 import subprocess
 import time
 
-from .scheduler import Job, get_enqueued_jobs, remove_job, HatTimerException
-from .utils import FLock, write_file, username_from_euid
+from .config import get_config
+from .executor import JobExecutor
+from .joboutput import OutputSpool, pump_output, write_output_record
+from .logwriter import start_log_writer, stop_log_writer
+from .scheduler import (Job, cold_jobs, get_job, job_counts, list_jobs,
+                        match_jobs, remove_job, next_run_at, pop_due_jobs,
+                        promote_jobs, demote_jobs, open_db, commit_db,
+                        next_promotion_at, HatJobException,
+                        HatTimerException)
+from .sysload import spare_capacity
+from .users import hat_dir
+from .utils import FifoReader, write_file
+
+
+# Most jobs sent back in a page of `joblist`
+MAX_PAGE = 1000
+# Length of the `joblist` cursor, per sort key
+CURSOR_LENGTHS = {'time': 2, 'id': 1}
+# Secs a batch job takes to show in the 1 min load average, mostly
+BATCH_SETTLE_SECS = 60
 
 
 class HatRunnerException(Exception):
@@ -33,18 +56,39 @@ class BaseRunner(metaclass=BaseRunnerMeta):
         self.daemon_log = '/var/log/hatd/daemon.log'
         self.fifo_in = '/var/run/hatd/ipc/runner_in.fifo'
         self.fifo_out = '/var/run/hatd/ipc/runner_out.fifo'
-        self.daemon_in = '/var/run/hatd/ipc/daemon_in.fifo'
-        self.daemon_out = '/var/run/hatd/ipc/daemon_out.fifo'
         self.pickle_file = '/var/lib/hatd/hatdb.pkl'
         self._running = False
-
-    def _joblist_raw(self, euid):
-        return get_enqueued_jobs(euid)
+        self.executor = JobExecutor(self._launch_job,
+                                    get_config('max_running_jobs'))
+        # Due batch jobs, `(euid, job_id, job_run_at)`, waiting for the
+        # system load to go down; these stay enqueued till admitted
+        self.batch_held = collections.deque()
+        self._next_batch_check = 0
+        # When the batch jobs of the last `BATCH_SETTLE_SECS` were admitted
+        self._batch_admitted = collections.deque()
+        # Min-heap of overdue jobs, `(job_run_at, euid, job_id)`, released
+        # at `catchup_rate`; these stay enqueued till started
+        self.catchup = []
+        self._next_catchup = 0
+        # `load_db_steps` generator while loading the saved jobs
+        self._loader = None
+        # Jobs past their run time, not started yet (pending, held or
+        # caught up on), as `{(euid, job_id): job_run_at}`, and their
+        # number per user
+        self.due_jobs = {}
+        self.due_counts = collections.Counter()
 
     def start(self):
         '''Starting BaseRunner instance.'''
         self._running = True
-        self._runner(self.fifo_in, self.fifo_out)
+        # Saved jobs are loaded by `_runner`, a step per round
+        self._loader = open_db()
+        start_log_writer(get_config('log_flush_interval'),
+                         get_config('log_buffer_bytes'))
+        try:
+            self._runner(self.fifo_in, self.fifo_out)
+        finally:
+            stop_log_writer()
 
     def stop(self):
         '''Stopping BaseRunner instance.'''
@@ -54,195 +98,522 @@ class BaseRunner(metaclass=BaseRunnerMeta):
         time.sleep(1)
         return True
     
-    def _dump_db(self):
-        '''Dumping `enqueued_jobs` to
-        pickle file (when anything changes),
-        called from _runner.
-        '''
-        with FLock(self.pickle_file):
-            with open(self.pickle_file, 'wb') as fpkl:
-                pickle.dump(get_enqueued_jobs(-1), fpkl)
+    def _commit_db(self):
+        '''Committing the changes of `enqueued_jobs` (when
+        anything changes), called from _runner.
+        '''
+        commit_db(self.pickle_file)
         
+    def _load_step(self):
+        '''Runs the next step of loading the saved jobs, and
+        finishes off once everything's loaded.
+        '''
+        try:
+            next(self._loader)
+        except StopIteration:
+            self._loader = None
+            # Far-future jobs of a database saved before tiering
+            demote_jobs(time.time())
+
+    def _wait_timeout(self):
+        '''Returns the secs to wait for input before the next job
+        is due or the next on-disk jobs are to be loaded, None
+        (wait for input only) if there is nothing to wait for.
+        '''
+        deadlines = [at for at in (next_run_at(), next_promotion_at())
+                     if at is not None]
+        if self.batch_held:
+            deadlines.append(self._next_batch_check)
+        # With on-time jobs pending, a job ending wakes the runner
+        if self.catchup and not self.executor.pending:
+            deadlines.append(self._next_catchup)
+        if not deadlines:
+            return None
+        return max(min(deadlines) - time.time(), 0)
+
     def _runner(self, fifo_in, fifo_out):
-        '''The runner.'''
-        with open(fifo_in, 'rt') as fifo_in:
+        '''The runner. Sleeps until either there's input in
+        `fifo_in` or the next job is due, whichever comes first.
+        '''
+        with FifoReader(fifo_in) as fifo_in:
             while True:
                 if not self._running:
                     break
-                to_remove = set()
-                for line in fifo_in:
+                if self._loader is not None:
+                    # Jobs due soonest are loaded first, so those run
+                    # while the rest is loading; input waits till done
+                    self._load_step()
+                    lines = []
+                # A job ending makes room for the pending ones
+                elif fifo_in.wait(self._wait_timeout(),
+                                  self.executor.sentinels()):
+                    lines = fifo_in.readlines()
+                    lines.extend(self._linger(fifo_in))
+                else:
+                    lines = []
+                messages = []
+                for line in lines:
                     try:
-                        content = json.loads(line.strip())
+                        messages.append(json.loads(line.strip()))
                     except json.JSONDecodeError as e:
                         write_file(self.daemon_log, str(e), mode='at')
-                    else:
-                        if 4 <= len(content) <= 6:
-                            try:
-                                Job(
-                                    int(content['euid']),
-                                    content['exact'],
-                                    content['command'],
-                                    content['time_'],
-                                    content.get('use_shell', False),
-                                    content.get('job_id')
-                                )
-                            except (KeyError, HatTimerException) as e:
-                                write_file(
-                                    self.daemon_out,
-                                    {"error": {
-                                        "msg": str(e)
-                                    }
-                                    },
-                                    nodate=True,
-                                    json_dumps=True
-                                )
-                            else:
-                                self._dump_db()
-                                write_file(
-                                    self.daemon_out,
-                                    {"msg": "Done"},
-                                    nodate=True,
-                                    json_dumps=True
-                                )
-                        elif len(content) == 1:
-                            # {'joblist': euid}
-                            if 'joblist' in content:
-                                write_file(
-                                    fifo_out,
-                                    dict(self._joblist_raw(
-                                        int(content['joblist'])
-                                    )
-                                    ),
-                                    nodate=True,
-                                    json_dumps=True
-                                )
-                            # {'stop': True}
-                            elif 'stop' in content:
-                                self._running = False
-                            # {'remove': [(euid, job_id), ...]}
-                            elif 'remove' in content:
-                                for euid, job_id in content['remove']:
-                                    to_remove.add((euid, int(job_id)))
-                _jobs = self._joblist_raw(-1)
-                if _jobs:
-                    for euid, job_dict in _jobs.items():
-                        for job_id, job in job_dict.items():
-                            job_run_at = job['job_run_at']
-                            current_time = int(time.time())
-                            # Considering 2 secs margin for load etc.
-                            if (current_time - 2 <= job_run_at <=
-                                current_time) or (
-                                   job_run_at < current_time
-                                   and not job['exact']):
-                                multiprocessing.Process(
-                                    target=self.command_run_save,
-                                    args=(job['command'],),
-                                    kwargs={
-                                        'euid': euid,
-                                        'stdout_file':
-                                            '/home/{}/.hatd/logs/stdout.log'
-                                            .format(username_from_euid(euid)),
-                                        'stderr_file':
-                                            '/home/{}/.hatd/logs/stderr.log'
-                                            .format(username_from_euid(euid)),
-                                        'use_shell': job.get('use_shell',
-                                                             False),
-                                        'job_id': job_id,
-                                        'run_at': job['job_run_at'],
-                                    },
-                                ).start()
-                                to_remove.add((euid, job_id))
-                            if (job_run_at < current_time) and job['exact']:
-                                to_remove.add((euid, job_id))
-                if to_remove:
-                    for euid, job_id in to_remove:
-                        remove_job(euid, job_id)
-                    self._dump_db()
-                    # write_file(self.daemon_out,
-                    #            {"msg": "Done"},
-                    #            nodate=True,
-                    #            json_dumps=True
-                    # )
-                time.sleep(0.1)
+                replies = self._run_round(messages)
+                if replies:
+                    write_file(
+                        fifo_out,
+                        '\n'.join(json.dumps(reply) for reply in replies),
+                        nodate=True
+                    )
+
+    async def run_in_loop(self, inbox, send_replies):
+        '''The runner, as a task of the running event loop (see
+        `single_process`): takes the messages from the `inbox`
+        asyncio.Queue instead of `fifo_in`, and hands the replies of
+        each round to `send_replies`, once committed.
+        '''
+        self._running = True
+        self._loader = open_db()
+        while self._running:
+            if self._loader is not None:
+                self._load_step()
+                # Letting the requests in between the steps
+                await asyncio.sleep(0)
+                messages = []
+            else:
+                messages = await self._wait_messages(inbox)
+            replies = self._run_round(messages)
+            if replies:
+                send_replies(replies)
+
+    async def _wait_messages(self, inbox):
+        '''Waits until there are messages in `inbox`, the next job
+        is due or a job ends, like `_runner` does; returns the
+        messages (along with those of `journal_commit_window`).
+        '''
+        loop = asyncio.get_running_loop()
+        ended = loop.create_future()
+
+        def job_ended():
+            if not ended.done():
+                ended.set_result(None)
+        sentinels = self.executor.sentinels()
+        for fd in sentinels:
+            loop.add_reader(fd, job_ended)
+        getter = loop.create_task(inbox.get())
+        try:
+            await asyncio.wait((getter, ended), timeout=self._wait_timeout(),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for fd in sentinels:
+                loop.remove_reader(fd)
+            getter.cancel()
+        if not getter.done() or getter.cancelled():
+            return []
+        window = get_config('journal_commit_window')
+        if window > 0:
+            await asyncio.sleep(window)
+        messages = [getter.result()]
+        while not inbox.empty():
+            messages.append(inbox.get_nowait())
+        return messages
+
+    def _run_round(self, messages):
+        '''Handles the `messages` (dicts, from the daemon), starts the
+        due jobs, and commits all changes at once. Returns the replies,
+        `[{'req': ID, 'reply': ...}, ...]`, for the requests that came
+        with an ID (see `daemon.HatDaemon`), to be sent now that the
+        changes are committed.
+        '''
+        to_remove = set()
+        replies = []
+        for content in messages:
+            req = content.pop('req', None) \
+                if isinstance(content, dict) else None
+            # A bad message gets an error reply, the rest go on
+            try:
+                reply = self._handle_message(content, to_remove)
+            except Exception as e:
+                write_file(self.daemon_log, 'Bad message {!r}: {!r}'
+                           .format(content, e), mode='at')
+                if req is None:
+                    continue
+                reply = {"error": {"msg": "Invalid request"}}
+            if reply is not None:
+                replies.append({'req': req, 'reply': reply})
+        current_time = int(time.time())
+        # Bringing in on-disk jobs that are now within range
+        promoted = promote_jobs(current_time)
+        # Only the jobs at the front of the due index are looked at
+        for euid, job_id, job in pop_due_jobs(current_time):
+            job_run_at = job.job_run_at
+            # Already on its way (re-indexed, e.g. by a rebuild of the
+            # index or a modification keeping the run time)
+            if self.due_jobs.get((euid, job_id)) == job_run_at:
+                continue
+            # Considering 2 secs margin for load etc.
+            on_time = current_time - 2 <= job_run_at
+            if on_time or not job.exact:
+                # Stays enqueued till it's actually started
+                self._mark_due(euid, job_id, job_run_at)
+                if job.batch:
+                    self.batch_held.append((euid, job_id, job_run_at))
+                elif on_time:
+                    self.executor.submit((euid, job_id, job_run_at))
+                else:
+                    self._add_catchup((euid, job_id, job_run_at))
+            else:
+                # Exact, and missed
+                to_remove.add((euid, job_id))
+        self._admit_batch_jobs(time.time())
+        self._release_catchup(time.time())
+        for euid, job_id, _ in self.executor.run_pending():
+            to_remove.add((euid, job_id))
+        for euid, job_id in to_remove:
+            self._unmark_due(euid, job_id)
+            remove_job(euid, job_id)
+        # One commit for all changes of this round
+        self._commit_db()
+        if promoted:
+            cold_jobs.discard_promoted()
+        return replies
+
+    def _handle_message(self, content, to_remove):
+        '''Handles the `content` dict of a message, adding the jobs to
+        remove to `to_remove`; returns the reply, None if there is none.
+        '''
+        if 4 <= len(content) <= 7:
+            reply = self._add_job(content)
+            reply.pop('job_id', None)
+            return reply
+        if len(content) != 1:
+            return None
+        # {'add_jobs': [job, ...]}, a reply for each
+        if 'add_jobs' in content:
+            return [self._add_job(job) for job in content['add_jobs']]
+        # {'joblist': {'euid': euid, 'limit': n,
+        #              'cursor': [...], 'sort': key,
+        #              'filter': {...}}}
+        if 'joblist' in content:
+            return self._joblist_page(content['joblist'])
+        # {'jobcount': euid}
+        if 'jobcount' in content:
+            return self._job_counts(int(content['jobcount']))
+        # {'stats': True}
+        if 'stats' in content:
+            return self._stats()
+        # {'stop': True}
+        if 'stop' in content:
+            self._running = False
+        # {'remove': [(euid, job_id), ...]}
+        elif 'remove' in content:
+            to_remove.update([(int(euid), int(job_id))
+                              for euid, job_id in content['remove']])
+        # {'remove_matching': {'euid': euid, 'filter': {...}}}
+        elif 'remove_matching' in content:
+            value = content['remove_matching']
+            job_ids = self._match_jobs(value)
+            if isinstance(job_ids, dict):
+                return job_ids
+            euid = int(value['euid'])
+            to_remove.update((euid, job_id) for job_id in job_ids)
+            return {"msg": "Done", "count": len(job_ids)}
+        # {'modify_matching': {'euid': euid,
+        #                      'filter': {...},
+        #                      'job': {...}}}
+        elif 'modify_matching' in content:
+            return self._modify_matching(content['modify_matching'])
+        return None
+
+    def _add_job(self, content):
+        '''Adds (or modifies) the job of the `content` dict, returns
+        the reply: `{"msg": "Done", "job_id": ID}` or `{"error": ...}`.
+        '''
+        try:
+            job = Job(
+                int(content['euid']),
+                content['exact'],
+                content['command'],
+                content['time_'],
+                content.get('use_shell', False),
+                content.get('job_id'),
+                content.get('batch', False)
+            )
+        except (KeyError, TypeError, ValueError, HatJobException,
+                HatTimerException) as e:
+            return {"error": {
+                "msg": str(e)
+            }
+            }
+        if content.get('job_id'):
+            # Rescheduled while due: due again once re-indexed; with
+            # the same run time, it keeps its place
+            saved = get_job(job.euid, job.job_id)
+            if saved is None or \
+                    self.due_jobs.get((job.euid, job.job_id)) != \
+                    saved.job_run_at:
+                self._unmark_due(job.euid, job.job_id)
+        return {"msg": "Done", "job_id": job.job_id}
+
+    def _match_jobs(self, value):
+        '''Returns the IDs of the jobs matching the filter of a
+        `*_matching` request, or the error reply.
+        '''
+        filter_ = value.get('filter') or {}
+        if not filter_:
+            return {"error": {"msg": "No filter given"}}
+        try:
+            return match_jobs(int(value['euid']), **filter_)
+        except (KeyError, TypeError, ValueError, re.error) as e:
+            return {"error": {"msg": "Invalid filter: {}".format(e)}}
+
+    def _joblist_page(self, value):
+        '''Returns the reply to a paged `joblist` request: a page of
+        the jobs matching the filter, sorted, as `[[job_id, job], ...]`,
+        and the cursor of the next page.
+        '''
+        try:
+            sort = value.get('sort') or 'time'
+            cursor = value.get('cursor')
+            # The key of the last job listed, see `LIST_SORT_KEYS`
+            if cursor is not None and not (
+                    isinstance(cursor, (list, tuple)) and
+                    len(cursor) == CURSOR_LENGTHS[sort] and
+                    all(isinstance(part, (int, str)) for part in cursor)):
+                raise ValueError('bad cursor {!r}'.format(cursor))
+            limit = min(int(value.get('limit') or MAX_PAGE), MAX_PAGE)
+            page, cursor = list_jobs(int(value['euid']), max(limit, 1),
+                                     cursor, sort,
+                                     **(value.get('filter') or {}))
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError,
+                re.error, sqlite3.Error) as e:
+            return {"error": {"msg": "Invalid listing: {}".format(e)}}
+        return {
+            'jobs': [[job_id, job.as_dict()] for job_id, job in page],
+            'cursor': cursor,
+        }
+
+    def _modify_matching(self, value):
+        '''Modifies the jobs matching the filter of a `modify_matching`
+        request as per its `job` (`add_job` params, `_` for keeping
+        a saved value), returns the reply with the count.
+        '''
+        job_ids = self._match_jobs(value)
+        if isinstance(job_ids, dict):
+            return job_ids
+        count = 0
+        for job_id in job_ids:
+            reply = self._add_job(dict(value.get('job') or {},
+                                       euid=value['euid'], job_id=job_id))
+            if 'error' in reply:
+                return dict(reply, count=count)
+            count += 1
+        return {"msg": "Done", "count": count}
+
+    def _linger(self, fifo_in):
+        '''Waits up to `journal_commit_window` secs for more input
+        (e.g. concurrent submissions) to commit along with what's
+        been read; returns the additional lines.
+        '''
+        window = get_config('journal_commit_window')
+        if window <= 0:
+            return []
+        lines = []
+        deadline = time.monotonic() + window
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0 or not fifo_in.wait(left):
+                return lines
+            lines.extend(fifo_in.readlines())
+
+    def _stats(self):
+        '''Returns the executor stats, with the held batch jobs
+        and the catch-up backlog.
+        '''
+        oldest_overdue = time.time() - self.catchup[0][0] \
+            if self.catchup else 0
+        return dict(self.executor.stats(),
+                    batch_held=len(self.batch_held),
+                    catchup_backlog=len(self.catchup),
+                    catchup_oldest_overdue=round(oldest_overdue))
+
+    def _mark_due(self, euid, job_id, job_run_at):
+        if (euid, job_id) not in self.due_jobs:
+            self.due_counts[euid] += 1
+        self.due_jobs[(euid, job_id)] = job_run_at
+
+    def _unmark_due(self, euid, job_id):
+        if self.due_jobs.pop((euid, job_id), None) is not None:
+            self.due_counts[euid] -= 1
+            if not self.due_counts[euid]:
+                del self.due_counts[euid]
+
+    def _job_counts(self, euid):
+        '''Returns the job counts of `euid`: total, exact, and
+        overdue (due, but not started yet).
+        '''
+        return dict(job_counts(euid),
+                    overdue_pending=self.due_counts.get(euid, 0))
+
+    def _add_catchup(self, item):
+        if not self.catchup:
+            write_file(self.daemon_log, 'Catching up on overdue jobs',
+                       mode='at')
+        euid, job_id, job_run_at = item
+        heapq.heappush(self.catchup, (job_run_at, euid, job_id))
+
+    def _pop_catchup(self):
+        job_run_at, euid, job_id = heapq.heappop(self.catchup)
+        return euid, job_id, job_run_at
+
+    def _release_catchup(self, current_time):
+        '''Hands overdue jobs over to the executor, in run time order,
+        at most `catchup_rate` per sec (plus jitter). Nothing is
+        released while on-time jobs are pending, those go first.
+        '''
+        if not self.catchup or current_time < self._next_catchup or \
+                self.executor.pending:
+            return
+        rate = get_config('catchup_rate')
+        if rate > 0:
+            self.executor.submit(self._pop_catchup())
+            self._next_catchup = current_time + 1 / rate + \
+                random.uniform(0, get_config('catchup_jitter'))
+        else:
+            while self.catchup:
+                self.executor.submit(self._pop_catchup())
+        if not self.catchup:
+            write_file(self.daemon_log, 'Caught up on overdue jobs',
+                       mode='at')
+
+    def _admit_batch_jobs(self, current_time):
+        '''Hands the oldest held batch jobs over to the executor, as
+        many as the system has spare capacity for, less those admitted
+        lately that the load average may not show yet; at least one, if
+        the system is not loaded. The load is checked once per
+        `batch_check_interval`.
+        '''
+        if not self.batch_held or current_time < self._next_batch_check:
+            return
+        self._next_batch_check = current_time + \
+            get_config('batch_check_interval')
+        admitted = self._batch_admitted
+        while admitted and admitted[0] <= current_time - BATCH_SETTLE_SECS:
+            admitted.popleft()
+        spare = spare_capacity(get_config('batch_max_loadavg'),
+                               get_config('batch_max_cpu_pressure'))
+        if not spare:
+            return
+        for _ in range(max(spare - len(admitted), 1)):
+            if not self.batch_held:
+                break
+            self.executor.submit(self.batch_held.popleft())
+            admitted.append(current_time)
+
+    def _launch_job(self, item):
+        '''Starts the pending job `(euid, job_id, job_run_at)` in
+        a new process, if it is still enqueued as such.
+        '''
+        euid, job_id, job_run_at = item
+        job = get_job(euid, job_id)
+        # Removed or rescheduled while pending
+        if job is None or job.job_run_at != job_run_at:
+            return None
+        try:
+            log_dir = os.path.join(hat_dir(euid), 'logs')
+        except KeyError:
+            write_file(
+                self.daemon_log,
+                'UID {}: No such user, output of job {} is not saved'
+                .format(euid, job_id),
+                mode='at'
+            )
+            log_dir = None
+        proc = multiprocessing.Process(
+            target=self.command_run_save,
+            args=(job.command,),
+            kwargs={
+                'euid': euid,
+                'stdout_file': log_dir and os.path.join(log_dir,
+                                                        'stdout.log'),
+                'stderr_file': log_dir and os.path.join(log_dir,
+                                                        'stderr.log'),
+                'use_shell': job.use_shell,
+                'job_id': job_id,
+                'run_at': job_run_at,
+            },
+        )
+        proc.start()
+        return proc
 
     def command_run_save(self, command, euid, stdout_file, stderr_file,
                          use_shell, job_id, run_at):
-        '''Runs a command using `run_command`, gets the
-        (returncode, STDOUT, STDERR) tuple and saves them
-        using `_check_and_write`.
-        '''
-        for f in (stdout_file, stderr_file):
-            if f:
-                os.makedirs(os.path.dirname(f), exist_ok=True)
-
-        returncode, stdout, stderr = self.run_command(command, euid, use_shell,
-                                                      job_id)
-        self._check_and_write(stdout_file, euid, run_at, job_id, command,
-                              returncode, stdout, is_stdout=True)
-        self._check_and_write(stderr_file, euid, run_at, job_id, command,
-                              returncode, stderr)
-
-    def run_command(self, command, euid, use_shell, job_id):
-        '''Runs a command, and returns (exit_status, STDOUT, STDERR) tuple.'''
+        '''Runs a command using `run_command`, with its output spooled
+        to disk, and appends the output to the user's logs.
+        '''
+        spool_dir = stdout_file and os.path.dirname(stdout_file)
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        max_bytes = get_config('job_output_max_bytes')
+        stdout, stderr = (OutputSpool(spool_dir, max_bytes)
+                          if spool_dir else None for _ in range(2))
+        try:
+            started = time.monotonic()
+            returncode = self.run_command(command, euid, use_shell, stdout,
+                                          stderr)
+            if not spool_dir:
+                return
+            fields = {
+                'euid': euid,
+                'job_id': job_id,
+                'scheduled': time.strftime('%Y-%m-%d %H:%M:%S',
+                                           time.localtime(run_at)),
+                'command': command,
+                'returncode': returncode,
+                'duration': time.monotonic() - started,
+            }
+            ndjson = get_config('job_log_format') == 'ndjson'
+            write_output_record(stdout_file, fields, stdout, ndjson)
+            if stderr:
+                write_output_record(stderr_file, fields, stderr, ndjson)
+        finally:
+            for spool in (stdout, stderr):
+                if spool is not None:
+                    spool.close()
+
+    def run_command(self, command, euid, use_shell, stdout, stderr):
+        '''Runs a command, with its STDOUT and STDERR read into the
+        `OutputSpool`s `stdout` and `stderr` as it goes (or discarded if
+        None), and returns the exit status.
+        '''
+        def pipe(spool):
+            return subprocess.PIPE if spool is not None else subprocess.DEVNULL
+
         try:
             command_ = command if use_shell else shlex.split(command)
             proc = subprocess.Popen(
                 command_,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                stdout=pipe(stdout),
+                stderr=pipe(stderr),
                 shell=use_shell,
                 preexec_fn=lambda: os.seteuid(int(euid))  # Setting EUID
             )
         except Exception as err:
-            # Setting `returncode` to 127
-            returncode, stdout, stderr = 127, b'', bytes(str(err), 'utf-8')
-        else:
-            returncode, stdout, stderr = proc.wait(), *proc.communicate()
-        finally:
-            try:
-                return (returncode, stdout, stderr)
-            except UnboundLocalError:
-                # Interactive or frame refreshing commands
-                # are not allowed e.g. `top`
-                error_msg = ('Interactive or screen refreshing'
-                             ' commands are not allowed'
-                )
-                write_file(
-                    self.daemon_log,
-                    'id>{} : cmd>{} :: {}'.format(job_id, command, error_msg),
-                    mode='at',
-                )
-                # raise HatRunnerException(error_msg)
-            
-    def _check_and_write(self, filename, euid, run_at, job_id, command,
-                         returncode, content, is_stdout=False):
-        '''Checks the input content, converts and saves in
-        filename by calling `write_file` afterwards.
-        '''
-        if content or is_stdout:
-            content = 'euid>{} : id>{} : time>{} : cmd>{} : ret>{} :: out>{}'.format(
-                euid,
-                job_id,
-                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run_at)),
-                command, returncode, content.decode('utf-8')
-            )
-            write_file(filename, content, mode='at')
-            
+            if stderr is not None:
+                stderr.feed(str(err).encode('utf-8'), final=True)
+            return 127
+        # Both pipes are drained as the command writes, so that it never
+        # blocks on a full one
+        pump_output({f: spool for f, spool in ((proc.stdout, stdout),
+                                               (proc.stderr, stderr))
+                     if spool is not None})
+        return proc.wait()
+
     @staticmethod
     def write_to_file(file_path, content, mode='at', nodate=False):
         '''Deprecated in favor of `utils.write_file`.'''
         return write_file(file_path, content, mode, nodate)
-    
-        # with FLock():
-        #     with open(filename, mode) as f:
-        #         f.write('{} : {}\n'.format(
-        #             datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        #             content,
-        #         )
-        #         ) if not nodate else f.write('{}\n'.format(
-        #             content)
-        #         )
-                
+
 
 if __name__ == '__main__':
     pass
@@ -1,33 +1,329 @@
 '''Generic scheduling stuffs for all incoming jobs. Other
 modules only need to work with `enqueued_jobs` dict.
+
+Jobs due within the hot horizon live in `enqueued_jobs`, later
+ones are kept on disk in `cold_jobs` until they come in range.
+With `job_store = sqlite` configured, all jobs live in an SQLite
+database (`job_store`) instead, behind the same functions.
+Jobs are kept as `JobRecord`s, not dicts.
 '''
 
+import bisect
 import collections
 import datetime
+import gc
+import heapq
+import multiprocessing
 import os
 import pickle
 import re
 import time
 
 from abc import ABCMeta
+from array import array
 
+from .coldstore import ColdStore
+from .config import get_config
+from .jobrecord import JobRecord
+from .journal import JOURNAL_FILE, Journal, replay
+from .sqlitestore import SQLITE_FILE, SQLiteJobStore
 from .utils import write_file
 
 
 PICKLE_FILE = '/var/lib/hatd/hatdb.pkl'
+# The snapshot is a stream of pickles: this header, then lists
+# of `(euid, job_id, job)`, of at most `SNAPSHOT_CHUNK` jobs each,
+# in run time order
+SNAPSHOT_HEADER = ('hatdb-snapshot', 1)
+SNAPSHOT_CHUNK = 10000
 DAEMON_LOG = '/var/log/hatd/daemon.log'
+# Job IDs of a user go up to this, then wrap around
+MAX_JOB_ID = 2 ** 31 - 1
+
+enqueued_jobs = collections.defaultdict(dict)
+
+# Min-heap of `(job_run_at, euid, job_id)` over `enqueued_jobs`, so that
+# the runner only needs to look at the front to find due jobs. Entries of
+# removed or rescheduled jobs are not deleted from the heap, those are
+# skipped (and dropped) lazily when they reach the front.
+due_index = []
+# Number of jobs in `enqueued_jobs`, used to decide when the heap has
+# collected enough stale entries to be worth rebuilding
+_job_total = 0
+
+
+def _rebuild_index():
+    '''(Re)builds `due_index` from `enqueued_jobs`; the keys of
+    `list_jobs` are built afresh as well, when next needed.
+    '''
+    global _job_total
+    _list_keys.clear()
+    due_index[:] = [(job.job_run_at, euid, job_id)
+                    for euid, jobs in enqueued_jobs.items()
+                    for job_id, job in jobs.items()]
+    heapq.heapify(due_index)
+    _job_total = len(due_index)
+
+
+# Per-user counts over all tiers, kept up to date on every add and
+# removal (a started job is removed), so that counting needs no job:
+# the number of jobs, and the IDs of the exact ones
+job_totals = collections.Counter()
+exact_job_ids = collections.defaultdict(set)
+
+
+def _count_job(euid, job_id, exact, new=True):
+    '''Counts a job stored for `euid`, `new` if it's not replacing one.'''
+    if new:
+        job_totals[euid] += 1
+    if exact:
+        exact_job_ids[euid].add(job_id)
+    else:
+        exact_job_ids[euid].discard(job_id)
+
+
+def _uncount_job(euid, job_id):
+    job_totals[euid] -= 1
+    exact_job_ids[euid].discard(job_id)
+    if not job_totals[euid]:
+        del job_totals[euid]
+        exact_job_ids.pop(euid, None)
+
+
+def _reset_counts():
+    job_totals.clear()
+    exact_job_ids.clear()
+    if job_store is not None:
+        for euid, job_id, exact in job_store.job_flags():
+            _count_job(euid, job_id, exact)
+
+
+def job_counts(euid):
+    '''Returns the job counts of `euid`: total and exact.'''
+    return {
+        'total': job_totals.get(euid, 0),
+        'exact': len(exact_job_ids.get(euid, ())),
+    }
+
 
-# Loading previous jobs (if any)
-try:
-    with open(PICKLE_FILE, 'rb') as fpkl:
+# Journal of changes to `enqueued_jobs`, only opened
+# by the runner (see `open_journal`)
+journal = None
+# SQLiteJobStore, if configured; opened by the runner (see `open_db`)
+job_store = None
+# Background compaction process of the journal
+_compactor = None
+# Saved jobs are being loaded (see `load_db_steps`)
+loading = False
+
+
+def _iter_snapshot(pickle_file):
+    '''Yields the saved jobs of `pickle_file` in chunks of
+    `[(euid, job_id, job), ...]`, earliest first.
+    '''
+    try:
+        fpkl = open(pickle_file, 'rb')
+    except FileNotFoundError:
+        return
+    with fpkl:
         try:
-            saved_data = pickle.load(fpkl)
+            first = pickle.load(fpkl)
         except EOFError:
-            saved_data = None
-except FileNotFoundError:
-    saved_data = None
-        
-enqueued_jobs = saved_data or collections.defaultdict(dict)
+            return
+        if first != SNAPSHOT_HEADER:
+            # The whole table of dicts in one pickle (older hatd),
+            # can't stream
+            yield sorted(((euid, job_id, JobRecord.from_dict(job))
+                          for euid, jobs in first.items()
+                          for job_id, job in jobs.items()),
+                         key=lambda entry: entry[2].job_run_at)
+            return
+        while True:
+            try:
+                yield pickle.load(fpkl)
+            except EOFError:
+                return
+
+
+def _store_loaded(entries, skip=None):
+    '''Puts saved jobs, `[(euid, job_id, job), ...]`, in
+    `enqueued_jobs` as they are, except for those in `skip`
+    (`{euid: {job_id: ...}}`).
+    '''
+    global _job_total
+    push = heapq.heappush
+    for euid, job_id, job in entries:
+        if skip and job_id in skip.get(euid, ()):
+            continue
+        jobs = enqueued_jobs[euid]
+        new = job_id not in jobs
+        if new:
+            _job_total += 1
+        _count_job(euid, job_id, job.exact, new)
+        jobs[job_id] = job
+        push(due_index, (job.job_run_at, euid, job_id))
+
+
+def load_db_steps(pickle_file=PICKLE_FILE, journal_file=JOURNAL_FILE):
+    '''Loads the saved jobs step by step, so that near-due jobs are
+    usable before the rest is loaded; a generator, yielding after each
+    step. The journals are read first, as those are small and their
+    records win over the snapshot; then the snapshot is streamed in
+    run time order, then the on-disk job locations.
+    '''
+    global loading
+    loading = True
+    enqueued_jobs.clear()
+    _rebuild_index()
+    _reset_counts()
+    overlay = collections.defaultdict(dict)
+    # `.old` is from a compaction that didn't finish
+    for journal_ in ('{}.old'.format(journal_file), journal_file):
+        replay(journal_, overlay, keep_removed=True)
+    _store_loaded((euid, job_id, JobRecord.from_dict(job))
+                  for euid, jobs in overlay.items()
+                  for job_id, job in jobs.items() if job is not None)
+    yield
+    chunks = _iter_snapshot(pickle_file)
+    while True:
+        # The cyclic GC would go over the freshly loaded jobs again
+        # and again, for nothing; it runs in between the chunks instead
+        gc.disable()
+        try:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                _store_loaded(chunk, overlay)
+        finally:
+            gc.enable()
+        if chunk is None:
+            break
+        yield
+    for entries in cold_jobs.load_steps():
+        for euid, job_id, job in entries:
+            # Left in both tiers by a move cut short (e.g. a promotion
+            # with its segment not deleted yet): the job in memory wins,
+            # the copy on disk is dropped so that it's not run twice
+            if job_id in enqueued_jobs.get(euid, ()):
+                cold_jobs.remove(euid, job_id)
+            else:
+                _count_job(euid, job_id, job.exact)
+        yield
+    # Nothing is listed while loading
+    _list_keys.clear()
+    loading = False
+
+
+def load_db(pickle_file=PICKLE_FILE, journal_file=JOURNAL_FILE):
+    '''Loads the saved jobs, all at once.'''
+    for _ in load_db_steps(pickle_file, journal_file):
+        pass
+
+
+def open_journal(journal_file=JOURNAL_FILE):
+    '''Starts recording the changes to `enqueued_jobs`.'''
+    global journal
+    journal = Journal(journal_file, fsync=get_config('journal_fsync'))
+    return journal
+
+
+def _journal(op, euid, job_id, job=None):
+    if journal is not None:
+        journal.append(op, euid, job_id, job and job.as_dict())
+
+
+def _write_snapshot(pickle_file):
+    '''Saves `enqueued_jobs` to `pickle_file`, atomically.'''
+    jobs = sorted(((euid, job_id, job)
+                   for euid, jobs in enqueued_jobs.items()
+                   for job_id, job in jobs.items()),
+                  key=lambda entry: entry[2].job_run_at)
+    tmp_file = '{}.tmp'.format(pickle_file)
+    with open(tmp_file, 'wb') as fpkl:
+        pickle.dump(SNAPSHOT_HEADER, fpkl)
+        for start in range(0, len(jobs), SNAPSHOT_CHUNK):
+            pickle.dump(jobs[start:start + SNAPSHOT_CHUNK], fpkl)
+        fpkl.flush()
+        os.fsync(fpkl.fileno())
+    os.replace(tmp_file, pickle_file)
+
+
+def _compact(pickle_file):
+    '''Runs in the forked compaction process.'''
+    _write_snapshot(pickle_file)
+    journal.drop_old()
+
+
+def compact_db(pickle_file=PICKLE_FILE):
+    '''Folds the journal into a new snapshot, in the background:
+    the journal is moved aside, and a forked process saves its
+    (copy-on-write) view of `enqueued_jobs`. Returns the process.
+    '''
+    journal.rotate()
+    proc = multiprocessing.Process(target=_compact, args=(pickle_file,),
+                                   name='hatd-compact')
+    proc.start()
+    return proc
+
+
+def open_db(sqlite_file=SQLITE_FILE):
+    '''Opens the configured job store for changes, called by the
+    runner on start. The first time the SQLite store is used, the
+    jobs saved by the in-memory store are copied over. Returns a
+    `load_db_steps` generator for the in-memory store, for the
+    runner to go through, None otherwise.
+    '''
+    global job_store
+    if get_config('job_store') != 'sqlite':
+        open_journal()
+        return load_db_steps()
+    new_db = not os.path.exists(sqlite_file)
+    job_store = SQLiteJobStore(sqlite_file, fsync=get_config('journal_fsync'))
+    if new_db:
+        load_db()
+        for euid, jobs in enqueued_jobs.items():
+            for job_id, job in jobs.items():
+                job_store.store_job(euid, job_id, job)
+        for euid in list(cold_jobs.locations):
+            for job_id, job in cold_jobs.jobs(euid).items():
+                job_store.store_job(euid, job_id, job)
+        job_store.commit()
+    enqueued_jobs.clear()
+    _rebuild_index()
+    _reset_counts()
+    return None
+
+
+def commit_db(pickle_file=PICKLE_FILE):
+    '''Commits the changes made since the last commit. For the
+    in-memory store, once the journal grows enough, it is folded
+    into the snapshot in the background.
+    '''
+    global _compactor
+    if job_store is not None:
+        job_store.commit()
+        return
+    # On disk first: the journal may record the removal from memory
+    # of a job that went there
+    cold_jobs.sync(journal.fsync)
+    if not journal.commit():
+        return
+    # The jobs moved into memory are saved there now
+    cold_jobs.drop_taken()
+    # A snapshot of a partially loaded table would lose jobs
+    if loading or journal.records < get_config('journal_compact_records'):
+        return
+    if _compactor is not None:
+        if _compactor.is_alive():
+            return
+        _compactor.join()
+    _compactor = compact_db(pickle_file)
+
+
+# Far-future jobs, on disk; loaded along with the rest
+cold_jobs = ColdStore(segment_secs=get_config('cold_segment_secs'))
+
+# EUID: JobIdAllocator
+_id_allocators = {}
 
 
 def _check_perm(euid):
@@ -47,30 +343,333 @@ def _check_perm(euid):
 
 
 def get_enqueued_jobs(euid):
-    '''To be called from other modules to get enqueued_jobs.'''
-    # if euid is -1, dumps everything
+    '''To be called from other modules to get enqueued_jobs,
+    as `{job_id: JobRecord}`.
+    '''
+    # if euid is -1, dumps everything in memory
     # TODO: Anything more creative (and robust)?
     if euid == -1:
         return enqueued_jobs
     # _check_perm(euid)
-    return enqueued_jobs.get(euid, {})
+    if job_store is not None:
+        return job_store.get_jobs(euid)
+    jobs = enqueued_jobs.get(euid, {})
+    if cold_jobs.job_ids(euid):
+        jobs = {**jobs, **cold_jobs.jobs(euid)}
+    return jobs
+
+
+def _job_matcher(command=None, after=None, before=None, shell=None):
+    '''Returns a predicate on jobs for the filters of `match_jobs`.'''
+    command_re = re.compile(command) if command is not None else None
+
+    def matches(job):
+        return (command_re is None or command_re.search(job.command)) and \
+            (after is None or job.job_run_at >= after) and \
+            (before is None or job.job_run_at <= before) and \
+            (shell is None or (job.use_shell or '-') == shell)
+    return matches
+
+
+def match_jobs(euid, command=None, after=None, before=None, shell=None):
+    '''Returns the IDs of the jobs of `euid` matching all of the given
+    filters, in one pass: `command` regex (searched), run time within
+    [`after`, `before`] (Epoch), and `shell` ('-' for no shell).
+    '''
+    if job_store is not None:
+        return job_store.match_jobs(euid, command, after, before, shell)
+    matches = _job_matcher(command, after, before, shell)
+    return [job_id for job_id, job in get_enqueued_jobs(euid).items()
+            if matches(job)]
+
+
+# Sort keys of `list_jobs`, the cursor is the key of the last job listed
+LIST_SORT_KEYS = {
+    'time': lambda job_id, job: (job.job_run_at, job_id),
+    'id': lambda job_id, job: (job_id,),
+}
+
+
+# Sorted keys of the jobs of a user in both tiers, so that a page of
+# `list_jobs` is cut out by bisection and only its jobs are read from
+# disk: `{(euid, sort): array}` of the `LIST_SORT_KEYS` keys packed in
+# ints, built on demand and dropped on any change of the user's jobs
+_list_keys = {}
+# `(job_run_at, job_id)` is packed as `job_run_at << _ID_BITS | job_id`
+_ID_BITS = MAX_JOB_ID.bit_length()
+
+
+def _pack_key(sort, key):
+    if sort == 'time':
+        return int(key[0]) << _ID_BITS | int(key[1])
+    return int(key[0])
+
+
+def _packed_job_id(sort, packed):
+    return packed & MAX_JOB_ID if sort == 'time' else packed
+
+
+def _drop_list_keys(euid):
+    for sort in LIST_SORT_KEYS:
+        _list_keys.pop((euid, sort), None)
+
+
+def _sorted_keys(euid, sort):
+    '''Returns the packed sort keys of the jobs of `euid`, in order.'''
+    keys = _list_keys.get((euid, sort))
+    if keys is None:
+        run_ats = dict(cold_jobs.run_times(euid))
+        run_ats.update((job_id, job.job_run_at) for job_id, job
+                       in enqueued_jobs.get(euid, {}).items())
+        if sort == 'time':
+            packed = (_pack_key(sort, (job_run_at, job_id))
+                      for job_id, job_run_at in run_ats.items())
+        else:
+            packed = iter(run_ats)
+        keys = _list_keys[(euid, sort)] = array('q', sorted(packed))
+    return keys
+
+
+def _jobs_of(euid, job_ids):
+    '''Returns `{job_id: job}` of the given jobs of `euid`, in any
+    tier, reading each on-disk segment once.
+    '''
+    hot = enqueued_jobs.get(euid, {})
+    jobs = cold_jobs.get_many(euid, [job_id for job_id in job_ids
+                                     if job_id not in hot])
+    jobs.update((job_id, hot[job_id]) for job_id in job_ids
+                if job_id in hot)
+    return jobs
+
+
+def _list_page(euid, limit, cursor, sort, command=None, after=None,
+               before=None, shell=None):
+    '''`list_jobs` of the in-memory store: returns up to `limit` jobs
+    of `euid` matching the filters after `cursor`, as `[(job_id, job),
+    ...]`; jobs are read in sort order, a chunk at a time, until the
+    page is full.
+    '''
+    matches = _job_matcher(command, after, before, shell)
+    keys = _sorted_keys(euid, sort)
+    start = 0 if cursor is None else \
+        bisect.bisect_right(keys, _pack_key(sort, cursor))
+    if sort == 'time' and after is not None:
+        start = max(start, bisect.bisect_left(
+            keys, _pack_key(sort, (max(int(after), 0), 0))))
+    page = []
+    chunk = limit
+    while start < len(keys) and len(page) < limit:
+        job_ids = [_packed_job_id(sort, packed)
+                   for packed in keys[start:start + chunk]]
+        start += chunk
+        chunk *= 2
+        jobs = _jobs_of(euid, job_ids)
+        for job_id in job_ids:
+            job = jobs[job_id]
+            if matches(job):
+                page.append((job_id, job))
+                if len(page) == limit:
+                    break
+        # Past `before`, nothing more can match
+        if sort == 'time' and before is not None and \
+                jobs[job_ids[-1]].job_run_at > before:
+            break
+    return page
+
+
+def list_jobs(euid, limit, cursor=None, sort='time', **filter_):
+    '''Returns a page of the jobs of `euid` matching `filter_` (see
+    `match_jobs`): the first `limit` ones after `cursor` in `sort`
+    order, as `[(job_id, job), ...]`, and the cursor for the next page
+    (None if this is the last one).
+    '''
+    key = LIST_SORT_KEYS[sort]
+    cursor = tuple(cursor) if cursor is not None else None
+    if job_store is not None:
+        page = job_store.list_jobs(euid, limit + 1, cursor, sort, **filter_)
+    else:
+        page = _list_page(euid, limit + 1, cursor, sort, **filter_)
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, list(key(*page[-1]))
+
+
+def get_job(euid, job_id):
+    '''Returns the job from whichever tier it is in,
+    or None if there is no such job.
+    '''
+    if job_store is not None:
+        return job_store.get_job(euid, job_id)
+    return enqueued_jobs.get(euid, {}).get(job_id) or \
+        cold_jobs.get(euid, job_id)
+
+
+def _has_job(euid, job_id):
+    '''Checks if the job exists, without reading it from disk.'''
+    if job_store is not None:
+        return job_store.get_job(euid, job_id) is not None
+    return job_id in enqueued_jobs.get(euid, {}) or \
+        (euid, job_id) in cold_jobs
+
+
+def _max_job_id(euid):
+    '''Returns the highest job ID of `euid`, 0 if there is no job.'''
+    if job_store is not None:
+        return job_store.max_job_id(euid)
+    return max(
+        list(enqueued_jobs.get(euid, {})) + list(cold_jobs.job_ids(euid)),
+        default=0
+    )
 
 
 def remove_job(euid, job_id):
     '''Remove a job from enqueued_jobs based on job ID.'''
     # _check_perm(euid)
-    jobs = get_enqueued_jobs(euid)
+    global _job_total
+    _drop_list_keys(euid)
+    jobs = enqueued_jobs.get(euid, {})
     try:
         del jobs[job_id]
     except KeyError:
-        write_file(
-            DAEMON_LOG,
-            'Removal failed: No such job with ID {} for UID {}'
-            .format(job_id, euid),
-            mode='at'
-        )
-            
-        
+        try:
+            if job_store is not None:
+                job_store.remove_job(euid, job_id)
+            else:
+                cold_jobs.remove(euid, job_id)
+        except KeyError:
+            write_file(
+                DAEMON_LOG,
+                'Removal failed: No such job with ID {} for UID {}'
+                .format(job_id, euid),
+                mode='at'
+            )
+            return
+    else:
+        # The heap entry is left behind, `_is_live` skips it
+        _job_total -= 1
+        _journal('remove', euid, job_id)
+    _uncount_job(euid, job_id)
+
+
+def _horizon_end(current_time):
+    '''Jobs due before the returned Epoch are kept in memory.'''
+    return current_time + get_config('hot_horizon')
+
+
+def _store_job(euid, job_id, job, hot=False):
+    '''Saves (or replaces) `job` in `enqueued_jobs`, and
+    indexes it by `job_run_at`. Jobs beyond the hot horizon go
+    to `cold_jobs` instead, unless `hot` is True.
+    '''
+    global _job_total
+    if job_store is not None:
+        job_store.store_job(euid, job_id, job)
+        return
+    _drop_list_keys(euid)
+    if not hot and cold_jobs.is_cold(job.job_run_at,
+                                     _horizon_end(time.time())):
+        cold_jobs.add(euid, job_id, job)
+        if job_id in enqueued_jobs.get(euid, {}):
+            del enqueued_jobs[euid][job_id]
+            _job_total -= 1
+            _journal('remove', euid, job_id)
+        return
+    if (euid, job_id) in cold_jobs:
+        cold_jobs.take(euid, job_id)
+    if job_id in enqueued_jobs[euid]:
+        _journal('modify', euid, job_id, job)
+    else:
+        _job_total += 1
+        _journal('add', euid, job_id, job)
+    enqueued_jobs[euid][job_id] = job
+    heapq.heappush(due_index, (job.job_run_at, euid, job_id))
+    # Too many stale entries, start afresh
+    if len(due_index) > 2 * _job_total + 1024:
+        _rebuild_index()
+
+
+def _is_live(entry):
+    '''Checks if the `due_index` entry still refers to an
+    enqueued job with the same run time.
+    '''
+    job_run_at, euid, job_id = entry
+    job = enqueued_jobs.get(euid, {}).get(job_id)
+    return job is not None and job.job_run_at == job_run_at
+
+
+def next_run_at():
+    '''Returns the earliest `job_run_at` among the enqueued
+    jobs, or None if there is none.
+    '''
+    if job_store is not None:
+        return job_store.next_run_at()
+    while due_index and not _is_live(due_index[0]):
+        heapq.heappop(due_index)
+    return due_index[0][0] if due_index else None
+
+
+def pop_due_jobs(current_time):
+    '''Takes all jobs with `job_run_at` <= `current_time` off
+    the index and returns those as `[(euid, job_id, job), ...]`,
+    ordered by run time. The jobs are kept in `enqueued_jobs`,
+    the caller is responsible for removing them.
+    '''
+    if job_store is not None:
+        return job_store.pop_due_jobs(current_time)
+    due = []
+    seen = set()
+    while due_index and due_index[0][0] <= current_time:
+        entry = heapq.heappop(due_index)
+        _, euid, job_id = entry
+        # A job modified with the same run time has two entries
+        if _is_live(entry) and (euid, job_id) not in seen:
+            seen.add((euid, job_id))
+            due.append((euid, job_id, enqueued_jobs[euid][job_id]))
+    return due
+
+
+def promote_jobs(current_time):
+    '''Moves the on-disk jobs that came within the hot horizon
+    into `enqueued_jobs`; returns the number of jobs moved. Call
+    `cold_jobs.discard_promoted` once `enqueued_jobs` is saved.
+    '''
+    if job_store is not None:
+        return 0
+    promoted = cold_jobs.promote(_horizon_end(current_time))
+    for euid, job_id, job in promoted:
+        _store_job(euid, job_id, job, hot=True)
+    return len(promoted)
+
+
+def demote_jobs(current_time):
+    '''Moves the in-memory jobs beyond the hot horizon to
+    `cold_jobs` e.g. jobs loaded from an untiered database;
+    returns the number of jobs moved.
+    '''
+    if job_store is not None:
+        return 0
+    horizon_end = _horizon_end(current_time)
+    far = [(euid, job_id, job) for euid, jobs in enqueued_jobs.items()
+           for job_id, job in jobs.items()
+           if cold_jobs.is_cold(job.job_run_at, horizon_end)]
+    for euid, job_id, job in far:
+        _store_job(euid, job_id, job)
+    return len(far)
+
+
+def next_promotion_at():
+    '''Returns the Epoch at which the next on-disk segment
+    comes within the hot horizon, or None if there is none.
+    '''
+    if job_store is not None:
+        return None
+    window = cold_jobs.next_window()
+    if window is None:
+        return None
+    return window - get_config('hot_horizon')
+
+
 class HatTimerException(Exception):
     '''Generic exception class for all input timers.'''
     pass
@@ -81,6 +680,48 @@ class HatJobException(Exception):
     pass
 
 
+class JobIdAllocator:
+    '''Hands out the job IDs of a user in constant time. IDs come
+    from a monotonic counter; once that reaches `max_id`, it wraps
+    around and reuses the IDs of removed jobs, looking for those from
+    where it last left off. IDs start afresh from 1 whenever the user
+    has no job left.
+    '''
+    def __init__(self, euid, max_id=MAX_JOB_ID):
+        self.euid = euid
+        self.max_id = max_id
+        # Starting after the IDs already in use (e.g. loaded jobs)
+        self.last_id = _max_job_id(euid)
+        self.wrapped = False
+
+    def allocate(self):
+        '''Returns a free job ID, raises HatJobException if
+        there's none left.
+        '''
+        job_count = job_totals.get(self.euid, 0)
+        if not job_count:
+            self.last_id = 0
+            self.wrapped = False
+        if not self.wrapped and self.last_id < self.max_id:
+            self.last_id += 1
+            return self.last_id
+        if job_count >= self.max_id:
+            write_file(
+                DAEMON_LOG,
+                'Job slot exceeded: Maximum {} jobs can be enqueued'
+                .format(self.max_id),
+                mode='at'
+            )
+            raise HatJobException(
+                'Job slot exceeded: Maximum {} jobs can be enqueued'
+                .format(self.max_id))
+        self.wrapped = True
+        while True:
+            self.last_id = self.last_id % self.max_id + 1
+            if not _has_job(self.euid, self.last_id):
+                return self.last_id
+
+
 class JobMeta(ABCMeta):
     '''Setting the allowed `strptime` formats for
     all classed.
@@ -100,24 +741,27 @@ class JobMeta(ABCMeta):
 class Job(metaclass=JobMeta):
     '''A job to be done at specified time.'''
     def __init__(self, euid, exact, command, time_, use_shell=False,
-                 job_id=None):
+                 job_id=None, batch=False):
         self.euid = int(euid)
         # Checking Permission
         # _check_perm(self.euid)
         # job_id is sent by runner when updating a Job params
         if job_id:
-            job = enqueued_jobs[self.euid][job_id]
+            job = get_job(self.euid, job_id)
+            if job is None:
+                raise KeyError(job_id)
             self.job_id = job_id
             # Hmmm...future thinking scope
             self.exact = exact
-            self.command = job['command'] if command == '_' \
+            self.batch = batch
+            self.command = job.command if command == '_' \
                 else command
             if time_ == '_':
-                self.date_time_epoch = job['job_run_at']
+                self.date_time_epoch = job.job_run_at
             else:
                 self.time_str = time_
                 self.date_time_epoch = self.get_run_at_epoch()
-            self.use_shell = job['use_shell'] if use_shell == '_' \
+            self.use_shell = job.use_shell if use_shell == '_' \
                 else use_shell
             # use_shell is absent: removing shell reference from command
             if not self.use_shell and not use_shell == '_':
@@ -128,6 +772,7 @@ class Job(metaclass=JobMeta):
             self.command = command
             self.use_shell = use_shell
             self.exact = exact
+            self.batch = batch
             self.time_str = time_
             self.date_time_epoch = self.get_run_at_epoch()
             # Saving the job, with the user's EUID as keys, and increasing
@@ -136,39 +781,20 @@ class Job(metaclass=JobMeta):
             
         if not self.date_time_epoch:
             return
-        enqueued_jobs[self.euid].update({
-            self.job_id: {
-                'command': self.command,
-                'job_run_at': int(self.date_time_epoch),  # to int
-                'use_shell': self.use_shell,
-                'exact': self.exact,
-            }
-        })
+        _count_job(self.euid, self.job_id, self.exact, new=not job_id)
+        _store_job(self.euid, self.job_id, JobRecord(
+            self.command,
+            int(self.date_time_epoch),  # to int
+            self.use_shell,
+            self.exact,
+            self.batch,
+        ))
         
     def _get_job_id(self, euid):
         '''Get job ID, to be used as the Job dict key.'''
-        # We'll wrap around at 10000 for each user
-        max_id = 10000
-        current_keys = sum([list(v.keys()) for u, v in enqueued_jobs.items()
-                            if int(u) == euid],
-                           []
-                           )
-        current_id = max(current_keys) if current_keys else 0
-        next_id = current_id + 1
-        if next_id <= max_id and next_id not in current_keys:
-            return next_id
-        for id in range(1, max_id):
-            if id not in current_keys:
-                return id
-        write_file(
-            DAEMON_LOG,
-            'Job slot exceeded: Maximum {} jobs can be enqueued'
-            .format(max_id),
-            mode='at'
-        )
-        raise HatJobException(
-            'Job slot exceeded: Maximum {} jobs can be enqueued'
-            .format(max_id))
+        if euid not in _id_allocators:
+            _id_allocators[euid] = JobIdAllocator(euid)
+        return _id_allocators[euid].allocate()
         
     def get_run_at_epoch(self):
         '''Returns when to run the job in Epoch, raises
@@ -0,0 +1,216 @@
+'''SQLite-backed job store, an alternative to the in-memory job
+table. Jobs are queried through indexes on `(job_run_at)` and
+`(euid, job_id)`, by the daemon as well as by offline tools e.g.
+
+    store = SQLiteJobStore(SQLITE_FILE, readonly=True)
+    store.due_between(time.time(), time.time() + 3600)
+'''
+
+import re
+import sqlite3
+
+from .jobrecord import JobRecord
+
+
+SQLITE_FILE = '/var/lib/hatd/hatdb.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    euid INTEGER NOT NULL,
+    job_id INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    job_run_at INTEGER NOT NULL,
+    use_shell TEXT,
+    exact INTEGER NOT NULL,
+    batch INTEGER NOT NULL DEFAULT 0,
+    -- Handed out by `pop_due_jobs`, but not removed yet
+    popped INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (euid, job_id)
+);
+CREATE INDEX IF NOT EXISTS jobs_run_at ON jobs (job_run_at);
+CREATE INDEX IF NOT EXISTS jobs_euid_run_at ON jobs (euid, job_run_at, job_id);
+'''
+
+COLUMNS = 'euid, job_id, command, job_run_at, use_shell, exact, batch'
+
+
+def _to_job(row):
+    '''Converts a `COLUMNS` row to `(euid, job_id, job)`.'''
+    euid, job_id, command, job_run_at, use_shell, exact, batch = row
+    return euid, job_id, JobRecord(command, job_run_at, use_shell or False,
+                                   bool(exact), bool(batch))
+
+
+def _regexp(pattern, value):
+    '''`REGEXP` operator for SQL queries.'''
+    return re.search(pattern, value) is not None
+
+
+class SQLiteJobStore:
+    '''Jobs in an SQLite database (WAL mode). Changes are committed
+    together on `commit`, so that all changes of a runner round share
+    one transaction. `fsync` chooses between `synchronous` FULL (every
+    commit is durable) and NORMAL (durable at WAL checkpoints).
+    '''
+    def __init__(self, db_file=SQLITE_FILE, fsync=True, readonly=False):
+        if readonly:
+            self.conn = sqlite3.connect(
+                'file:{}?mode=ro'.format(db_file), uri=True)
+        else:
+            self.conn = sqlite3.connect(db_file)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous={}'.format(
+                'FULL' if fsync else 'NORMAL'))
+            self.conn.executescript(SCHEMA)
+            # Whatever was handed out before a restart is gone
+            self.conn.execute('UPDATE jobs SET popped = 0 WHERE popped')
+            self.conn.commit()
+        self.conn.create_function('REGEXP', 2, _regexp)
+
+    def commit(self):
+        '''Commits the changes; returns True if there were any.'''
+        if not self.conn.in_transaction:
+            return False
+        self.conn.commit()
+        return True
+
+    def close(self):
+        self.conn.close()
+
+    def store_job(self, euid, job_id, job):
+        '''Saves (or replaces) a job.'''
+        self.conn.execute(
+            'INSERT OR REPLACE INTO jobs ({}) VALUES (?, ?, ?, ?, ?, ?, ?)'
+            .format(COLUMNS),
+            (euid, job_id, job.command, job.job_run_at,
+             job.use_shell or None, int(bool(job.exact)),
+             int(bool(job.batch))))
+
+    def remove_job(self, euid, job_id):
+        '''Removes a job, raises KeyError if there is no such job.'''
+        cursor = self.conn.execute(
+            'DELETE FROM jobs WHERE euid = ? AND job_id = ?',
+            (euid, job_id))
+        if not cursor.rowcount:
+            raise KeyError(job_id)
+
+    def get_job(self, euid, job_id):
+        '''Returns the job, or None if there is no such job.'''
+        row = self.conn.execute(
+            'SELECT {} FROM jobs WHERE euid = ? AND job_id = ?'
+            .format(COLUMNS), (euid, job_id)).fetchone()
+        return _to_job(row)[2] if row else None
+
+    def get_jobs(self, euid):
+        '''Returns all jobs of `euid` as `{job_id: job}`.'''
+        rows = self.conn.execute(
+            'SELECT {} FROM jobs WHERE euid = ?'.format(COLUMNS), (euid,))
+        return {job_id: job for _, job_id, job in map(_to_job, rows)}
+
+    def job_flags(self):
+        '''Yields `(euid, job_id, exact)` of all jobs, for counting.'''
+        for euid, job_id, exact in self.conn.execute(
+                'SELECT euid, job_id, exact FROM jobs'):
+            yield euid, job_id, bool(exact)
+
+    def max_job_id(self, euid):
+        return self.conn.execute(
+            'SELECT MAX(job_id) FROM jobs WHERE euid = ?',
+            (euid,)).fetchone()[0] or 0
+
+    def next_run_at(self):
+        '''Returns the earliest `job_run_at` among the jobs not
+        handed out yet, or None if there is none.
+        '''
+        return self.conn.execute(
+            'SELECT MIN(job_run_at) FROM jobs WHERE NOT popped'
+        ).fetchone()[0]
+
+    def pop_due_jobs(self, current_time):
+        '''Hands out the jobs with `job_run_at` <= `current_time` not
+        handed out before, as `[(euid, job_id, job), ...]` ordered by
+        run time. The jobs are kept, the caller removes them.
+        '''
+        due = [_to_job(row) for row in self.conn.execute(
+            'SELECT {} FROM jobs WHERE job_run_at <= ? AND NOT popped '
+            'ORDER BY job_run_at'.format(COLUMNS), (current_time,))]
+        if due:
+            self.conn.executemany(
+                'UPDATE jobs SET popped = 1 WHERE euid = ? AND job_id = ?',
+                [(euid, job_id) for euid, job_id, _ in due])
+        return due
+
+    # Queries for the daemon and offline tools
+
+    def due_between(self, start, end):
+        '''Returns the jobs due in `[start, end]`, ordered by run time.'''
+        return [_to_job(row) for row in self.conn.execute(
+            'SELECT {} FROM jobs WHERE job_run_at BETWEEN ? AND ? '
+            'ORDER BY job_run_at'.format(COLUMNS), (start, end))]
+
+    def jobs_matching(self, euid, command_re):
+        '''Returns the jobs of `euid` with command matching the
+        regex `command_re`, ordered by job ID.
+        '''
+        return [_to_job(row) for row in self.conn.execute(
+            'SELECT {} FROM jobs WHERE euid = ? AND command REGEXP ? '
+            'ORDER BY job_id'.format(COLUMNS), (euid, command_re))]
+
+    def _filter_where(self, euid, command_re, after, before, shell):
+        '''Returns the WHERE clause and its params for the jobs of
+        `euid` matching all of the given filters.
+        '''
+        where, params = ['euid = ?'], [euid]
+        if command_re is not None:
+            where.append('command REGEXP ?')
+            params.append(command_re)
+        if after is not None:
+            where.append('job_run_at >= ?')
+            params.append(after)
+        if before is not None:
+            where.append('job_run_at <= ?')
+            params.append(before)
+        if shell is not None:
+            where.append("IFNULL(use_shell, '-') = ?")
+            params.append(shell)
+        return ' AND '.join(where), params
+
+    def match_jobs(self, euid, command_re=None, after=None, before=None,
+                   shell=None):
+        '''Returns the IDs of the jobs of `euid` matching all of the
+        given filters (see `scheduler.match_jobs`).
+        '''
+        where, params = self._filter_where(euid, command_re, after, before,
+                                           shell)
+        return [job_id for job_id, in self.conn.execute(
+            'SELECT job_id FROM jobs WHERE {}'.format(where), params)]
+
+    def list_jobs(self, euid, limit, cursor=None, sort='time',
+                  command=None, after=None, before=None, shell=None):
+        '''Returns up to `limit` jobs of `euid` matching the filters,
+        after `cursor` in `sort` order (see `scheduler.list_jobs`), as
+        `[(job_id, job), ...]`.
+        '''
+        where, params = self._filter_where(euid, command, after, before,
+                                           shell)
+        order = 'job_run_at, job_id' if sort == 'time' else 'job_id'
+        if cursor is not None:
+            where += ' AND ({}) > ({})'.format(
+                order, ', '.join('?' * len(cursor)))
+            params.extend(cursor)
+        rows = self.conn.execute(
+            'SELECT {} FROM jobs WHERE {} ORDER BY {} LIMIT ?'
+            .format(COLUMNS, where, order), params + [limit])
+        return [(job_id, job) for _, job_id, job in map(_to_job, rows)]
+
+    def oldest_overdue(self, current_time):
+        '''Returns the earliest job due before `current_time`, or None.'''
+        row = self.conn.execute(
+            'SELECT {} FROM jobs WHERE job_run_at < ? '
+            'ORDER BY job_run_at LIMIT 1'.format(COLUMNS),
+            (current_time,)).fetchone()
+        return _to_job(row) if row else None
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,60 @@
+'''System load readings, for admitting batch jobs only
+when the host has spare capacity.
+'''
+
+import os
+
+
+LOADAVG_FILE = '/proc/loadavg'
+CPU_PRESSURE_FILE = '/proc/pressure/cpu'
+
+
+def cpu_pressure():
+    '''Returns the CPU pressure (PSI) as the `some avg10` percentage,
+    or None if the kernel does not provide it.
+    '''
+    try:
+        with open(CPU_PRESSURE_FILE) as f:
+            for line in f:
+                # some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+                fields = line.split()
+                if fields and fields[0] == 'some':
+                    return float(fields[1].split('=')[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def loadavg_per_cpu():
+    '''Returns the 1 minute load average divided by the
+    number of CPUs.
+    '''
+    with open(LOADAVG_FILE) as f:
+        loadavg = float(f.read().split()[0])
+    return loadavg / (os.cpu_count() or 1)
+
+
+def is_loaded(max_loadavg, max_cpu_pressure):
+    '''Checks if the system is too loaded for batch jobs. CPU
+    pressure is used when available, as it reacts much faster;
+    the load average per CPU otherwise.
+    '''
+    pressure = cpu_pressure()
+    if pressure is not None:
+        return pressure >= max_cpu_pressure
+    return loadavg_per_cpu() >= max_loadavg
+
+
+def spare_capacity(max_loadavg, max_cpu_pressure):
+    '''Returns the number of batch jobs the system can take now:
+    none if it's loaded (see `is_loaded`), otherwise one per CPU left
+    under `max_loadavg` per CPU, at least one.
+    '''
+    if is_loaded(max_loadavg, max_cpu_pressure):
+        return 0
+    cpus = os.cpu_count() or 1
+    return max(int((max_loadavg - loadavg_per_cpu()) * cpus), 1)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,68 @@
+'''Cached lookup of the users that jobs belong to.'''
+
+import os
+import pwd
+import time
+
+
+PASSWD_FILE = '/etc/passwd'
+# Secs a looked up user is kept for; users from other sources than
+# `PASSWD_FILE` (e.g. LDAP through NSS) change without touching it
+USER_CACHE_TTL = 300
+
+
+class UserCache:
+    '''EUID -> (name, home) from `pwd`, so that any NSS source works.
+    Entries are dropped all at once when `passwd_file` is modified,
+    and one by one after `ttl` secs.
+    '''
+    def __init__(self, ttl=USER_CACHE_TTL, passwd_file=PASSWD_FILE):
+        self.ttl = ttl
+        self.passwd_file = passwd_file
+        # EUID: (name, home, looked up at (monotonic))
+        self._entries = {}
+        self._passwd_mtime = None
+
+    def _check_passwd(self):
+        try:
+            mtime = os.stat(self.passwd_file).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._passwd_mtime:
+            self._passwd_mtime = mtime
+            self._entries.clear()
+
+    def lookup(self, euid):
+        '''Returns `(name, home)` of `euid`, raises KeyError
+        if there is no such user.
+        '''
+        self._check_passwd()
+        now = time.monotonic()
+        entry = self._entries.get(euid)
+        if entry is None or now - entry[2] > self.ttl:
+            pw_entry = pwd.getpwuid(euid)
+            entry = (pw_entry.pw_name, pw_entry.pw_dir, now)
+            self._entries[euid] = entry
+        return entry[:2]
+
+
+users = UserCache()
+
+
+def username(euid):
+    '''Returns the username of `euid`, or None if there is no such user.'''
+    try:
+        return users.lookup(euid)[0]
+    except KeyError:
+        return None
+
+
+def hat_dir(euid):
+    '''Returns the hat dir of `euid` (job output logs etc.), in the
+    home dir; raises KeyError if there is no such user.
+    '''
+    return os.path.join(users.lookup(euid)[1], '.hatd')
+
+
+if __name__ == '__main__':
+    pass
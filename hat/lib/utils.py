@@ -2,18 +2,28 @@
 
 import datetime
 import fcntl
-import logging
 import json
+import math
 import os
+import select
+import socket
+import struct
 import sys
-import time
+
+
+# Where the FLock files are
+LOCK_DIR = '/var/run/hatd/locks'
+# The LogWriter taking the appends of `write_file`, if started
+_log_writer = None
 
 
 class FLock:
-    '''A context manager for exclusive locking (LOCK_EX) of files.'''
+    '''A context manager for exclusive locking (LOCK_EX) of files.
+    Waits for the lock in the kernel, woken as soon as it's released.
+    '''
     def __init__(self, lockfile_prefix=''):
         lockfile_prefix = lockfile_prefix.replace('/', '_')
-        self.lockfile = os.path.join('/var/run/hatd/locks',
+        self.lockfile = os.path.join(LOCK_DIR,
                                      '._{}.lock'.format(lockfile_prefix))
 
     def __enter__(self):
@@ -22,18 +32,75 @@ class FLock:
             os.chmod(self.lockfile, 0o660)
         except PermissionError:
             pass
-        while True:
-            try:
-                fcntl.lockf(self.lockf, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            except BlockingIOError:
-                time.sleep(0.5)
-                continue
-            return self.lockf
-        
+        try:
+            fcntl.lockf(self.lockf, fcntl.LOCK_EX)
+        except BaseException:
+            self.lockf.close()
+            raise
+        return self.lockf
+
     def __exit__(self, *exc_info):
         fcntl.lockf(self.lockf, fcntl.LOCK_UN)
         self.lockf.close()
-        
+
+
+class FifoReader:
+    '''Line reader for a FIFO that can wait for input with a timeout,
+    instead of polling. The FIFO is opened read-write so that it does
+    not keep hitting EOF once all writers are gone; a wait blocks
+    until something is actually written.
+    '''
+    def __init__(self, fifo_path):
+        self.fd = os.open(fifo_path, os.O_RDWR | os.O_NONBLOCK)
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+        self._buffer = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def fileno(self):
+        return self.fd
+
+    def wait(self, timeout=None, other_fds=()):
+        '''Blocks until there is input or `timeout` secs have
+        passed (forever if None); `other_fds` (e.g. process
+        sentinels) also end the wait once ready. Returns True
+        if there is input in the FIFO.
+        '''
+        if timeout is not None:
+            # Rounding up, so that we never wake before the deadline
+            timeout = math.ceil(max(timeout, 0) * 1000)
+        for fd in other_fds:
+            self._poll.register(fd, select.POLLIN)
+        try:
+            ready = self._poll.poll(timeout)
+        finally:
+            for fd in other_fds:
+                self._poll.unregister(fd)
+        return any(fd == self.fd for fd, _ in ready)
+
+    def readlines(self):
+        '''Returns the complete (non-empty) lines available now,
+        keeping any partial line for the next call.
+        '''
+        while True:
+            try:
+                chunk = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b'\n')
+        return [line.decode('utf-8') for line in lines if line.strip()]
+
+    def close(self):
+        os.close(self.fd)
+
 
 def print_msg(msg, end='\n', flush_stream=True, file=sys.stdout):
     '''Wrapper for formatting-printing.'''
@@ -42,48 +109,110 @@ def print_msg(msg, end='\n', flush_stream=True, file=sys.stdout):
 
 
 def read_file(file_path, mode='rt', whole=False, json_loads=False):
-    '''Reading from a file with FLock; if `whole` is True, reads
-    whole content, otherwise just a single line. `json_load`
-    parameter dictates the output format.
+    '''Reading from a file; if `whole` is True, reads whole content,
+    otherwise just a single line. `json_load` parameter dictates the
+    output format. No lock is taken, as `write_file` writes whole
+    lines at once.
     '''
-    lock_name = '{}/read_{}'.format(file_path, file_path.replace('/', '_'))
-    with FLock(lock_name):
-        with open(file_path, mode) as f:
-            try:
-                content = f.read() if whole else next(f)
-            except (EOFError, StopIteration):
-                return None
-            return json.loads(content.strip()) if json_loads else content
+    with open(file_path, mode) as f:
+        try:
+            content = f.read() if whole else next(f)
+        except (EOFError, StopIteration):
+            return None
+        return json.loads(content.strip()) if json_loads else content
 
 
-def write_file(file_path, content, mode='wt', nodate=False, json_dumps=False):
-    '''Writes `content` to `filename`. Similar design to `read_file`'''
+def write_file(file_path, content, mode='wt', nodate=False, json_dumps=False,
+               lock=False, index=False):
+    '''Writes `content` to `filename` as a line, with a single write
+    on an unbuffered file. Appends (`mode='at'`) from any number of
+    processes thus land whole, one after another (O_APPEND), with no
+    lock; the other files are written by the daemon alone. `lock`
+    takes a FLock of the file for the write, for large records (e.g.
+    job output) that the kernel may write in parts; `index` notes the
+    record in the time index of the file (see `lib/logindex.py`), for
+    job logs, written with `lock`. Appends go through the log writer
+    instead, if one is started (see `lib/logwriter.py`).
+    '''
+    data = log_line(content, nodate, json_dumps)
+    if mode == 'at':
+        if _log_writer is not None:
+            _log_writer.write(file_path, data, lock, index)
+        else:
+            append_direct(file_path, data, lock, index)
+        return True
     # Create intermediate dirs
     os.makedirs(os.path.dirname(file_path), mode=0o755, exist_ok=True)
-    lock_name = '{}/write_{}'.format(file_path, file_path.replace('/', '_'))
-    with FLock(lock_name):
-        with open(file_path, mode) as f:
-            f.write('{} : {}\n'.format(
-                datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                content,
-            )) if not nodate else f.write(
-                json.dumps(content) if json_dumps
-                else '{}\n'.format(content)
-            )
-            return True
-            
+    _write_whole(file_path, mode, data)
+    return True
+
+
+def log_line(content, nodate=False, json_dumps=False):
+    '''Returns the line (bytes) `write_file` writes for `content`.'''
+    if not nodate:
+        line = '{} : {}\n'.format(
+            datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), content)
+    else:
+        line = '{}\n'.format(json.dumps(content) if json_dumps else content)
+    return line.encode('utf-8')
+
+
+def append_direct(file_path, data, lock=False, index=False):
+    '''Appends `data` (bytes) to `file_path` with a single write, under
+    the file's FLock if `lock`; noting it in the time index of the file
+    if `index`.
+    '''
+    os.makedirs(os.path.dirname(file_path), mode=0o755, exist_ok=True)
+    if not lock:
+        _write_whole(file_path, 'a', data)
+        return
+    with file_lock(file_path):
+        offset = _write_whole(file_path, 'a', data)
+        if index:
+            from .logindex import note_record
+            note_record(file_path, offset, data)
 
-def username_from_euid(euid):
-    '''Takes a EUID, and returns the username.'''
-    with open('/etc/passwd') as f:
-        for line in f:
-            line = line.split(':')
-            if str(euid) in line:
-                return line[0]
+
+def set_log_writer(writer):
+    '''Sets the LogWriter taking the appends of `write_file`, None
+    for none; returns the previous one.
+    '''
+    global _log_writer
+    previous, _log_writer = _log_writer, writer
+    return previous
+
+
+def file_lock(file_path):
+    '''Returns the FLock taken by `write_file(..., lock=True)`
+    for writing to `file_path`.
+    '''
+    return FLock('{}/write_{}'.format(file_path, file_path.replace('/', '_')))
+
+
+def _write_whole(file_path, mode, data):
+    '''Writes `data` whole; returns the offset it's written at,
+    if appending.
+    '''
+    with open(file_path, mode.replace('t', '') + 'b', buffering=0) as f:
+        offset = f.tell() if 'a' in mode else None
+        view = memoryview(data)
+        while view:
+            view = view[f.write(view):]
+        return offset
+
+
+def peer_credentials(sock):
+    '''Returns `(pid, uid, gid)` of the process at the other end of
+    the Unix socket `sock`, as the kernel saw it on connect.
+    '''
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    return struct.unpack('3i', creds)
 
 
 def get_logger(logfile='/var/log/hatd/debug.log'):
     # Enable (debug) logging to /var/log/hatd/debug.log
+    import logging
     logger = logging.getLogger('hatd_base_logger')
     
     handler = logging.FileHandler(logfile)
@@ -29,6 +29,10 @@ mkdir -p /var/log/hatd/
 # Create DB file
 [[ -f ${HAT_DB_DIR}/hatdb.pkl ]] || { mkdir -p "${HAT_DB_DIR}" && : >"${HAT_DB_DIR}"/hatdb.pkl ;}
 
+# Copying the config file, keeping any existing one
+mkdir -p /etc/hatd
+[[ -f /etc/hatd/hatd.conf ]] || cp system/hatd.conf /etc/hatd/
+
 # Copying the logrotate file
 cp system/hat-daemon /etc/logrotate.d/
 
@@ -63,7 +67,7 @@ systemctl enable hat-daemon.service && \
 #        rm /etc/systemd/system/hat-daemon.service && \
 #        systemctl daemon-reload
 # 2. Remove other files and directories:
-#        rm -r /var/lib/hatd/ /var/run/hatd/ /usr/lib/hatd/ /etc/logrotate.d/hat-daemon /usr/share/man/man1/hatc.1.gz /usr/bin/hat{c,-parser}
+#        rm -r /var/lib/hatd/ /var/run/hatd/ /usr/lib/hatd/ /etc/hatd/ /etc/logrotate.d/hat-daemon /usr/share/man/man1/hatc.1.gz /usr/bin/hat{c,-parser}
 #
-# N.B: If you want to keep the enqueued jobs, don't remove `/var/lib/hatd/`, precisely `/var/lib/hatd/hatdb.pkl`.
+# N.B: If you want to keep the enqueued jobs, don't remove `/var/lib/hatd/`, precisely `/var/lib/hatd/hatdb.pkl` and `/var/lib/hatd/cold/`.
 #
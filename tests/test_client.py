@@ -3,9 +3,13 @@
 # Test case(s) for the hat client -- `client.py`
 
 import os
+import subprocess
 import sys
+import tempfile
 import unittest
 
+from unittest import mock
+
 # Inserting the dir in `sys.path` at index 0
 sys.path.insert(0, os.path.join(os.path.dirname(
     os.path.dirname(os.path.abspath(__file__))), 'hat'))
@@ -66,6 +70,88 @@ class ClientTest(unittest.TestCase):
             self.assertIsNotNone(received, 'No data for: {}'.format(arg))
 
 
+class AddFromTest(unittest.TestCase):
+    '''Testing the reading of bulk submissions (`--add-from`).'''
+    def test_lines(self):
+        '''TSV and JSON lines become jobs; bad lines are reported
+        by line number, along with the daemon's results.
+        '''
+        with tempfile.NamedTemporaryFile('w', suffix='.tsv') as f:
+            f.write('# backups\n'
+                    'backup-home\tnow + 1 hour\tbash\n'
+                    '\n'
+                    '{"command": "sync", "time": "now + 2 hours", '
+                    '"exact": true}\n'
+                    'no time here\n'
+                    '{"command": "sync"}\n')
+            f.flush()
+            data = client.SendReceiveData(('add_from', False, f.name),
+                                          batch=True)
+            data.add_from_fmt((False, f.name))
+        home, sync = data.out_dict['add_jobs']
+        self.assertEqual((home['command'], home['use_shell'], home['exact'],
+                          home['batch']),
+                         ('bash -c "backup-home"', 'bash', False, True))
+        self.assertEqual((sync['command'], sync['use_shell'], sync['exact']),
+                         ('sync', False, True))
+        self.assertEqual(data.line_numbers, [2, 4])
+        self.assertEqual(sorted(data.line_errors), [5, 6])
+        results = data.add_from_results([
+            {'msg': 'Done', 'job_id': 7},
+            {'error': {'msg': 'Job slot exceeded'}},
+        ])
+        self.assertEqual(results.splitlines()[:2],
+                         ['2: Done (Job ID 7)', '4: Job slot exceeded'])
+        self.assertTrue(results.splitlines()[2].startswith('5: Invalid job'))
+
+
+class StartupTest(unittest.TestCase):
+    '''Testing what hatc does on every call.'''
+    def test_lazy_imports(self):
+        '''Only the calls that need them import these.'''
+        modules = subprocess.run(
+            [sys.executable, '-c',
+             'import sys; sys.path.insert(0, {!r}); import client; '
+             'print(" ".join(sys.modules))'.format(
+                 os.path.dirname(client.__file__))],
+            check=True, stdout=subprocess.PIPE).stdout.decode().split()
+        for module in ('argparse', 'subprocess', 'shlex', 'logging',
+                       'lib.humantime_epoch_converter', 'lib.users'):
+            self.assertNotIn(module, modules)
+
+    def test_fast_arguments(self):
+        '''The queries handled without argparse are read as argparse
+        would.
+        '''
+        for args, data_seq in client.FAST_ARGUMENTS.items():
+            with mock.patch.object(sys, 'argv', ['hatc', *args]):
+                self.assertEqual(
+                    client.argument_serializer(client.parse_arguments()),
+                    data_seq)
+
+    def test_check_daemon_process(self):
+        '''The daemon is taken as running only if the process of the
+        PID file is the daemon's.
+        '''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pid_file = os.path.join(tmp_dir, 'hatd.pid')
+            self.assertFalse(client.check_daemon_process(pid_file))
+            for content in ('', 'garbage', str(os.getpid())):
+                with open(pid_file, 'w') as f:
+                    f.write(content)
+                self.assertFalse(client.check_daemon_process(pid_file))
+            # Looking like the daemon, from its command line
+            daemon = subprocess.Popen([sys.executable, '-c',
+                                       'import time; time.sleep(30)',
+                                       'daemon_front.py'])
+            with open(pid_file, 'w') as f:
+                f.write(str(daemon.pid))
+            self.assertTrue(client.check_daemon_process(pid_file))
+            daemon.kill()
+            daemon.wait()
+            self.assertFalse(client.check_daemon_process(pid_file))
+
+
 if __name__ == '__main__':
     unittest.main()
 
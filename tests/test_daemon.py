@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the daemon -- `daemon.py`
+
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+import daemon
+from lib import runner, scheduler
+from lib.coldstore import ColdStore
+
+
+class SingleProcessTest(unittest.TestCase):
+    '''Testing the runner as a task of the daemon's event loop
+    (`single_process`), on jobs in memory, committing nothing.
+    '''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.saved_cold_jobs = scheduler.cold_jobs
+        scheduler.cold_jobs = ColdStore(self.tmp_dir.name)
+        scheduler.enqueued_jobs.clear()
+        scheduler._rebuild_index()
+        scheduler._reset_counts()
+        self.daemon = daemon.HatDaemon()
+        self.daemon.single_process = True
+        for patcher in (mock.patch.object(runner, 'open_db',
+                                          lambda: iter(())),
+                        mock.patch.object(runner, 'commit_db'),
+                        mock.patch.object(runner, 'write_file'),
+                        mock.patch.object(daemon, 'write_file')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.daemon.single_process = False
+        scheduler.cold_jobs = self.saved_cold_jobs
+        scheduler.enqueued_jobs.clear()
+        scheduler._rebuild_index()
+        scheduler._reset_counts()
+        self.tmp_dir.cleanup()
+
+    def test_round(self):
+        '''Requests are answered by the runner task once committed,
+        and the task ends on stop.
+        '''
+        time_ = time.strftime('%Y-%m-%d_%H:%M:%S',
+                              time.localtime(time.time() + 3600))
+
+        async def session():
+            await self.daemon.open_runner_channel()
+            added = await self.daemon.add_job(1000, False, 'true', time_)
+            counts = await self.daemon.jobcount(1000)
+            page = await self.daemon.joblist(1000, {})
+            self.assertTrue(self.daemon.stop())
+            await asyncio.wait_for(self.daemon.close_runner_channel(), 10)
+            return added, counts, page
+
+        added, counts, page = asyncio.run(session())
+        self.assertEqual(added, {'msg': 'Done'})
+        self.assertEqual(counts, {'total': 1, 'exact': 0,
+                                  'overdue_pending': 0})
+        self.assertEqual([job_id for job_id, _ in page['jobs']], [1])
+        self.assertTrue(runner.commit_db.called)
+        self.assertTrue(self.daemon._runner_task.done())
+
+
+class RunnerExitTest(unittest.TestCase):
+    '''Testing the requests to a runner process that is gone.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.daemon = daemon.HatDaemon()
+        self.saved = (self.daemon.daemon, self.daemon.runner_in,
+                      self.daemon.runner_out)
+        self.daemon.runner_in, self.daemon.runner_out = (
+            os.path.join(self.tmp_dir.name, name)
+            for name in ('runner_in.fifo', 'runner_out.fifo'))
+        for fifo in (self.daemon.runner_in, self.daemon.runner_out):
+            os.mkfifo(fifo)
+        # Standing in for the runner's end of `runner_in`
+        self.reader_fd = os.open(self.daemon.runner_in,
+                                 os.O_RDONLY | os.O_NONBLOCK)
+        # A runner that ends without replying
+        self.daemon.daemon = multiprocessing.Process(target=time.sleep,
+                                                     args=(0.5,))
+        self.daemon.daemon.start()
+        patcher = mock.patch.object(daemon, 'write_file')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.daemon.daemon.join()
+        os.close(self.reader_fd)
+        (self.daemon.daemon, self.daemon.runner_in,
+         self.daemon.runner_out) = self.saved
+        self.tmp_dir.cleanup()
+
+    def test_no_hang(self):
+        '''The waiting requests fail once the runner exits, and so
+        do the ones after.
+        '''
+        async def session():
+            await self.daemon.open_runner_channel()
+            results = []
+            for _ in range(2):
+                try:
+                    results.append(await asyncio.wait_for(
+                        self.daemon.jobcount(1000), 10))
+                except ValueError as e:
+                    results.append(str(e))
+            return results
+
+        self.assertEqual(asyncio.run(session()), ['Runner failed'] * 2)
+        self.assertIn('Runner exited', daemon.write_file.call_args[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
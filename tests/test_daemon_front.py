@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the daemon front -- `daemon_front.py`
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from daemon_front import DaemonWrapper
+
+
+class FakeDaemon:
+    '''Stand-in for `HatDaemon`, echoing what it's asked.'''
+    async def add_job(self, **job):
+        return {'added': job}
+
+    async def jobcount(self, euid):
+        return {'euid': euid}
+
+    async def remove_job(self, euid, *job_ids):
+        return {'removed': list(job_ids)}
+
+    async def joblist(self, euid, options):
+        return {'options': options}
+
+
+class SocketServerTest(unittest.TestCase):
+    '''Testing the serving of clients over the Unix socket.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.socket_file = os.path.join(self.tmp_dir.name, 'hatd.sock')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _exchange(self, lines):
+        '''Sends `lines` on one connection, returns the replies.'''
+        async def exchange():
+            wrapper = DaemonWrapper(FakeDaemon())
+            server = await asyncio.start_unix_server(wrapper.handle_client,
+                                                     self.socket_file)
+            async with server:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.socket_file)
+                writer.write(''.join('{}\n'.format(line) for line in lines)
+                             .encode('utf-8'))
+                replies = [json.loads(await reader.readline())
+                           for _ in lines]
+                writer.close()
+                await writer.wait_closed()
+            return replies
+        return asyncio.run(exchange())
+
+    def test_peer_identity(self):
+        '''The user is the one at the other end of the connection,
+        whatever the request says; replies come back in order.
+        '''
+        euid = os.geteuid()
+        replies = self._exchange([
+            json.dumps({'jobcount': 12345}),
+            json.dumps({'add_job': {'command': 'true', 'euid': 12345}}),
+            'not json',
+            json.dumps({'no_such_operation': True}),
+        ])
+        self.assertEqual(replies[0], {'euid': euid})
+        self.assertEqual(replies[1], {'added': {'command': 'true',
+                                                'euid': euid}})
+        self.assertEqual(replies[2:], [{'error': {'msg': 'Ambiguous input'}}]
+                         * 2)
+
+    def test_bad_values(self):
+        '''Values of the wrong type get an error reply, and are not
+        passed on.
+        '''
+        replies = self._exchange([
+            json.dumps({'remove_job': [[1000, 'x']]}),
+            json.dumps({'remove_job': ['3']}),
+            json.dumps({'remove_job': 3}),
+            json.dumps({'joblist': {'euid': 0}}),
+            json.dumps({'joblist': {'filter': [1]}}),
+            json.dumps({'remove_job': [3, 4]}),
+            json.dumps({'joblist': {'sort': 'id'}}),
+        ])
+        self.assertEqual(replies[:5], [{'error': {'msg': 'Ambiguous input'}}]
+                         * 5)
+        self.assertEqual(replies[5:], [{'removed': [3, 4]},
+                                       {'options': {'sort': 'id'}}])
+
+
+if __name__ == '__main__':
+    unittest.main()
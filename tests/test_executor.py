@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the bounded job executor -- `lib/executor.py`
+
+import os
+import sys
+import unittest
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib.executor import JobExecutor
+
+
+class FakeProcess:
+    '''Stand-in for `multiprocessing.Process`.'''
+    def __init__(self):
+        self.alive = True
+        self.sentinel = -1
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self):
+        pass
+
+
+class JobExecutorTest(unittest.TestCase):
+    '''Testing the concurrency limit and pending queue.'''
+    def setUp(self):
+        self.procs = {}
+        self.executor = JobExecutor(self._launch, 2)
+
+    def _launch(self, item):
+        if item == 'gone':
+            return None
+        self.procs[item] = FakeProcess()
+        return self.procs[item]
+
+    def test_bounded(self):
+        '''Only `max_workers` items run, the rest wait in order.'''
+        for item in ('a', 'gone', 'b', 'c', 'd'):
+            self.executor.submit(item)
+        self.assertEqual(self.executor.run_pending(), ['a', 'b'])
+        self.assertEqual(self.executor.run_pending(), [])
+        stats = self.executor.stats()
+        self.assertEqual((stats['running'], stats['pending']), (2, 2))
+        self.procs['b'].alive = False
+        self.assertEqual(self.executor.run_pending(), ['c'])
+        self.assertEqual(self.executor.stats()['started'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Test case(s) for saving job output -- `lib/joboutput.py`
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib import joboutput
+from lib.joboutput import OutputSpool, pump_output, write_output_record
+
+
+class OutputSpoolTest(unittest.TestCase):
+    '''Testing the on-disk spooling of job output.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _saved(self, spool):
+        with tempfile.TemporaryFile(dir=self.tmp_dir.name) as f:
+            spool.copy_to(f)
+            f.seek(0)
+            return f.read().decode('utf-8')
+
+    def test_truncated(self):
+        spool = OutputSpool(self.tmp_dir.name, 10)
+        # The last char kept would be cut in two
+        spool.feed('abcdefghiéxyz'.encode('utf-8'), final=True)
+        self.assertEqual(self._saved(spool), 'abcdefghi\n[hat: output '
+                         'truncated at 9 bytes, 5 more bytes dropped]')
+        spool.close()
+
+    def test_undecodable(self):
+        spool = OutputSpool(self.tmp_dir.name, 100)
+        spool.feed(b'a\xff\xc3')
+        spool.feed(b'\xa9', final=True)
+        self.assertEqual(self._saved(spool), 'a\\xffé')
+        spool.close()
+
+    def test_pump_both_pipes(self):
+        # More than a pipe holds, on both streams
+        proc = subprocess.Popen(
+            [sys.executable, '-c', 'import sys; '
+             'sys.stderr.write("e" * 200000); print("o" * 200000)'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout = OutputSpool(self.tmp_dir.name, 1000)
+        stderr = OutputSpool(self.tmp_dir.name, 300000)
+        pump_output({proc.stdout: stdout, proc.stderr: stderr})
+        self.assertEqual(proc.wait(), 0)
+        self.assertEqual((stdout.size, stdout.dropped), (1000, 199001))
+        self.assertEqual((stderr.size, stderr.dropped), (200000, 0))
+        stdout.close()
+        stderr.close()
+
+    def test_ndjson_record(self):
+        log_file = os.path.join(self.tmp_dir.name, 'logs', 'stdout.log')
+        fields = {'euid': 1000, 'job_id': 7, 'command': 'x : "y"',
+                  'scheduled': '2026-01-02 03:04:05', 'returncode': 0,
+                  'duration': 0.5}
+        outputs = ['a : b\n"é"\\', 'z' * (joboutput.SMALL_RECORD + 1)]
+        for output in outputs:
+            spool = OutputSpool(self.tmp_dir.name, 1 << 20)
+            spool.feed(output.encode('utf-8'), final=True)
+            # Streamed if large
+            write_output_record(log_file, fields, spool, ndjson=True)
+            spool.close()
+        with open(log_file) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([record['out'] for record in records], outputs)
+        self.assertEqual(list(records[1])[:2], ['run', 'scheduled'])
+        self.assertEqual(records[1]['command'], 'x : "y"')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the time index of the job logs -- `lib/logindex.py`
+
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib import logindex
+
+
+class LogIndexTest(unittest.TestCase):
+    '''Testing seeking to a time in a log.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.tmp_dir.name, 'stdout.log')
+        self.offsets = {}
+        at = datetime.datetime(2026, 1, 1)
+        with open(self.log_file, 'wb') as f:
+            for i in range(3000):
+                at += datetime.timedelta(seconds=i % 7)
+                time_ = at.strftime('%Y-%m-%d %H:%M:%S')
+                self.offsets.setdefault(time_, f.tell())
+                if i % 2:
+                    record = '{{"run": "{0}", "scheduled": "{0}", ' \
+                        '"out": "{1}"}}\n'.format(time_, 'x' * i)
+                else:
+                    record = '{0} : euid>0 : id>{1} : time>{0} : cmd>x : ' \
+                        'ret>0 :: out>{1}\n{2}\n'.format(time_, i, 'y' * i)
+                logindex.note_record(self.log_file, f.tell(),
+                                     record.encode('utf-8'))
+                f.write(record.encode('utf-8'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _check_offset(self, offset, start):
+        '''No record from `start` on is before `offset`, and not many
+        bytes are read before the first one.
+        '''
+        first = min(at for time_, at in self.offsets.items()
+                    if time_ >= start)
+        self.assertLessEqual(offset, first)
+        self.assertLess(first - offset, 2 * logindex.INDEX_EVERY)
+
+    def test_seek(self):
+        entries = logindex.read_index(self.log_file)
+        self.assertGreater(len(entries), 10)
+        with open(self.log_file, 'rb') as f:
+            for start in sorted(self.offsets)[::97]:
+                self._check_offset(
+                    logindex.seek_offset(f, self.log_file, start), start)
+                # Without the index
+                self._check_offset(logindex.bisect_offset(f, start), start)
+
+    def test_rebuilt(self):
+        entries = logindex.read_index(self.log_file)
+        os.remove(logindex.index_path(self.log_file))
+        self.assertEqual(logindex.build_index(self.log_file), len(entries))
+        self.assertEqual(logindex.read_index(self.log_file), entries)
+
+    def test_stale_index(self):
+        with open(logindex.index_path(self.log_file), 'a') as f:
+            f.write('2026-01-01 00:00:01 17\n')
+        start = sorted(self.offsets)[-1]
+        with open(self.log_file, 'rb') as f, \
+                mock.patch.object(logindex, 'bisect_offset',
+                                  wraps=logindex.bisect_offset) as bisect:
+            self._check_offset(
+                logindex.seek_offset(f, self.log_file, start), start)
+        bisect.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the buffered log writer -- `lib/logwriter.py`
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib import logwriter, utils
+
+
+class LogWriterTest(unittest.TestCase):
+    '''Testing the buffered writing of log records.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.tmp_dir.name, 'logs', 'a.log')
+        # Written out on stop only
+        self.writer = logwriter.start_log_writer(interval=3600)
+        self.addCleanup(logwriter.stop_log_writer)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _read(self):
+        with open(self.log_file) as f:
+            return f.read()
+
+    def test_coalesced(self):
+        with mock.patch.object(logwriter.os, 'write',
+                               wraps=os.write) as write:
+            for i in range(100):
+                utils.write_file(self.log_file, i, mode='at', nodate=True)
+            logwriter.stop_log_writer()
+        self.assertEqual(self._read().split(), [str(i) for i in range(100)])
+        self.assertEqual(write.call_count, 1)
+
+    def test_reopened_when_rotated(self):
+        writer = logwriter.LogWriter()
+        writer._add(self.log_file, b'old\n', False)
+        writer._flush()
+        os.rename(self.log_file, self.log_file + '.1')
+        writer._add(self.log_file, b'new\n', False)
+        writer._flush()
+        writer._close_all()
+        self.assertEqual(self._read(), 'new\n')
+
+    def test_lost_records_reported(self):
+        '''Records that can't be written are reported in the daemon log.'''
+        daemon_log = os.path.join(self.tmp_dir.name, 'daemon.log')
+        # A regular file where a dir should be
+        open(os.path.join(self.tmp_dir.name, 'file'), 'w').close()
+        writer = logwriter.LogWriter()
+        writer._add(os.path.join(self.tmp_dir.name, 'file', 'a.log'), b'x\n')
+        with mock.patch.object(logwriter, 'DAEMON_LOG', daemon_log):
+            writer._flush()
+        with open(daemon_log) as f:
+            self.assertIn('file/a.log lost', f.read())
+
+    def test_from_child(self):
+        proc = multiprocessing.Process(
+            target=utils.write_file, args=(self.log_file, 'child'),
+            kwargs={'mode': 'at', 'nodate': True, 'lock': True})
+        proc.start()
+        proc.join()
+        utils.write_file(self.log_file, 'parent', mode='at', nodate=True)
+        logwriter.stop_log_writer()
+        self.assertEqual(sorted(self._read().split()), ['child', 'parent'])
+
+    def test_stop_timeout(self):
+        '''Stopping waits for a stuck write out up to the timeout only,
+        and reports it.
+        '''
+        daemon_log = os.path.join(self.tmp_dir.name, 'daemon.log')
+        stuck = threading.Event()
+        self.addCleanup(stuck.set)
+        utils.write_file(self.log_file, 'stuck', mode='at', nodate=True)
+        with mock.patch.object(self.writer, '_flush',
+                               lambda: stuck.wait(10)), \
+                mock.patch.object(logwriter, 'DAEMON_LOG', daemon_log):
+            started = time.monotonic()
+            self.assertFalse(logwriter.stop_log_writer(timeout=0.2))
+            self.assertLess(time.monotonic() - started, 5)
+        with open(daemon_log) as f:
+            self.assertIn('not stopped in 0.2 secs', f.read())
+
+    def test_late_records(self):
+        '''Records handed over once stopped are written directly.'''
+        self.assertTrue(logwriter.stop_log_writer())
+        self.writer.write(self.log_file, b'parent\n')
+        proc = multiprocessing.Process(
+            target=self.writer.write, args=(self.log_file, b'child\n'))
+        proc.start()
+        proc.join()
+        self.assertEqual(sorted(self._read().split()), ['child', 'parent'])
+
+
+if __name__ == '__main__':
+    unittest.main()
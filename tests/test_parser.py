@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the log parser -- `hat-parser.py`
+
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+PARSER = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'hat', 'hat-parser.py')
+
+
+class ParallelSearchTest(unittest.TestCase):
+    '''Testing the search of rotated and compressed logs with `-j`.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_dir = os.path.join(self.tmp_dir.name, '.hatd', 'logs')
+        os.makedirs(self.log_dir)
+        # Oldest first: compressed, rotated, current
+        for age, (name, day) in enumerate(reversed([
+                ('stdout.log.2.gz', '01'), ('stdout.log.1', '02'),
+                ('stdout.log', '03')])):
+            self._write_log(name, day, age)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write_log(self, name, day, age):
+        records = []
+        for job_id, hour in enumerate(('08', '12', '20'), 1):
+            run = '2026-03-{} {}:00:00'.format(day, hour)
+            command = 'backup-{}'.format(job_id) if job_id % 2 else 'true'
+            records.append('{} : euid>1000 : id>{} : time>{} : cmd>{} : '
+                           'ret>0 :: out>line 1\nline 2\n'.format(
+                               run, job_id, run, command))
+        records.append('{}\n'.format(json.dumps({
+            'run': '2026-03-{} 23:00:00'.format(day),
+            'scheduled': '2026-03-{} 23:00:00'.format(day),
+            'euid': 1000, 'job_id': 9, 'command': 'backup-nd',
+            'returncode': 0, 'duration': 0.1, 'dropped': 0,
+            'out': 'nd'})))
+        data = ''.join(records).encode('utf-8')
+        path = os.path.join(self.log_dir, name)
+        with (gzip.open if name.endswith('.gz') else open)(path, 'wb') as f:
+            f.write(data)
+        mtime = 1700000000 - age * 86400
+        os.utime(path, (mtime, mtime))
+
+    def _search(self, *args):
+        return subprocess.run(
+            [sys.executable, PARSER] + list(args), check=True,
+            stdout=subprocess.PIPE, env=dict(os.environ,
+                                             HOME=self.tmp_dir.name)
+        ).stdout.decode('utf-8')
+
+    def test_same_as_serial(self):
+        '''Searching in parallel gives the serial output, in order.'''
+        for args in ((), ('-c', '^backup-'),
+                     ('-f', '2026-03-02T10:00:00',
+                      '-t', '2026-03-03T09:00:00'),
+                     ('-s', '-f', '2026-03-02T00:00:00')):
+            serial = self._search('-j', '1', *args)
+            self.assertTrue(serial.strip())
+            self.assertEqual(self._search('-j', '3', *args), serial, args)
+        days = [line[8:10] for line in self._search('-j', '3').split()
+                if line.startswith('2026-03-')]
+        self.assertEqual(days, sorted(days))
+        self.assertEqual(set(days), {'01', '02', '03'})
+
+
+if __name__ == '__main__':
+    unittest.main()
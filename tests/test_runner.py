@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the base runner -- `lib/runner.py`
+
+import collections
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib import runner, scheduler
+from lib.coldstore import ColdStore
+from lib.executor import JobExecutor
+
+
+class CatchupTest(unittest.TestCase):
+    '''Testing the rate-limited release of overdue jobs.'''
+    def setUp(self):
+        self.runner = runner.BaseRunner()
+        self.saved_executor = self.runner.executor
+        self.runner.executor = JobExecutor(lambda item: None, 2)
+        self.runner.catchup = []
+        self.runner._next_catchup = 0
+        patcher = mock.patch.object(runner, 'write_file')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.runner.executor = self.saved_executor
+
+    def _pending(self):
+        return [item for _, item in self.runner.executor.pending]
+
+    def test_rate_limited_in_run_time_order(self):
+        '''Overdue jobs go out oldest first, one per 1/rate secs.'''
+        for job_id, job_run_at in ((1, 300), (2, 100), (3, 200)):
+            self.runner._add_catchup((1000, job_id, job_run_at))
+        with mock.patch.object(runner, 'get_config',
+                               {'catchup_rate': 2.0,
+                                'catchup_jitter': 0.0}.get):
+            self.runner._release_catchup(1000)
+            self.runner._release_catchup(1000.2)
+            self.assertEqual(self._pending(), [(1000, 2, 100)])
+            self.runner.executor.pending.clear()
+            self.runner._release_catchup(1000.5)
+            self.assertEqual(self._pending(), [(1000, 3, 200)])
+            self.assertEqual(self.runner._stats()['catchup_backlog'], 1)
+
+    def test_on_time_jobs_first(self):
+        '''Nothing is released while on-time jobs are pending.'''
+        self.runner._add_catchup((1000, 1, 100))
+        self.runner.executor.submit((1000, 2, 1000))
+        with mock.patch.object(runner, 'get_config',
+                               {'catchup_rate': 0.0,
+                                'catchup_jitter': 0.0}.get):
+            self.runner._release_catchup(1000)
+            self.assertEqual(self._pending(), [(1000, 2, 1000)])
+            self.runner.executor.pending.clear()
+            self.runner._release_catchup(1000)
+            self.assertEqual(self._pending(), [(1000, 1, 100)])
+
+
+class BatchTest(unittest.TestCase):
+    '''Testing the admission of held batch jobs.'''
+    def setUp(self):
+        self.runner = runner.BaseRunner()
+        self.saved_executor = self.runner.executor
+        self.runner.executor = JobExecutor(lambda item: None, 32)
+        self.runner.batch_held = collections.deque(
+            (1000, job_id, 100) for job_id in range(1, 6))
+        self.runner._next_batch_check = 0
+        self.runner._batch_admitted = collections.deque()
+        patcher = mock.patch.object(runner, 'get_config',
+                                    {'batch_check_interval': 5,
+                                     'batch_max_loadavg': 0.8,
+                                     'batch_max_cpu_pressure': 10.0}.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.runner.executor = self.saved_executor
+        self.runner.batch_held.clear()
+        self.runner._batch_admitted.clear()
+
+    def _admit(self, current_time, spare):
+        with mock.patch.object(runner, 'spare_capacity',
+                               lambda *limits: spare):
+            self.runner._admit_batch_jobs(current_time)
+        admitted = [item[1] for _, item in self.runner.executor.pending]
+        self.runner.executor.pending.clear()
+        return admitted
+
+    def test_held_while_loaded(self):
+        '''Nothing is admitted while loaded, and the load is only
+        checked once per `batch_check_interval`.
+        '''
+        self.assertEqual(self._admit(1000, 0), [])
+        self.assertEqual(self._admit(1001, 3), [])
+        self.assertEqual(self._admit(1005, 3), [1, 2, 3])
+        self.assertEqual(len(self.runner.batch_held), 2)
+
+    def test_recent_admissions_count(self):
+        '''Jobs admitted lately use up the spare capacity, but one job
+        is admitted per check as long as the system is not loaded.
+        '''
+        self.assertEqual(self._admit(1000, 2), [1, 2])
+        self.assertEqual(self._admit(1005, 3), [3])
+        self.assertEqual(self._admit(1010, 2), [4])
+        self.assertEqual(self._admit(1000 + runner.BATCH_SETTLE_SECS, 2),
+                         [5])
+
+
+class DueCountTest(unittest.TestCase):
+    '''Testing the count of due jobs not started yet.'''
+    def test_mark_unmark(self):
+        base_runner = runner.BaseRunner()
+        base_runner.due_jobs, base_runner.due_counts = {}, \
+            collections.Counter()
+        base_runner._mark_due(1000, 1, 100)
+        base_runner._mark_due(1000, 1, 100)
+        base_runner._mark_due(1000, 2, 100)
+        base_runner._unmark_due(1000, 1)
+        base_runner._unmark_due(1000, 1)
+        with mock.patch.object(runner, 'job_counts',
+                               lambda euid: {'total': 2, 'exact': 0}):
+            self.assertEqual(base_runner._job_counts(1000),
+                             {'total': 2, 'exact': 0, 'overdue_pending': 1})
+            base_runner._unmark_due(1000, 2)
+            self.assertEqual(base_runner._job_counts(1000)['overdue_pending'],
+                             0)
+
+
+class RoundTestCase(unittest.TestCase):
+    '''Base of the tests running rounds of the runner, on jobs
+    in memory and a temporary on-disk tier, committing nothing.
+    '''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.saved_cold_jobs = scheduler.cold_jobs
+        scheduler.cold_jobs = ColdStore(self.tmp_dir.name)
+        scheduler.enqueued_jobs.clear()
+        scheduler._rebuild_index()
+        scheduler._reset_counts()
+        self.runner = runner.BaseRunner()
+        self.saved_executor = self.runner.executor
+        # Nothing gets room to start
+        self.runner.executor = JobExecutor(lambda item: None, 0)
+        self.runner.due_jobs, self.runner.due_counts = {}, \
+            collections.Counter()
+        for patcher in (mock.patch.object(self.runner, '_commit_db'),
+                        mock.patch.object(runner, 'write_file')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.now = int(time.time())
+
+    def tearDown(self):
+        self.runner.executor = self.saved_executor
+        self.runner.due_jobs, self.runner.due_counts = {}, \
+            collections.Counter()
+        scheduler.cold_jobs = self.saved_cold_jobs
+        scheduler.enqueued_jobs.clear()
+        scheduler._rebuild_index()
+        scheduler._reset_counts()
+        self.tmp_dir.cleanup()
+
+    def _now(self, delta=0):
+        return time.strftime('%Y-%m-%d_%H:%M:%S',
+                             time.localtime(self.now + delta))
+
+    def _pending(self):
+        return [item[:2] for _, item in self.runner.executor.pending]
+
+
+class DueJobsTest(RoundTestCase):
+    '''Testing that due jobs are handed over exactly once.'''
+
+    def test_rebuilt_index(self):
+        '''Jobs waiting for room are not handed over again once the
+        index is rebuilt.
+        '''
+        job = scheduler.Job(1000, False, 'true', self._now())
+        self.runner._run_round([])
+        scheduler._rebuild_index()
+        self.runner._run_round([])
+        self.assertEqual(self._pending(), [(1000, job.job_id)])
+
+    def test_modified_exact_job(self):
+        '''An on-time exact job modified, keeping its run time, is
+        not taken for a missed one.
+        '''
+        job = scheduler.Job(1000, True, 'true', self._now())
+        self.runner._run_round([])
+        self.runner._add_job({'euid': 1000, 'exact': True, 'command': 'date',
+                              'time_': '_', 'job_id': job.job_id})
+        with mock.patch.object(runner.time, 'time',
+                               return_value=self.now + 60):
+            self.runner._run_round([])
+        self.assertEqual(scheduler.get_job(1000, job.job_id).command, 'date')
+        self.assertEqual(self._pending(), [(1000, job.job_id)])
+
+
+class AddJobsTest(RoundTestCase):
+    '''Testing bulk submissions (`hatc --add-from`).'''
+    def test_reply_per_job(self):
+        '''The jobs are added in one round, with a result each.'''
+        job = {'euid': 1000, 'exact': False, 'command': 'true',
+               'time_': self._now(60)}
+        replies = self.runner._run_round([{'req': 7, 'add_jobs': [
+            job, dict(job, time_='garbage'), dict(job, command='date')]}])
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(replies[0]['req'], 7)
+        first, bad, last = replies[0]['reply']
+        self.assertEqual((first, last), ({'msg': 'Done', 'job_id': 1},
+                                         {'msg': 'Done', 'job_id': 2}))
+        self.assertIn('garbage', bad['error']['msg'])
+        self.assertEqual(scheduler.get_job(1000, 2).command, 'date')
+        self.runner._commit_db.assert_called_once_with()
+
+
+class JoblistTest(RoundTestCase):
+    '''Testing paged `joblist` requests.'''
+    def test_bad_cursor(self):
+        '''A cursor not fit for the sort key gets an error reply,
+        and the runner carries on.
+        '''
+        for delta in (60, 120):
+            scheduler.Job(1000, False, 'true', self._now(delta))
+        cursors = ([1], [], [1, 2, 3], [[1], 2], {'a': 1}, 'ab')
+        replies = self.runner._run_round(
+            [{'req': req, 'joblist': {'euid': 1000, 'cursor': cursor}}
+             for req, cursor in enumerate(cursors)] +
+            [{'req': 9, 'joblist': {'euid': 1000, 'sort': 'id',
+                                    'cursor': [1, 2]}}])
+        self.assertEqual(len(replies), len(cursors) + 1)
+        for reply in replies:
+            self.assertIn('Invalid listing', reply['reply']['error']['msg'])
+        replies = self.runner._run_round([
+            {'req': 1, 'joblist': {'euid': 1000, 'limit': 1}}])
+        page = replies[0]['reply']
+        self.assertEqual([job_id for job_id, _ in page['jobs']], [1])
+        replies = self.runner._run_round([
+            {'req': 2, 'joblist': {'euid': 1000, 'cursor': page['cursor']}}])
+        self.assertEqual([job_id for job_id, _ in replies[0]['reply']['jobs']],
+                         [2])
+
+
+class MessagesTest(RoundTestCase):
+    '''Testing the handling of bad messages in a round.'''
+    def test_bad_message(self):
+        '''A bad message gets an error reply if it's a request, and
+        the rest of the round goes on.
+        '''
+        job = scheduler.Job(1000, False, 'true', self._now(60))
+        replies = self.runner._run_round([
+            {'remove': [[1000, 'x']]},
+            {'req': 1, 'jobcount': 'x'},
+            {'req': 2, 'add_jobs': 3},
+            {'remove': [[1000, job.job_id]]},
+            {'req': 3, 'jobcount': 1000},
+        ])
+        self.assertEqual(replies[:2], [
+            {'req': 1, 'reply': {'error': {'msg': 'Invalid request'}}},
+            {'req': 2, 'reply': {'error': {'msg': 'Invalid request'}}},
+        ])
+        # Answered before the removals of the round
+        self.assertEqual(replies[2]['reply']['total'], 1)
+        self.assertIsNone(scheduler.get_job(1000, job.job_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
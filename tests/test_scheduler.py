@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the job scheduler -- `lib/scheduler.py`
+
+import os
+import pickle
+import sys
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib import config, utils
+# The defaults, whatever the host's config
+config._config = dict(config.DEFAULTS)
+
+from lib import scheduler
+from lib.coldstore import ColdStore
+from lib.jobrecord import JobRecord
+from lib.sqlitestore import SQLiteJobStore
+
+
+class JobsTestCase(unittest.TestCase):
+    '''Base of the tests adding jobs to run `delta` secs after `now`,
+    on an empty queue, with the on-disk tier, the daemon log and the
+    locks in a temporary dir instead of the host's.
+    '''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        lock_dir = os.path.join(self.tmp_dir.name, 'locks')
+        os.mkdir(lock_dir)
+        for module, name, value in (
+                (scheduler, 'DAEMON_LOG',
+                 os.path.join(self.tmp_dir.name, 'daemon.log')),
+                (utils, 'LOCK_DIR', lock_dir)):
+            patcher = mock.patch.object(module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.cold_dir = os.path.join(self.tmp_dir.name, 'cold')
+        self.saved_cold_jobs = scheduler.cold_jobs
+        scheduler.cold_jobs = ColdStore(self.cold_dir)
+        scheduler.enqueued_jobs.clear()
+        scheduler._rebuild_index()
+        scheduler._reset_counts()
+        self.now = int(time.time())
+
+    def tearDown(self):
+        scheduler.cold_jobs = self.saved_cold_jobs
+        scheduler.enqueued_jobs.clear()
+        scheduler._rebuild_index()
+        scheduler._reset_counts()
+        self.tmp_dir.cleanup()
+
+    def _add(self, euid, delta, command='true', job_id=None):
+        time_ = time.strftime('%Y-%m-%d_%H:%M:%S',
+                              time.localtime(self.now + delta))
+        return scheduler.Job(euid, False, command, time_, job_id=job_id)
+
+
+class DueIndexTest(JobsTestCase):
+    '''Testing the due time index of enqueued jobs.'''
+
+    def test_pop_due_jobs_order(self):
+        '''Only due jobs are popped, in run time order.'''
+        late = self._add(1000, 60)
+        first = self._add(1000, 10)
+        second = self._add(1001, 20)
+        self.assertEqual(scheduler.next_run_at(), self.now + 10)
+        due = scheduler.pop_due_jobs(self.now + 30)
+        self.assertEqual([(euid, job_id) for euid, job_id, _ in due],
+                         [(1000, first.job_id), (1001, second.job_id)])
+        self.assertEqual(scheduler.next_run_at(), self.now + 60)
+        # Popped jobs are still enqueued until removed
+        self.assertIn(late.job_id, scheduler.get_enqueued_jobs(1000))
+        self.assertIn(first.job_id, scheduler.get_enqueued_jobs(1000))
+
+    def test_removed_job_is_skipped(self):
+        '''Removed jobs never come out of the index.'''
+        job = self._add(1000, 10)
+        scheduler.remove_job(1000, job.job_id)
+        self.assertIsNone(scheduler.next_run_at())
+        self.assertEqual(scheduler.pop_due_jobs(self.now + 30), [])
+
+    def test_modified_job_is_reindexed(self):
+        '''Modifying by job ID moves the job in the index.'''
+        job = self._add(1000, 10)
+        self._add(1000, 100, job_id=job.job_id)
+        self.assertEqual(scheduler.pop_due_jobs(self.now + 30), [])
+        self.assertEqual(scheduler.next_run_at(), self.now + 100)
+        # Same run time again: must be popped only once
+        scheduler.Job(1000, False, 'date', '_', job_id=job.job_id)
+        due = scheduler.pop_due_jobs(self.now + 100)
+        self.assertEqual(len(due), 1)
+        self.assertEqual(due[0][2].command, 'date')
+
+
+class JobRecordTest(unittest.TestCase):
+    '''Testing the compact job records.'''
+    def test_round_trip(self):
+        '''Commands are shared, and records survive dicts and pickles.'''
+        first = JobRecord(''.join(['sleep ', '1']), 60, '/bin/sh')
+        second = JobRecord(''.join(['sleep ', '1']), 120, '/bin/sh')
+        self.assertIs(first.command, second.command)
+        self.assertEqual(JobRecord.from_dict(first.as_dict()), first)
+        loaded = pickle.loads(pickle.dumps(first))
+        self.assertEqual(loaded, first)
+        self.assertIs(loaded.command, first.command)
+
+
+class JobIdAllocatorTest(JobsTestCase):
+    '''Testing job ID allocation.'''
+
+    def _store(self, allocator):
+        job_id = allocator.allocate()
+        scheduler._count_job(1000, job_id, False)
+        scheduler._store_job(1000, job_id,
+                             JobRecord('true', int(time.time()) + 60))
+        return job_id
+
+    def test_wrap_around(self):
+        '''IDs increase, then reuse the gaps, then run out.'''
+        allocator = scheduler.JobIdAllocator(1000, max_id=4)
+        self.assertEqual([self._store(allocator) for _ in range(4)],
+                         [1, 2, 3, 4])
+        scheduler.remove_job(1000, 3)
+        scheduler.remove_job(1000, 1)
+        self.assertEqual([self._store(allocator) for _ in range(2)], [1, 3])
+        with self.assertRaises(scheduler.HatJobException):
+            allocator.allocate()
+
+    def test_restart_when_empty(self):
+        '''IDs start from 1 again once the queue is empty.'''
+        allocator = scheduler.JobIdAllocator(1000)
+        self._store(allocator)
+        self._store(allocator)
+        scheduler.remove_job(1000, 1)
+        self.assertEqual(self._store(allocator), 3)
+        scheduler.remove_job(1000, 2)
+        scheduler.remove_job(1000, 3)
+        self.assertEqual(self._store(allocator), 1)
+
+
+class ColdTierTest(JobsTestCase):
+    '''Testing the on-disk tier of far-future jobs.'''
+    def setUp(self):
+        super().setUp()
+        self.days = 3 * 86400
+
+    def test_far_jobs_stay_on_disk(self):
+        '''Far-future jobs are listed, but not kept in memory.'''
+        near = self._add(1000, 60)
+        far = self._add(1000, self.days)
+        self.assertEqual(set(scheduler.enqueued_jobs[1000]), {near.job_id})
+        self.assertEqual(set(scheduler.get_enqueued_jobs(1000)),
+                         {near.job_id, far.job_id})
+        self.assertEqual(
+            [job_id for _, job_id, _ in
+             scheduler.pop_due_jobs(self.now + self.days)],
+            [near.job_id])
+        # Surviving a restart
+        reloaded = ColdStore(self.cold_dir)
+        reloaded.load()
+        self.assertIn((1000, far.job_id), reloaded)
+
+    def test_promotion(self):
+        '''Jobs come into memory once within the horizon.'''
+        far = self._add(1000, self.days)
+        self.assertEqual(scheduler.promote_jobs(self.now), 0)
+        self.assertIsNotNone(scheduler.next_promotion_at())
+        self.assertEqual(scheduler.promote_jobs(self.now + self.days), 1)
+        scheduler.cold_jobs.discard_promoted()
+        self.assertIn(far.job_id, scheduler.enqueued_jobs[1000])
+        self.assertEqual(os.listdir(self.cold_dir), [])
+        self.assertEqual(scheduler.next_run_at(), self.now + self.days)
+
+    def test_modify_and_remove(self):
+        '''Modification moves jobs across tiers; removal persists.'''
+        job = self._add(1000, self.days)
+        self._add(1000, 60, job_id=job.job_id)
+        self.assertIn(job.job_id, scheduler.enqueued_jobs[1000])
+        self.assertNotIn((1000, job.job_id), scheduler.cold_jobs)
+        self._add(1000, self.days, command='date', job_id=job.job_id)
+        self.assertNotIn(job.job_id, scheduler.enqueued_jobs[1000])
+        self.assertEqual(
+            scheduler.get_enqueued_jobs(1000)[job.job_id].command, 'date')
+        scheduler.remove_job(1000, job.job_id)
+        reloaded = ColdStore(self.cold_dir)
+        reloaded.load()
+        self.assertNotIn((1000, job.job_id), reloaded)
+
+    def test_match_jobs(self):
+        '''Filters apply to the jobs of both tiers.'''
+        near = self._add(1000, 60, command='backup-home')
+        far = self._add(1000, self.days, command='backup-etc')
+        self._add(1000, 120, command='true')
+        self._add(1001, 60, command='backup-home')
+        self.assertEqual(sorted(scheduler.match_jobs(1000, '^backup-')),
+                         [near.job_id, far.job_id])
+        self.assertEqual(
+            scheduler.match_jobs(1000, 'backup', before=self.now + 3600),
+            [near.job_id])
+        self.assertEqual(
+            scheduler.match_jobs(1000, after=self.now + 3600, shell='-'),
+            [far.job_id])
+
+    def test_job_counts(self):
+        '''Counts follow adds, modifications and removals in both tiers.'''
+        scheduler._reset_counts()
+        near = self._add(1000, 60)
+        far = self._add(1000, self.days)
+        scheduler.Job(1000, True, '_', '_', job_id=far.job_id)
+        self.assertEqual(scheduler.job_counts(1000),
+                         {'total': 2, 'exact': 1})
+        scheduler.remove_job(1000, far.job_id)
+        scheduler.remove_job(1000, far.job_id)
+        self.assertEqual(scheduler.job_counts(1000),
+                         {'total': 1, 'exact': 0})
+        scheduler.remove_job(1000, near.job_id)
+        self.assertEqual(scheduler.job_counts(1000),
+                         {'total': 0, 'exact': 0})
+
+    def test_list_jobs(self):
+        '''Listing is paged, in run time order across both tiers.'''
+        far = self._add(1000, self.days)
+        near = self._add(1000, 60)
+        mid = self._add(1000, 120, command='backup-home')
+        page, cursor = scheduler.list_jobs(1000, 2)
+        self.assertEqual([job_id for job_id, _ in page],
+                         [near.job_id, mid.job_id])
+        page, cursor = scheduler.list_jobs(1000, 2, cursor)
+        self.assertEqual(([job_id for job_id, _ in page], cursor),
+                         ([far.job_id], None))
+        page, _ = scheduler.list_jobs(1000, 2, sort='id', command='backup')
+        self.assertEqual([job_id for job_id, _ in page], [mid.job_id])
+
+    def test_list_jobs_reads_page_only(self):
+        '''Only the on-disk segments of the jobs listed are read.'''
+        jobs = [self._add(1000, self.days + i * 3600) for i in range(5)]
+        self._add(1000, 60)
+        with mock.patch.object(scheduler.cold_jobs, '_read_segment',
+                               wraps=scheduler.cold_jobs._read_segment) \
+                as read_segment:
+            page, cursor = scheduler.list_jobs(
+                1000, 2, after=self.now + self.days + 3600)
+            self.assertEqual([job_id for job_id, _ in page],
+                             [jobs[1].job_id, jobs[2].job_id])
+            page, cursor = scheduler.list_jobs(
+                1000, 2, cursor, before=self.now + self.days + 3 * 3600)
+            self.assertEqual(([job_id for job_id, _ in page], cursor),
+                             ([jobs[3].job_id], None))
+        self.assertLessEqual(read_segment.call_count, 5)
+
+
+class JournalTest(JobsTestCase):
+    '''Testing the journal, its replay and compaction.'''
+    def setUp(self):
+        super().setUp()
+        self.pickle_file = os.path.join(self.tmp_dir.name, 'hatdb.pkl')
+        self.journal_file = os.path.join(self.tmp_dir.name, 'hatdb.journal')
+        self.journal = scheduler.open_journal(self.journal_file)
+
+    def tearDown(self):
+        self.journal.close()
+        scheduler.journal = None
+        super().tearDown()
+
+    def _reload(self):
+        saved = {euid: dict(jobs)
+                 for euid, jobs in scheduler.enqueued_jobs.items() if jobs}
+        scheduler.load_db(self.pickle_file, self.journal_file)
+        loaded = {euid: dict(jobs)
+                  for euid, jobs in scheduler.enqueued_jobs.items() if jobs}
+        self.assertEqual(loaded, saved)
+
+    def test_replay(self):
+        '''Committed changes are rebuilt from the journal.'''
+        first = self._add(1000, 60)
+        second = self._add(1000, 120)
+        self._add(1000, 180, command='date', job_id=first.job_id)
+        scheduler.remove_job(1000, second.job_id)
+        self.journal.commit()
+        self.assertEqual(self.journal.records, 4)
+        self._reload()
+
+    def test_compaction(self):
+        '''Compaction folds the journal into the snapshot.'''
+        self._add(1000, 60)
+        self._add(1000, 120)
+        scheduler.compact_db(self.pickle_file).join()
+        self.assertTrue(os.path.isfile(self.pickle_file))
+        self.assertFalse(os.path.exists(self.journal.old_file))
+        self.assertEqual(os.path.getsize(self.journal_file), 0)
+        self._add(1000, 180)
+        self.journal.commit()
+        self._reload()
+
+    def test_torn_record(self):
+        '''A partially written record is dropped.'''
+        self._add(1000, 60)
+        self.journal.close()
+        with open(self.journal_file, 'ab') as f:
+            f.write(b'["add", 1000, 9')
+        self.journal = scheduler.open_journal(self.journal_file)
+        self._add(1000, 120)
+        self.journal.commit()
+        self._reload()
+
+    def test_cold_synced_first(self):
+        '''On-disk segments written to are synced before the journal.'''
+        job = self._add(1000, 60)
+        self.journal.commit()
+        synced = []
+
+        def fsync(fd):
+            synced.append(os.path.basename(os.readlink(
+                '/proc/self/fd/{}'.format(fd))))
+        # Moved from memory to disk
+        self._add(1000, 3 * 86400, job_id=job.job_id)
+        with mock.patch.object(os, 'fsync', fsync), \
+                mock.patch.object(self.journal, 'fsync', True):
+            scheduler.commit_db(self.pickle_file)
+        self.assertEqual(len(synced), 3)
+        self.assertTrue(synced[0].endswith('.seg'))
+        self.assertEqual(synced[1:], ['cold', 'hatdb.journal'])
+
+    def test_streamed_load(self):
+        '''Jobs are loaded earliest first, journal changes win over
+        the snapshot, and an old single-pickle snapshot still loads.
+        '''
+        with mock.patch.object(scheduler, 'SNAPSHOT_CHUNK', 2):
+            for delta in (500, 400, 300, 200, 100):
+                self._add(1000, delta)
+            scheduler.compact_db(self.pickle_file).join()
+        first = self._add(1000, 50)
+        scheduler.remove_job(1000, 1)
+        self.journal.commit()
+        steps = scheduler.load_db_steps(self.pickle_file, self.journal_file)
+        # The journal, then the earliest snapshot chunk
+        next(steps)
+        next(steps)
+        self.assertEqual(sorted(scheduler.enqueued_jobs[1000]),
+                         [4, 5, first.job_id])
+        self.assertEqual(scheduler.next_run_at(), self.now + 50)
+        for _ in steps:
+            pass
+        self.assertFalse(scheduler.loading)
+        self.assertEqual(sorted(scheduler.enqueued_jobs[1000]),
+                         [2, 3, 4, 5, first.job_id])
+        with open(self.pickle_file, 'wb') as f:
+            pickle.dump({1000: {7: scheduler.get_job(1000, 4).as_dict()}},
+                        f)
+        scheduler.load_db(self.pickle_file, self.journal_file)
+        self.assertIn(7, scheduler.enqueued_jobs[1000])
+
+    def _reload_cold(self):
+        scheduler.cold_jobs = ColdStore(self.cold_dir)
+        scheduler.load_db(self.pickle_file, self.journal_file)
+
+    def test_promotion_cut_short(self):
+        '''A job promoted, with its segment not deleted yet, is loaded
+        in memory only, and stays removed once removed.
+        '''
+        far = self._add(1000, 3 * 86400)
+        scheduler.commit_db(self.pickle_file)
+        self.assertEqual(scheduler.promote_jobs(self.now + 3 * 86400), 1)
+        scheduler.commit_db(self.pickle_file)
+        self._reload_cold()
+        self.assertIn(far.job_id, scheduler.enqueued_jobs[1000])
+        self.assertNotIn((1000, far.job_id), scheduler.cold_jobs)
+        self.assertEqual(scheduler.job_counts(1000),
+                         {'total': 1, 'exact': 0})
+        scheduler.remove_job(1000, far.job_id)
+        scheduler.commit_db(self.pickle_file)
+        self._reload_cold()
+        self.assertNotIn(far.job_id, scheduler.get_enqueued_jobs(1000))
+
+    def test_move_to_memory_deferred(self):
+        '''A job moved from disk to memory stays on disk till the
+        move is committed.
+        '''
+        job = self._add(1000, 3 * 86400)
+        scheduler.commit_db(self.pickle_file)
+        self._add(1000, 60, job_id=job.job_id)
+        reloaded = ColdStore(self.cold_dir)
+        reloaded.load()
+        self.assertIn((1000, job.job_id), reloaded)
+        scheduler.commit_db(self.pickle_file)
+        reloaded = ColdStore(self.cold_dir)
+        reloaded.load()
+        self.assertNotIn((1000, job.job_id), reloaded)
+        # Moved back before the commit
+        self._add(1000, 3 * 86400, job_id=job.job_id)
+        self._add(1000, 60, job_id=job.job_id)
+        self._add(1000, 3 * 86400, command='date', job_id=job.job_id)
+        scheduler.commit_db(self.pickle_file)
+        self._reload_cold()
+        self.assertNotIn(job.job_id, scheduler.enqueued_jobs[1000])
+        self.assertEqual(
+            scheduler.get_enqueued_jobs(1000)[job.job_id].command, 'date')
+
+
+class SQLiteStoreTest(JobsTestCase):
+    '''Testing the SQLite job store behind the scheduler functions.'''
+    def setUp(self):
+        super().setUp()
+        self.db_file = os.path.join(self.tmp_dir.name, 'hatdb.sqlite')
+        scheduler.job_store = SQLiteJobStore(self.db_file, fsync=False)
+
+    def tearDown(self):
+        scheduler.job_store.close()
+        scheduler.job_store = None
+        super().tearDown()
+
+    def test_jobs(self):
+        '''Adding, modifying, popping and removing jobs.'''
+        first = self._add(1000, 60, command='backup-home')
+        second = self._add(1000, 10)
+        other = self._add(1001, 30)
+        self.assertEqual((first.job_id, second.job_id, other.job_id),
+                         (1, 2, 1))
+        self._add(1000, 20, job_id=second.job_id)
+        self.assertEqual(scheduler.next_run_at(), self.now + 20)
+        due = scheduler.pop_due_jobs(self.now + 30)
+        self.assertEqual([(euid, job_id) for euid, job_id, _ in due],
+                         [(1000, second.job_id), (1001, other.job_id)])
+        # Handed out only once
+        self.assertEqual(scheduler.pop_due_jobs(self.now + 30), [])
+        self.assertEqual(scheduler.next_run_at(), self.now + 60)
+        scheduler.remove_job(1000, second.job_id)
+        scheduler.commit_db()
+        self.assertEqual(set(scheduler.get_enqueued_jobs(1000)),
+                         {first.job_id})
+
+    def test_offline_queries(self):
+        '''Indexed queries through a separate read-only connection.'''
+        self._add(1000, 60, command='backup-home')
+        self._add(1000, 7200, command='backup-etc')
+        self._add(1000, 120, command='true')
+        scheduler.commit_db()
+        store = SQLiteJobStore(self.db_file, readonly=True)
+        self.assertEqual(len(store.due_between(self.now, self.now + 3600)), 2)
+        self.assertEqual(
+            [job.command for _, _, job in
+             store.jobs_matching(1000, '^backup-')],
+            ['backup-home', 'backup-etc'])
+        self.assertEqual(
+            store.match_jobs(1000, 'backup', before=self.now + 3600,
+                             shell='-'),
+            [1])
+        self.assertIsNone(store.oldest_overdue(self.now))
+        self.assertEqual(
+            store.oldest_overdue(self.now + 100)[2].command, 'backup-home')
+        store.close()
+
+    def test_list_jobs(self):
+        '''Listing is paged from the index, in run time order.'''
+        for delta in (60, 30, 90):
+            self._add(1000, delta)
+        self._add(1001, 10)
+        page, cursor = scheduler.list_jobs(1000, 2)
+        self.assertEqual([job_id for job_id, _ in page], [2, 1])
+        self.assertEqual(cursor, [self.now + 60, 1])
+        page, cursor = scheduler.list_jobs(1000, 2, cursor)
+        self.assertEqual(([job_id for job_id, _ in page], cursor), ([3], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
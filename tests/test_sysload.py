@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the system load readings -- `lib/sysload.py`
+
+import os
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib import sysload
+
+
+class SysLoadTest(unittest.TestCase):
+    '''Testing the load checks, on made up /proc files.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.loadavg_file = os.path.join(self.tmp_dir.name, 'loadavg')
+        self.pressure_file = os.path.join(self.tmp_dir.name, 'cpu')
+        for name, value in (('LOADAVG_FILE', self.loadavg_file),
+                            ('CPU_PRESSURE_FILE', self.pressure_file)):
+            patcher = mock.patch.object(sysload, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(sysload.os, 'cpu_count', lambda: 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, file_path, content):
+        with open(file_path, 'w') as f:
+            f.write(content)
+
+    def test_pressure_preferred(self):
+        '''CPU pressure decides when available, whatever the load.'''
+        self._write(self.loadavg_file, '8.00 4.00 2.00 9/300 1234\n')
+        self._write(self.pressure_file,
+                    'some avg10=12.50 avg60=3.00 avg300=1.00 total=100\n'
+                    'full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n')
+        self.assertEqual(sysload.cpu_pressure(), 12.5)
+        self.assertTrue(sysload.is_loaded(0.8, 10.0))
+        self.assertFalse(sysload.is_loaded(0.8, 20.0))
+
+    def test_loadavg_fallback(self):
+        '''Without PSI, the load average per CPU decides.'''
+        self._write(self.loadavg_file, '3.00 1.00 0.50 2/300 1234\n')
+        self.assertIsNone(sysload.cpu_pressure())
+        self.assertEqual(sysload.loadavg_per_cpu(), 0.75)
+        self.assertFalse(sysload.is_loaded(0.8, 10.0))
+        self.assertTrue(sysload.is_loaded(0.7, 10.0))
+        self._write(self.pressure_file, 'garbage\n')
+        self.assertIsNone(sysload.cpu_pressure())
+
+    def test_spare_capacity(self):
+        '''A job per CPU left under the limit, at least one.'''
+        self._write(self.loadavg_file, '1.00 1.00 1.00 2/300 1234\n')
+        self.assertEqual(sysload.spare_capacity(0.8, 10.0), 2)
+        self._write(self.loadavg_file, '3.00 1.00 1.00 2/300 1234\n')
+        self.assertEqual(sysload.spare_capacity(0.8, 10.0), 1)
+        self._write(self.loadavg_file, '4.00 1.00 1.00 2/300 1234\n')
+        self.assertEqual(sysload.spare_capacity(0.8, 10.0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
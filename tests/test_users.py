@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the user lookup -- `lib/users.py`
+
+import os
+import pwd
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib import users
+
+
+class UserCacheTest(unittest.TestCase):
+    '''Testing the cached EUID -> (name, home) lookup.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.passwd_file = os.path.join(self.tmp_dir.name, 'passwd')
+        with open(self.passwd_file, 'w') as f:
+            f.write('')
+        self.cache = users.UserCache(ttl=60, passwd_file=self.passwd_file)
+        self.entries = {1000: ('alice', '/home/alice')}
+        patcher = mock.patch.object(users.pwd, 'getpwuid',
+                                    side_effect=self._getpwuid)
+        self.getpwuid = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _getpwuid(self, euid):
+        name, home = self.entries[euid]
+        return pwd.struct_passwd((name, 'x', euid, euid, '', home,
+                                  '/bin/sh'))
+
+    def test_cached_till_passwd_changes(self):
+        self.assertEqual(self.cache.lookup(1000), ('alice', '/home/alice'))
+        self.entries[1000] = ('bob', '/srv/bob')
+        self.assertEqual(self.cache.lookup(1000), ('alice', '/home/alice'))
+        self.assertEqual(self.getpwuid.call_count, 1)
+        os.utime(self.passwd_file, ns=(0, 0))
+        self.assertEqual(self.cache.lookup(1000), ('bob', '/srv/bob'))
+        with self.assertRaises(KeyError):
+            self.cache.lookup(1001)
+
+    def test_ttl(self):
+        with mock.patch.object(users.time, 'monotonic', return_value=0):
+            self.cache.lookup(1000)
+        self.entries[1000] = ('bob', '/srv/bob')
+        with mock.patch.object(users.time, 'monotonic', return_value=61):
+            self.assertEqual(self.cache.lookup(1000), ('bob', '/srv/bob'))
+
+
+if __name__ == '__main__':
+    unittest.main()
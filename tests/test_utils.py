@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Test case(s) for the utilities -- `lib/utils.py`
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+# Inserting the dir in `sys.path` at index 0
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'hat'))
+
+from lib import utils
+from lib.utils import FifoReader, FLock
+
+
+class FifoReaderTest(unittest.TestCase):
+    '''Testing the waits and reads on a FIFO.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fifo = os.path.join(self.tmp_dir.name, 'runner_in.fifo')
+        os.mkfifo(self.fifo)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write_later(self, data, delay=0.1):
+        def write():
+            time.sleep(delay)
+            fd = os.open(self.fifo, os.O_WRONLY)
+            os.write(fd, data)
+            os.close(fd)
+        writer = threading.Thread(target=write)
+        writer.start()
+        self.addCleanup(writer.join)
+
+    def test_timeout(self):
+        '''Without input, the wait ends at the timeout, not before.'''
+        with FifoReader(self.fifo) as reader:
+            started = time.monotonic()
+            self.assertFalse(reader.wait(0.2))
+            self.assertGreaterEqual(time.monotonic() - started, 0.2)
+            self.assertEqual(reader.readlines(), [])
+
+    def test_write_wakes(self):
+        '''A write ends the wait; a partial line is kept for later.'''
+        with FifoReader(self.fifo) as reader:
+            self._write_later(b'{"stats": true}\n\n{"stop"')
+            started = time.monotonic()
+            self.assertTrue(reader.wait(10))
+            self.assertLess(time.monotonic() - started, 5)
+            self.assertEqual(reader.readlines(), ['{"stats": true}'])
+            self._write_later(b': true}\n', 0)
+            self.assertTrue(reader.wait(10))
+            self.assertEqual(reader.readlines(), ['{"stop": true}'])
+
+    def test_other_fds(self):
+        '''Other fds end the wait too, with no input.'''
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        os.write(write_fd, b'x')
+        with FifoReader(self.fifo) as reader:
+            started = time.monotonic()
+            self.assertFalse(reader.wait(10, [read_fd]))
+            self.assertLess(time.monotonic() - started, 5)
+
+
+class FLockTest(unittest.TestCase):
+    '''Testing the blocking file locks, across processes.'''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(utils, 'LOCK_DIR', self.tmp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def _take(prefix, conn):
+        with FLock(prefix):
+            conn.send(time.monotonic())
+
+    def test_blocks_till_released(self):
+        '''Another process gets the lock only once it's released.'''
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        with FLock('/var/log/hatd/daemon.log'):
+            other = multiprocessing.Process(
+                target=self._take, args=('/var/log/hatd/daemon.log', sender))
+            other.start()
+            self.assertFalse(receiver.poll(0.5))
+            released = time.monotonic()
+        self.assertTrue(receiver.poll(10))
+        self.assertGreaterEqual(receiver.recv(), released)
+        other.join()
+        self.assertEqual(os.listdir(self.tmp_dir.name),
+                         ['.__var_log_hatd_daemon.log.lock'])
+
+
+if __name__ == '__main__':
+    unittest.main()